@@ -0,0 +1,202 @@
+#
+# alarms.py
+#
+# Keeps track of the aircraft that set off the alarm zone, and decides when
+# each one is done and should be tweeted.
+#
+
+# The states an alarm goes through:
+ENTERING = 'entering'   # the aircraft just entered the zone
+INSIDE = 'inside'       # it is still in the zone
+EXITING = 'exiting'     # it left the zone, counting down updates
+FIRED = 'fired'         # the countdown ran out, time to tweet
+
+
+class Alarm(object):
+    '''
+    One aircraft that entered an alarm zone: the zone, its state, the data
+    at its closest position so far (relative to the zone), the countdown
+    since it left the zone, and whatever the enrich hook attached to it
+    (e.g. a FlightAware lookup).
+    '''
+    __slots__ = ('hex', 'zone', 'state', 'closest', 'countdown', 'enrichment')
+
+    def __init__(self, zone, closest, enrichment=None):
+        self.hex = closest.hex
+        self.zone = zone
+        self.state = ENTERING
+        self.closest = closest
+        self.countdown = 0
+        self.enrichment = enrichment
+
+    def __str__(self):
+        return '<{} {} {} countdown={}>'.format(
+            self.__class__.__name__,
+            self.closest,
+            self.state,
+            self.countdown)
+
+
+class AlarmTracker(object):
+    '''
+    The alarm state machine.  Feed it every snapshot with update(); it
+    returns the alarms that fired.  An aircraft's alarm goes
+        ENTERING -> INSIDE -> EXITING -> FIRED
+    and goes back from EXITING to INSIDE if the aircraft returns to the
+    zone before `wait_x_updates` updates went by.
+
+    Everything is kept in dicts keyed by hex, so each transition costs O(1)
+    and an update costs O(aircraft that moved + alarms).
+
+    enrich, if given, is called with the aircraft data when it enters the
+    zone (and again on later updates while it returned None), and its
+    result is kept as the alarm's enrichment.
+
+    `changes` counts the changes to the alarms, so a checkpoint of them
+    only needs to be written when it moved.
+    '''
+    def __init__(self, zone, wait_x_updates, enrich=None):
+        self.zone = zone
+        self.wait_x_updates = wait_x_updates
+        self.enrich = enrich
+        self.alarms = dict()    # hex -> Alarm, every aircraft being tracked
+        self.inside = dict()    # hex -> aircraft data, the aircraft inside the zone now
+        self.changes = 0
+
+    def __len__(self):
+        return len(self.alarms)
+
+    def __contains__(self, dhex):
+        return dhex in self.alarms
+
+    def get(self, dhex):
+        return self.alarms.get(dhex)
+
+    def update(self, snapshot, candidates=None):
+        '''
+        update()
+        Evaluates the aircraft that moved in the snapshot, or only the given
+        candidates among them, and advances every alarm.  Returns a list of
+        the alarms that fired.
+        '''
+        # the aircraft that didn't move stay in (or out of) the zone
+        unchanged = snapshot.delta.unchanged
+        self.inside = {h: snapshot[h] for h in self.inside if h in unchanged}
+
+        moved = snapshot.delta.moved
+        for dhex in (moved if candidates is None else candidates):
+            a = snapshot[dhex]
+            # if they don't have lat/lon or a heading skip them
+            if a.lat is None or a.lon is None or a.track is None:
+                continue
+            if self.zone.contains(a):
+                self.inside[dhex] = a
+                self.entered(a)
+
+        fired = []
+        for dhex, alarm in list(self.alarms.items()):
+            if dhex in self.inside:
+                if alarm.state == ENTERING and dhex not in moved:
+                    alarm.state = INSIDE
+                    self.changes += 1
+                continue
+            self.changes += 1
+            if alarm.countdown < self.wait_x_updates:
+                alarm.state = EXITING
+                alarm.countdown += 1
+            else:
+                alarm.state = FIRED
+                del self.alarms[dhex]
+                fired.append(alarm)
+        return fired
+
+    def entered(self, a):
+        alarm = self.alarms.get(a.hex)
+        if alarm is None:
+            enrichment = self.enrich(a) if self.enrich else None
+            self.alarms[a.hex] = Alarm(self.zone, self.zone.locate(a), enrichment)
+            self.changes += 1
+            return
+        if alarm.state in (ENTERING, EXITING):
+            alarm.state = INSIDE
+            alarm.countdown = 0
+            self.changes += 1
+        if alarm.enrichment is None and self.enrich:
+            # e.g. the flight name may only show up after it entered the zone
+            alarm.enrichment = self.enrich(a)
+        if self.zone.geometry(a)[0] < alarm.closest.distance:
+            alarm.closest = self.zone.locate(a)
+            self.changes += 1
+
+    def restore(self, closest, state, countdown):
+        '''
+        restore()
+        Brings back the alarm of an aircraft from a checkpoint, its
+        enrichment is started again.
+        '''
+        enrichment = self.enrich(closest) if self.enrich else None
+        alarm = Alarm(self.zone, closest, enrichment)
+        alarm.state = state
+        alarm.countdown = countdown
+        self.alarms[alarm.hex] = alarm
+        self.changes += 1
+        return alarm
+
+
+class ZoneAlarms(object):
+    '''
+    An AlarmTracker for each zone of a zones.ZoneIndex.  Every aircraft
+    that moved is only evaluated by the trackers of the zones near it, so
+    an update costs about the same however many zones there are.
+    '''
+    def __init__(self, index, wait_x_updates, enrich=None):
+        self.index = index
+        self.trackers = dict()  # zone -> AlarmTracker
+        for zone in index:
+            self.trackers[zone] = AlarmTracker(zone, wait_x_updates, enrich)
+
+    def __len__(self):
+        return sum(len(tracker) for tracker in self.trackers.values())
+
+    @property
+    def changes(self):
+        return sum(tracker.changes for tracker in self.trackers.values())
+
+    def alarms(self):
+        '''
+        alarms()
+        Yields every alarm being tracked.
+        '''
+        for tracker in self.trackers.values():
+            for alarm in tracker.alarms.values():
+                yield alarm
+
+    def inside(self):
+        '''
+        inside()
+        Yields (zone, aircraft) for every aircraft inside a zone now.
+        '''
+        for zone, tracker in self.trackers.items():
+            for a in tracker.inside.values():
+                yield zone, a
+
+    def update(self, snapshot):
+        '''
+        update()
+        Evaluates the aircraft that moved against the zones near them and
+        advances every alarm.  Returns a list of the alarms that fired.
+        '''
+        candidates = dict()     # zone -> hexes to evaluate
+        for dhex in snapshot.delta.moved:
+            a = snapshot[dhex]
+            if a.lat is None or a.lon is None or a.track is None:
+                continue
+            for zone in self.index.nearby(a.lat, a.lon, a.altitude):
+                candidates.setdefault(zone, []).append(dhex)
+
+        fired = []
+        for zone, tracker in self.trackers.items():
+            hexes = candidates.get(zone, ())
+            if hexes or tracker.alarms or tracker.inside:
+                fired.extend(tracker.update(snapshot, hexes))
+        return fired
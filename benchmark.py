@@ -0,0 +1,253 @@
+#
+# benchmark.py
+#
+# Measures how fast a refresh is processed: decoding the payload, parsing it
+# into a snapshot, the geometry (with and without the alarm zone
+# pre-filter) and the alarm evaluation, on synthetic loads of aircraft
+# around the receiver.  Every aircraft moves between refreshes, the worst
+# case.
+#
+# Usage:
+#     python benchmark.py [--loads 50,500,5000] [--refreshes 20] [--driver dump1090] [--json]
+#                         [--receiver lat,lon]
+#     python benchmark.py --imports
+#
+# --json runs the benchmark once with each JSON decoder that is installed.
+# --imports measures instead how long each module takes to import, each in
+# a fresh interpreter, and which of the heavy dependencies it pulls in.
+# No config.ini is needed, the aircraft are around Tustin unless
+# --receiver says otherwise.
+#
+
+import argparse
+import json
+import math
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import alarms
+import fastjson
+import flightdata
+import zones
+
+DRIVERS = ('dump1090', 'virtualradarserver')
+
+# The receiver the synthetic aircraft fly around.
+DEFAULT_RECEIVER = (33.7458, -117.8262)
+
+# The modules timed by --imports, the tracker last.
+IMPORT_MODULES = ('config', 'metrics', 'fastjson', 'geomath', 'flightdata', 'zones', 'alarms',
+                  'messages', 'sinks', 'fa_api', 'stream', 'screenshot', 'maprender',
+                  'datasource', 'tracker')
+
+# The dependencies that are slow to import, and only wanted when their
+# feature is enabled.
+HEAVY_MODULES = ('numpy', 'requests', 'selenium', 'PIL', 'twitter', 'http.server', 'http.client')
+
+
+def synthetic_aircraft(count, receiver, seed=1):
+    '''
+    synthetic_aircraft()
+    count aircraft within about a hundred miles of the receiver, one in ten
+    without a position.
+    '''
+    rng = random.Random(seed)
+    aircraft = []
+    for i in range(count):
+        a = {
+            'hex': '{:06x}'.format(0xa00000 + i),
+            'flight': 'TST{}'.format(i),
+            'squawk': '{:04d}'.format(rng.randint(0, 7777)),
+            'messages': rng.randint(1, 10000),
+            'seen': rng.random() * 5,
+            'rssi': rng.uniform(-30, -3),
+            'speed': rng.randint(100, 500),
+            'track': rng.uniform(0, 360),
+            'vert_rate': rng.choice((-1024, 0, 0, 1024)),
+        }
+        if i % 10:
+            a.update(
+                lat=receiver[0] + rng.uniform(-1.5, 1.5),
+                lon=receiver[1] + rng.uniform(-1.5, 1.5),
+                altitude=rng.randint(0, 40000),
+                seen_pos=rng.random())
+        aircraft.append(a)
+    return aircraft
+
+
+def advance(aircraft, seconds):
+    '''
+    advance()
+    Moves every aircraft with a position along its track.
+    '''
+    for a in aircraft:
+        if 'lat' not in a:
+            continue
+        miles = a['speed'] * 1.15078 * seconds / 3600.0
+        track = math.radians(a['track'])
+        a['lat'] += miles * math.cos(track) / zones.MILES_PER_DEGREE
+        a['lon'] += miles * math.sin(track) / (zones.MILES_PER_DEGREE * math.cos(math.radians(a['lat'])))
+        a['altitude'] = max(0, a['altitude'] + int(a['vert_rate'] * seconds / 60.0))
+
+
+def dump1090_payload(aircraft, now):
+    return json.dumps({'now': now, 'messages': len(aircraft), 'aircraft': aircraft}).encode()
+
+
+def vrs_payload(aircraft, now):
+    acList = []
+    for a in aircraft:
+        v = {
+            'Icao': a['hex'],
+            'Call': a['flight'],
+            'Sqk': a['squawk'],
+            'CMsgs': a['messages'],
+            'Spd': a['speed'],
+            'Trak': a['track'],
+            'Vsi': a['vert_rate'],
+            'Sig': int(255 * (10 ** (a['rssi'] / 10.0))),
+        }
+        if 'lat' in a:
+            v.update(Lat=a['lat'], Long=a['lon'], Alt=a['altitude'], PosTime=int((now - a['seen_pos']) * 1000))
+        acList.append(v)
+    return json.dumps({'stm': int(now * 1000), 'acList': acList}).encode()
+
+
+PAYLOADS = {
+    'dump1090': (dump1090_payload, flightdata.Dump1090DataParser),
+    'virtualradarserver': (vrs_payload, flightdata.VRSDataParser),
+}
+
+
+def benchmark(count, refreshes=20, driver='dump1090', loads=fastjson.loads, origin=DEFAULT_RECEIVER):
+    '''
+    benchmark()
+    Processes `refreshes` synthetic refreshes of count aircraft around the
+    origin, decoding them with loads.  Returns the average seconds per
+    refresh of each stage.
+    '''
+    make_payload, parser_class = PAYLOADS[driver]
+    parser = parser_class()
+    zone = zones.AlarmZone(origin[0], origin[1], 5, 30)
+    tracker = alarms.AlarmTracker(zone, 5)
+    aircraft = synthetic_aircraft(count, origin)
+    now = time.time()
+
+    # build the payloads up front so their encoding isn't measured
+    payloads = []
+    for i in range(refreshes + 1):
+        payloads.append(make_payload(aircraft, now + i))
+        advance(aircraft, 1.0)
+
+    stages = ('decode', 'parse', 'geometry', 'prefiltered', 'alarms')
+    totals = dict.fromkeys(stages, 0.0)
+    previous = None
+    for i, raw_data in enumerate(payloads):
+        t0 = time.perf_counter()
+        json_data = loads(raw_data)
+        t1 = time.perf_counter()
+        snapshot = flightdata.AircraftSnapshot(datetime.fromtimestamp(parser.time(json_data)))
+        parser.parse_aircraft(json_data, snapshot)
+        snapshot.diff(previous)
+        t2 = time.perf_counter()
+        snapshot.locate(origin, previous, zone)
+        t3 = time.perf_counter()
+        snapshot.locate(origin, previous)
+        t4 = time.perf_counter()
+        tracker.update(snapshot)
+        t5 = time.perf_counter()
+        previous = snapshot
+        if i == 0:
+            # the first refresh has nothing to diff against, don't count it
+            continue
+        totals['decode'] += t1 - t0
+        totals['parse'] += t2 - t1
+        totals['prefiltered'] += t3 - t2
+        totals['geometry'] += t4 - t3
+        totals['alarms'] += t5 - t4
+    return {stage: total / refreshes for stage, total in totals.items()}
+
+
+def report(counts, refreshes=20, driver='dump1090', backend=fastjson.BACKEND, origin=DEFAULT_RECEIVER):
+    loads = fastjson.BACKENDS[backend]
+    print("{} payloads decoded with {}, {} refreshes per load, ms per refresh:".format(driver, backend, refreshes))
+    print("| aircraft |  decode |   parse | geometry | prefiltered |  alarms |   total | aircraft/s |")
+    print("|----------+---------+---------+----------+-------------+---------+---------+------------|")
+    for count in counts:
+        r = benchmark(count, refreshes, driver, loads, origin)
+        # a refresh is decode, parse, the pre-filtered geometry and alarms
+        total = r['decode'] + r['parse'] + r['prefiltered'] + r['alarms']
+        print("| {:>8} | {:>7.2f} | {:>7.2f} | {:>8.2f} | {:>11.2f} | {:>7.2f} | {:>7.2f} | {:>10.0f} |".format(
+            count,
+            r['decode'] * 1000,
+            r['parse'] * 1000,
+            r['geometry'] * 1000,
+            r['prefiltered'] * 1000,
+            r['alarms'] * 1000,
+            total * 1000,
+            count / total))
+
+
+def import_time(module):
+    '''
+    import_time()
+    Imports module in a fresh interpreter.  Returns the seconds the import
+    took, the seconds the whole interpreter took and the heavy modules
+    that were imported.
+    '''
+    code = 'import sys, {}; print(" ".join(m for m in {!r} if m in sys.modules))'.format(
+        module, HEAVY_MODULES)
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    seconds = 0.0
+    for line in result.stderr.splitlines():
+        # import time: <self us> | <cumulative us> | <module>
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            seconds = int(fields[1]) / 1e6
+    return seconds, elapsed, result.stdout.split()
+
+
+def report_imports(modules=IMPORT_MODULES):
+    print("ms to import each module in a fresh interpreter:")
+    print("| module       |  import | process | heavy dependencies imported")
+    print("|--------------+---------+---------+----------------------------")
+    for module in modules:
+        try:
+            seconds, elapsed, heavy = import_time(module)
+        except RuntimeError as e:
+            print("| {:<12} | failed: {}".format(module, e))
+            continue
+        print("| {:<12} | {:>7.1f} | {:>7.1f} | {}".format(
+            module, seconds * 1000, elapsed * 1000, ', '.join(heavy)))
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description='Benchmarks the processing of a refresh.')
+    argparser.add_argument('--loads', default='50,200,1000,5000',
+                           help='comma separated numbers of aircraft')
+    argparser.add_argument('--refreshes', type=int, default=20,
+                           help='refreshes measured per load')
+    argparser.add_argument('--driver', default='dump1090', choices=DRIVERS)
+    argparser.add_argument('--receiver', default='{},{}'.format(*DEFAULT_RECEIVER),
+                           help='lat,lon the aircraft fly around')
+    argparser.add_argument('--json', action='store_true',
+                           help='compare every JSON decoder installed')
+    argparser.add_argument('--imports', action='store_true',
+                           help='measure the import time of each module instead')
+    args = argparser.parse_args()
+    if args.imports:
+        report_imports()
+        sys.exit(0)
+    counts = [int(n) for n in args.loads.split(',')]
+    origin = tuple(float(x) for x in args.receiver.split(','))
+    backends = fastjson.BACKENDS.keys() if args.json else [fastjson.BACKEND]
+    for backend in backends:
+        report(counts, args.refreshes, args.driver, backend, origin)
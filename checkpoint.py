@@ -0,0 +1,164 @@
+#
+# checkpoint.py
+#
+# Saves the alarms in progress, and the finished ones still waiting to be
+# tweeted, to a file, so the tracker can be restarted (or crash) at any
+# moment without losing an aircraft in the middle of its pass.
+#
+# The file is JSON, written to a temporary file and renamed over the old
+# one, so it is always either the previous or the new checkpoint, never
+# half of one.  It is only written when the alarms changed.
+#
+
+import json
+import os
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from datetime import datetime
+
+import flightdata
+
+VERSION = 1
+
+
+def aircraft_to_dict(a):
+    d = {name: getattr(a, name) for name in flightdata.AIRCRAFT_FIELDS}
+    d['time'] = a.time.timestamp()
+    return d
+
+
+def aircraft_from_dict(d):
+    values = [d.get(name) for name in flightdata.AIRCRAFT_FIELDS]
+    return flightdata.AirCraftData(*values, time=datetime.fromtimestamp(d['time']))
+
+
+class Checkpoint(object):
+    '''
+    Keeps the checkpoint of a ZoneAlarms in filename.  save() is called
+    after every update and writes at most every min_interval seconds, and
+    only if something changed.  The finished alarms handed to the
+    notification workers are kept in it from fired() until done().
+    A checkpoint older than max_age seconds isn't restored, those aircraft
+    are long gone.
+    '''
+    def __init__(self, filename, min_interval=1.0, max_age=600.0):
+        self.filename = filename
+        self.min_interval = min_interval
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.pending = OrderedDict()    # key -> (aircraft data, zone) fired but not yet tweeted
+        self.pending_changes = 0
+        self.next_key = 0
+        self.saved = None               # what had changed when last written
+        self.last_write = 0.0
+        self.writes = 0
+
+    def fired(self, closest, zone):
+        '''
+        fired()
+        Keeps a finished alarm until done() is called with the key returned.
+        '''
+        with self.lock:
+            key = self.next_key
+            self.next_key += 1
+            self.pending[key] = (closest, zone)
+            self.pending_changes += 1
+            return key
+
+    def done(self, key):
+        with self.lock:
+            if self.pending.pop(key, None) is not None:
+                self.pending_changes += 1
+
+    def save(self, zone_alarms, force=False):
+        '''
+        save()
+        Writes the checkpoint if the alarms changed since it was last
+        written.  Returns True if it was written.
+        '''
+        changes = (zone_alarms.changes, self.pending_changes)
+        if changes == self.saved:
+            return False
+        now = time.monotonic()
+        if not force and now - self.last_write < self.min_interval:
+            # written soon after, at the next save() past the interval
+            return False
+        state = {'version': VERSION, 'time': time.time(), 'alarms': [], 'pending': []}
+        for alarm in zone_alarms.alarms():
+            state['alarms'].append({
+                'zone': alarm.zone.name,
+                'state': alarm.state,
+                'countdown': alarm.countdown,
+                'closest': aircraft_to_dict(alarm.closest)})
+        with self.lock:
+            for closest, zone in self.pending.values():
+                state['pending'].append({'zone': zone.name, 'closest': aircraft_to_dict(closest)})
+        try:
+            self.write(state)
+        except (OSError, ValueError) as e:
+            print("could not write the checkpoint {}: {}".format(self.filename, e))
+            return False
+        self.saved = changes
+        self.last_write = now
+        self.writes += 1
+        return True
+
+    def write(self, state):
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.filename)
+
+    def load(self):
+        '''
+        load()
+        The saved state, or None if there is none worth restoring.
+        '''
+        try:
+            with open(self.filename) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print("could not read the checkpoint {}: {}".format(self.filename, e))
+            return None
+        if state.get('version') != VERSION:
+            return None
+        age = time.time() - state['time']
+        if age > self.max_age:
+            print("the checkpoint is {:.0f}s old, not restoring it".format(age))
+            return None
+        return state
+
+    def restore(self, zone_alarms):
+        '''
+        restore()
+        Brings the alarms of the checkpoint back into zone_alarms.  Returns
+        the (aircraft data, zone) of the finished alarms that were not
+        tweeted yet, to hand to the workers again with fired().
+        '''
+        state = self.load()
+        if state is None:
+            return []
+        zones = {zone.name: zone for zone in zone_alarms.trackers}
+        pending = []
+        try:
+            for saved in state['alarms']:
+                zone = zones.get(saved['zone'])
+                if zone is None:
+                    continue
+                alarm = zone_alarms.trackers[zone].restore(
+                    aircraft_from_dict(saved['closest']), saved['state'], saved['countdown'])
+                print("restored {}".format(alarm))
+            for saved in state['pending']:
+                zone = zones.get(saved['zone'])
+                if zone is not None:
+                    pending.append((aircraft_from_dict(saved['closest']), zone))
+        except (KeyError, TypeError, ValueError):
+            print("could not restore the checkpoint {}:".format(self.filename))
+            traceback.print_exc()
+        return pending
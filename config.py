@@ -0,0 +1,193 @@
+#
+# config.py
+#
+# The configuration of this application.  config.ini is parsed once by
+# load(), and the settings the modules need are read from it into a
+# Settings, which the tracker hands to the objects it builds.  No module
+# reads the configuration when it is imported.  Set ABOVETUSTIN_CONFIG to
+# read another file, a recording's configuration for instance.
+#
+
+import os
+from configparser import ConfigParser
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+FILENAME = os.environ.get('ABOVETUSTIN_CONFIG', 'config.ini')
+
+_loaded = dict()    # filename -> ConfigParser
+
+
+def load(filename=FILENAME):
+    '''
+    load()
+    The configuration in filename, parsed the first time it is asked for.
+    '''
+    config = _loaded.get(filename)
+    if config is None:
+        config = ConfigParser()
+        config.read(filename)
+        _loaded[filename] = config
+    return config
+
+
+@dataclass(frozen=True)
+class Settings:
+    '''
+    The settings of the [receiver], [abovetustin], [flightaware] and [crop]
+    sections, typed and with their defaults filled in; see
+    config.sample.ini for what each does.  The sections that describe
+    several things ([zone:*], [sink:*], [hashtags]) are read by the
+    from_config() of zones, sinks and messages instead.
+    '''
+    # [receiver]
+    latitude: float
+    longitude: float
+
+    # [abovetustin], the ones without a default
+    data_url: str
+    map_url: str
+    request_timeout: float
+    distance_alarm: float
+    elevation_alarm: float
+    wait_x_updates: int
+    sleep_time: float
+    image_width: int
+    image_height: int
+
+    # the data source
+    driver: str = 'dump1090'
+    data_timeout: float = 5.0
+    record_file: str = ''
+    replay_file: str = ''
+    replay_speed: float = 1.0
+
+    # polling and alarms
+    max_sleep_time: Optional[float] = None      # sleep_time if None
+    track_history_size: int = 64
+    track_stale_time: float = 300.0
+    notify_workers: int = 2
+    notify_queue_size: int = 16
+    notify_drop_policy: str = 'oldest'
+    sightings_db: str = ''
+    sightings_snapshot_every: int = 0
+    sightings_flush_interval: float = 5.0
+    checkpoint_file: str = ''
+    checkpoint_interval: float = 1.0
+    checkpoint_max_age: float = 600.0
+
+    # the browser
+    chromedriver: str = 'chromedriver'
+    chrome_binary: str = ''
+    browser_pool_size: int = 1
+    browser_max_memory_mb: float = 300.0
+    browser_recycle_interval: float = 60.0
+    select_timeout: float = 5.0
+    crop: Optional[Tuple[int, int, int, int]] = None    # x, y, width, height
+
+    # the maps drawn from tiles
+    tile_url: str = 'https://tile.openstreetmap.org/{z}/{x}/{y}.png'
+    tile_zoom: int = 12
+    tile_cache_dir: str = 'tiles'
+    track_length: int = 120
+
+    # metrics
+    metrics_port: int = 0
+    metrics_address: str = '127.0.0.1'
+
+    # [flightaware]
+    fa_enable: bool = False
+    fa_username: str = ''
+    fa_api_key: str = ''
+    fa_cache_size: int = 256
+    fa_cache_ttl: float = 1800.0
+    fa_negative_ttl: float = 600.0
+    fa_cache_file: str = ''
+    fa_timeout: float = 10.0
+    fa_connect_timeout: float = 5.0
+    fa_read_timeout: float = 15.0
+    fa_retries: int = 3
+    fa_rate_limit: float = 0.0
+
+    @property
+    def receiver(self):
+        return (self.latitude, self.longitude)
+
+    @classmethod
+    def from_parser(cls, parser):
+        '''
+        from_parser()
+        The settings of a parsed configuration.  Raises the parser's errors
+        if a setting without a default is missing or isn't a number.
+        '''
+        a = 'abovetustin'
+        fa = 'flightaware'
+        crop = None
+        if parser.has_section('crop') and parser.getboolean('crop', 'do_crop'):
+            crop = tuple(parser.getint('crop', name) for name in ('crop_x', 'crop_y', 'crop_width', 'crop_height'))
+        sleep_time = parser.getfloat(a, 'sleep_time')
+        return cls(
+            latitude=parser.getfloat('receiver', 'latitude'),
+            longitude=parser.getfloat('receiver', 'longitude'),
+            data_url=parser.get(a, 'data_url'),
+            map_url=parser.get(a, 'map_url'),
+            request_timeout=parser.getfloat(a, 'request_timeout'),
+            distance_alarm=parser.getfloat(a, 'distance_alarm'),
+            elevation_alarm=parser.getfloat(a, 'elevation_alarm'),
+            wait_x_updates=parser.getint(a, 'wait_x_updates'),
+            sleep_time=sleep_time,
+            image_width=parser.getint(a, 'image_width'),
+            image_height=parser.getint(a, 'image_height'),
+            driver=parser.get(a, 'driver', fallback=cls.driver),
+            data_timeout=parser.getfloat(a, 'data_timeout', fallback=cls.data_timeout),
+            record_file=parser.get(a, 'record_file', fallback=cls.record_file),
+            replay_file=parser.get(a, 'replay_file', fallback=cls.replay_file),
+            replay_speed=parser.getfloat(a, 'replay_speed', fallback=cls.replay_speed),
+            max_sleep_time=parser.getfloat(a, 'max_sleep_time', fallback=sleep_time),
+            track_history_size=parser.getint(a, 'track_history_size', fallback=cls.track_history_size),
+            track_stale_time=parser.getfloat(a, 'track_stale_time', fallback=cls.track_stale_time),
+            notify_workers=parser.getint(a, 'notify_workers', fallback=cls.notify_workers),
+            notify_queue_size=parser.getint(a, 'notify_queue_size', fallback=cls.notify_queue_size),
+            notify_drop_policy=parser.get(a, 'notify_drop_policy', fallback=cls.notify_drop_policy),
+            sightings_db=parser.get(a, 'sightings_db', fallback=cls.sightings_db),
+            sightings_snapshot_every=parser.getint(a, 'sightings_snapshot_every',
+                                                   fallback=cls.sightings_snapshot_every),
+            sightings_flush_interval=parser.getfloat(a, 'sightings_flush_interval',
+                                                     fallback=cls.sightings_flush_interval),
+            checkpoint_file=parser.get(a, 'checkpoint_file', fallback=cls.checkpoint_file),
+            checkpoint_interval=parser.getfloat(a, 'checkpoint_interval', fallback=cls.checkpoint_interval),
+            checkpoint_max_age=parser.getfloat(a, 'checkpoint_max_age', fallback=cls.checkpoint_max_age),
+            chromedriver=parser.get(a, 'chromedriver', fallback=cls.chromedriver),
+            chrome_binary=parser.get(a, 'chrome_binary', fallback=cls.chrome_binary),
+            browser_pool_size=parser.getint(a, 'browser_pool_size', fallback=cls.browser_pool_size),
+            browser_max_memory_mb=parser.getfloat(a, 'browser_max_memory_mb', fallback=cls.browser_max_memory_mb),
+            browser_recycle_interval=parser.getfloat(a, 'browser_recycle_interval',
+                                                     fallback=cls.browser_recycle_interval),
+            select_timeout=parser.getfloat(a, 'select_timeout', fallback=cls.select_timeout),
+            crop=crop,
+            tile_url=parser.get(a, 'tile_url', fallback=cls.tile_url),
+            tile_zoom=parser.getint(a, 'tile_zoom', fallback=cls.tile_zoom),
+            tile_cache_dir=parser.get(a, 'tile_cache_dir', fallback=cls.tile_cache_dir),
+            track_length=parser.getint(a, 'track_length', fallback=cls.track_length),
+            metrics_port=parser.getint(a, 'metrics_port', fallback=cls.metrics_port),
+            metrics_address=parser.get(a, 'metrics_address', fallback=cls.metrics_address),
+            fa_enable=parser.getboolean(fa, 'fa_enable', fallback=cls.fa_enable),
+            fa_username=parser.get(fa, 'fa_username', fallback=cls.fa_username),
+            fa_api_key=parser.get(fa, 'fa_api_key', fallback=cls.fa_api_key),
+            fa_cache_size=parser.getint(fa, 'fa_cache_size', fallback=cls.fa_cache_size),
+            fa_cache_ttl=parser.getfloat(fa, 'fa_cache_ttl', fallback=cls.fa_cache_ttl),
+            fa_negative_ttl=parser.getfloat(fa, 'fa_negative_ttl', fallback=cls.fa_negative_ttl),
+            fa_cache_file=parser.get(fa, 'fa_cache_file', fallback=cls.fa_cache_file),
+            fa_timeout=parser.getfloat(fa, 'fa_timeout', fallback=cls.fa_timeout),
+            fa_connect_timeout=parser.getfloat(fa, 'fa_connect_timeout', fallback=cls.fa_connect_timeout),
+            fa_read_timeout=parser.getfloat(fa, 'fa_read_timeout', fallback=cls.fa_read_timeout),
+            fa_retries=parser.getint(fa, 'fa_retries', fallback=cls.fa_retries),
+            fa_rate_limit=parser.getfloat(fa, 'fa_rate_limit', fallback=cls.fa_rate_limit))
+
+
+def settings(filename=FILENAME):
+    '''
+    settings()
+    The Settings of the configuration in filename.
+    '''
+    return Settings.from_parser(load(filename))
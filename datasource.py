@@ -1,7 +1,9 @@
-import configparser
-
 import flightdata
+import maprender
+import poller
+import recorder
 import screenshot
+import stream
 
 
 class Error(Exception):
@@ -14,34 +16,86 @@ DRIVERS = {
                 map=screenshot.Dump1090Display),
         'virtualradarserver': dict(
                 data=flightdata.VRSDataParser,
-                map=screenshot.VRSDisplay)
+                map=screenshot.VRSDisplay),
+        # Same data sources, but the tweet image is drawn from map tiles
+        # instead of screenshotting the web page.
+        'dump1090-tiles': dict(
+                data=flightdata.Dump1090DataParser,
+                map=maprender.TileMapDisplay),
+        'virtualradarserver-tiles': dict(
+                data=flightdata.VRSDataParser,
+                map=maprender.TileMapDisplay),
+        # Aircraft are read from dump1090's SBS-1 (30003) or Beast (30005)
+        # TCP output as it arrives, instead of polling aircraft.json.  The
+        # data_url is then tcp://host:port.
+        'dump1090-sbs': dict(
+                data=stream.StreamDataParser,
+                source=stream.SBSSource,
+                map=screenshot.Dump1090Display),
+        'dump1090-beast': dict(
+                data=stream.StreamDataParser,
+                source=stream.BeastSource,
+                map=screenshot.Dump1090Display),
+        'dump1090-sbs-tiles': dict(
+                data=stream.StreamDataParser,
+                source=stream.SBSSource,
+                map=maprender.TileMapDisplay),
+        'dump1090-beast-tiles': dict(
+                data=stream.StreamDataParser,
+                source=stream.BeastSource,
+                map=maprender.TileMapDisplay)
 }
 
 
 DEFAULT_DRIVER = 'dump1090'
 
 
-def get_driver():
-        driver = DRIVERS.get(g_driver, None)
+def get_driver(settings, name=None):
+        name = name or settings.driver
+        driver = DRIVERS.get(name, None)
         if not driver:
                 raise Error('Unknown driver: {}. Valid drivers are {}'.format(
-                    g_driver, ', '.join(DRIVERS.keys())))
+                    name, ', '.join(DRIVERS.keys())))
         return driver
 
 
-def get_map_source():
-        return get_driver()['map'](g_map_url)
+def get_receivers(settings):
+        '''
+        The (url, parser) of each receiver in the data_url of settings.
+        There is one per line, optionally preceded by the driver of that receiver:
+                data_url = http://localhost/dump1090/data/aircraft.json
+                        virtualradarserver http://other/VirtualRadar/AircraftList.json
+        '''
+        receivers = []
+        for line in settings.data_url.splitlines():
+                words = line.split()
+                if not words:
+                        continue
+                driver = get_driver(settings, words[0] if len(words) > 1 else None)
+                receivers.append((words[-1], driver['data']()))
+        return receivers
+
+
+def get_map_source(settings):
+        return get_driver(settings)['map'](settings.map_url, settings)
 
 
-def get_data_source():
+def get_data_source(settings, zone=None):
+        polled = not settings.replay_file and 'source' not in get_driver(settings)
+        receivers = get_receivers(settings)
         return flightdata.FlightData(
-            data_url=g_data_url,
-            parser=get_driver()['data']())
+            settings.receiver,
+            data_url=[url for url, parser in receivers] if polled else None,
+            parser=[parser for url, parser in receivers],
+            zone=zone,
+            timeout=settings.data_timeout,
+            recorder=recorder.Recorder(settings.record_file) if settings.record_file else None)
 
 
-parser = configparser.ConfigParser()
-parser.read('config.ini')
-abovetustin = parser['abovetustin']
-g_driver = abovetustin.get('driver', DEFAULT_DRIVER)
-g_data_url = parser.get('abovetustin', 'data_url')
-g_map_url = parser.get('abovetustin', 'map_url')
+def get_poller(settings, fd, interval):
+        if settings.replay_file:
+                return recorder.Replay(fd, settings.replay_file, settings.replay_speed)
+        source = get_driver(settings).get('source')
+        if source:
+                return source(fd, get_receivers(settings)[0][0], interval)
+        return poller.AsyncPoller(fd, interval)
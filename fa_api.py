@@ -4,49 +4,335 @@
 # Sergiusz Paprzycki <serek@walcz.net>
 # 
 
+import random
+import shelve
+import threading
+import time
 import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 
-import requests
+import metrics
+import util
+
+FXML_URL = "https://flightxml.flightaware.com/json/FlightXML3/"
+
+# Status codes worth retrying: rate limited, or a server side problem.
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+REQUEST_SECONDS = metrics.histogram('abovetustin_flightaware_request_seconds', 'Seconds per FlightXML request')
+RETRIES = metrics.counter('abovetustin_flightaware_retries_total', 'FlightXML requests retried')
+FAILURES = metrics.counter('abovetustin_flightaware_failures_total', 'FlightXML calls that gave up')
+CACHE = metrics.counter('abovetustin_flightaware_cache_total', 'FlightAware cache lookups', ('result',))
+CACHE_HITS = CACHE.labels('hit')
+CACHE_MISSES = CACHE.labels('miss')
+
+class FlightXMLClient(object):
+	"""
+	A FlightXML3 client.  It keeps one pooled requests.Session, so repeated
+	lookups reuse the TCP+TLS connection, and applies connect/read timeouts.
+	Requests failing with a connection error or one of RETRY_STATUS are
+	retried up to `retries` times with jittered exponential backoff
+	(honoring Retry-After on a 429).  If `rate` is given, at most that many
+	requests per minute are made, to stay inside the FlightXML plan.
+
+	The client keeps count of requests, retries and failures, and of the
+	request latency.
+	"""
+	def __init__(self, username, apiKey, base_url=FXML_URL,
+			connect_timeout=5.0, read_timeout=15.0,
+			retries=3, backoff=0.5, max_backoff=8.0, rate=None):
+		import requests
+		self.base_url = base_url
+		self.timeout = (connect_timeout, read_timeout)
+		self.retries = retries
+		self.backoff = backoff
+		self.max_backoff = max_backoff
+		self.limiter = util.RateLimiter(rate / 60.0) if rate else None
+		self.session = requests.Session()
+		self.session.auth = (username, apiKey)
+		adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4)
+		self.session.mount('https://', adapter)
+		self.session.mount('http://', adapter)
+		self.lock = threading.Lock()
+		self.requests = 0		# requests sent, including retries
+		self.retried = 0		# of which retries
+		self.failures = 0		# calls that gave up
+		self.latency_total = 0.0	# seconds spent in requests
+		self.latency_max = 0.0
+		self.latency_last = 0.0
+
+	def stats(self):
+		with self.lock:
+			average = self.latency_total / self.requests if self.requests else 0.0
+			return "{} requests, {} retries, {} failures, latency avg {:.3f}s max {:.3f}s".format(
+				self.requests, self.retried, self.failures, average, self.latency_max)
+
+	def _record(self, latency):
+		REQUEST_SECONDS.observe(latency)
+		with self.lock:
+			self.requests += 1
+			self.latency_total += latency
+			self.latency_last = latency
+			self.latency_max = max(self.latency_max, latency)
+
+	def _delay(self, attempt, response):
+		if response is not None and response.status_code == 429:
+			retry_after = response.headers.get('Retry-After')
+			if retry_after and retry_after.isdigit():
+				return min(float(retry_after), self.max_backoff)
+		delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+		return delay / 2 + random.uniform(0, delay / 2)
+
+	def get(self, method, params):
+		"""
+		Calls a FlightXML method and returns the requests.Response.  Raises
+		the last error if every attempt failed.
+		"""
+		import requests
+		attempt = 0
+		while True:
+			if self.limiter:
+				self.limiter.acquire()
+			response = None
+			start = time.time()
+			try:
+				response = self.session.get(self.base_url + method, params=params, timeout=self.timeout)
+			except (requests.ConnectionError, requests.Timeout):
+				self._record(time.time() - start)
+				if attempt >= self.retries:
+					with self.lock:
+						self.failures += 1
+					FAILURES.inc()
+					raise
+			else:
+				self._record(time.time() - start)
+				if response.status_code not in RETRY_STATUS or attempt >= self.retries:
+					if response.status_code in RETRY_STATUS:
+						with self.lock:
+							self.failures += 1
+						FAILURES.inc()
+					return response
+			delay = self._delay(attempt, response)
+			print("FlightXML {} failed ({}), retrying in {:.1f}s".format(
+				method, response.status_code if response is not None else "no response", delay))
+			time.sleep(delay)
+			attempt += 1
+			RETRIES.inc()
+			with self.lock:
+				self.retried += 1
+
+	def FlightInfoStatus(self, ident, verbose=0, results=10):
+		"""
+		Looks up ident, returning a tuple of the result and whether the
+		result is definitive (worth caching) rather than a transient failure.
+		"""
+		try:
+			ident = ident.strip()
+			payload = {'ident':ident, 'howMany':results}
+			response = self.get("FlightInfoStatus", payload)
+			output = dict()
+			if response.status_code == 402:
+				print(response.text)
+				return False, True
+			if response.status_code == 200:
+				decodedResponse = response.json()
+				if 'FlightInfoStatusResult' not in decodedResponse:
+					print("FlightAware has no FlightInfoStatusResult for {}".format(ident))
+					return False, True
+				for flight in decodedResponse['FlightInfoStatusResult']['flights']:
+					if 'status' not in flight:
+						continue
+					if flight['status'].startswith('On') or flight['status'].startswith('En') or flight['status'].startswith('In'):
+						output = {
+							"orig_name":flight['origin']['airport_name'],
+							"orig_city":flight['origin']['city'],
+							"orig_alt":flight['origin']['alternate_ident'],
+							"orig_code":flight['origin']['code'],
+							"dest_name":flight['destination']['airport_name'],
+							"dest_city":flight['destination']['city'],
+							"dest_alt":flight['destination']['alternate_ident'],
+							"dest_code":flight['destination']['code']
+						}
+						break
+				print("FlightAware {}: {} to {} ({:.3f}s)".format(
+					ident, output.get('orig_code'), output.get('dest_code'), self.latency_last))
+				if verbose:
+					return decodedResponse, True
+				else:
+					return output, True
+			else:
+				print("FA API status code: {}".format(response.status_code))
+				print(response.text)
+				return False, False
+		except Exception:
+			print("exception in fa_api.FlightInfo():")
+			traceback.print_exc()
+			return False, False
+
+	def FlightInfo(self, ident, verbose=0, results=10):
+		return self.FlightInfoStatus(ident, verbose, results)[0]
+
+# One client per set of credentials for the module level FlightInfo().
+_clients = dict()
+_clients_lock = threading.Lock()
+
+def _client(username, apiKey):
+	with _clients_lock:
+		client = _clients.get((username, apiKey))
+		if client is None:
+			client = FlightXMLClient(username, apiKey)
+			_clients[(username, apiKey)] = client
+		return client
 
 def FlightInfo(ident, username, apiKey, verbose=0, results=10):
-	try:
-		fxmlUrl = "https://flightxml.flightaware.com/json/FlightXML3/"
-		ident = ident.strip()
-		payload = {'ident':ident, 'howMany':results}
-		response = requests.get(fxmlUrl + "FlightInfoStatus", params=payload, auth=(username, apiKey))
-		output = dict()
-		if response.status_code == 402:
-			print(response.text)
+	return _client(username, apiKey).FlightInfo(ident, verbose, results)
+
+class FlightInfoCache(object):
+	"""
+	An LRU cache of FlightInfo() results keyed by ident.
+
+	Results are kept for `ttl` seconds.  Negative results (402 or no result
+	for the ident) are kept too, for `negative_ttl` seconds, so a flight
+	FlightAware doesn't know isn't asked about on every pass.  Transient
+	failures are never cached.  If `filename` is given the cache is also
+	kept in a shelve file so it survives restarts.
+	"""
+	def __init__(self, client, size=256, ttl=1800, negative_ttl=600, filename=None):
+		self.client = client
+		self.size = size
+		self.ttl = ttl
+		self.negative_ttl = negative_ttl
+		self.entries = OrderedDict()	# ident -> (expiry time, result)
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+		self.shelf = None
+		if filename:
+			self.shelf = shelve.open(filename)
+			now = time.time()
+			for ident, entry in sorted(self.shelf.items(), key=lambda item: item[1][0]):
+				if entry[0] > now:
+					self.entries[ident] = entry
+				else:
+					del self.shelf[ident]
+			while len(self.entries) > self.size:
+				self._evict()
+
+	def get(self, ident):
+		"""
+		Returns a tuple of (found, result) for the ident.
+		"""
+		with self.lock:
+			entry = self.entries.get(ident)
+			if entry is None:
+				self.misses += 1
+				CACHE_MISSES.inc()
+				return False, None
+			if entry[0] <= time.time():
+				del self.entries[ident]
+				if self.shelf is not None:
+					del self.shelf[ident]
+				self.misses += 1
+				CACHE_MISSES.inc()
+				return False, None
+			self.entries.move_to_end(ident)
+			self.hits += 1
+			CACHE_HITS.inc()
+			return True, entry[1]
+
+	def put(self, ident, result):
+		ttl = self.ttl if result else self.negative_ttl
+		entry = (time.time() + ttl, result)
+		with self.lock:
+			self.entries[ident] = entry
+			self.entries.move_to_end(ident)
+			if self.shelf is not None:
+				self.shelf[ident] = entry
+				self.shelf.sync()
+			while len(self.entries) > self.size:
+				self._evict()
+
+	def _evict(self):
+		ident, entry = self.entries.popitem(last=False)
+		if self.shelf is not None and ident in self.shelf:
+			del self.shelf[ident]
+
+	def FlightInfo(self, ident, results=10):
+		"""
+		Same as the client's FlightInfo(), answered from the cache when
+		possible.
+		"""
+		if not ident:
 			return False
-		if response.status_code == 200:
-			decodedResponse = response.json()
-			print(decodedResponse)
-			if 'FlightInfoStatusResult' not in decodedResponse:
-				return False
-			for flight in decodedResponse['FlightInfoStatusResult']['flights']:
-				if 'status' not in flight:
-					continue
-				if flight['status'].startswith('On') or flight['status'].startswith('En') or flight['status'].startswith('In'):
-					output = {
-						"orig_name":flight['origin']['airport_name'],
-						"orig_city":flight['origin']['city'],
-						"orig_alt":flight['origin']['alternate_ident'],
-						"orig_code":flight['origin']['code'],
-						"dest_name":flight['destination']['airport_name'],
-						"dest_city":flight['destination']['city'],
-						"dest_alt":flight['destination']['alternate_ident'],
-						"dest_code":flight['destination']['code']
-					}
-					break
-			if verbose:
-				return decodedResponse
-			else:
-				return output
-		else:
-			print("FA API status code: {}".format(response.status_code))
-			print(response.text)
+		ident = ident.strip()
+		found, result = self.get(ident)
+		if found:
+			print("FlightAware cache hit for {} ({} hits, {} misses)".format(ident, self.hits, self.misses))
+			return result
+		result, cacheable = self.client.FlightInfoStatus(ident, results=results)
+		if cacheable:
+			self.put(ident, result)
+		return result
+
+	def close(self):
+		with self.lock:
+			if self.shelf is not None:
+				self.shelf.close()
+				self.shelf = None
+
+
+class FlightInfoPrefetcher(object):
+	"""
+	Starts flight detail lookups in the background, so they are done by the
+	time they're needed.  `lookup` is called with the ident, e.g. a
+	FlightInfoCache's FlightInfo.  An ident that
+	is already being looked up is never requested a second time; the
+	pending lookup is shared instead.
+	"""
+	def __init__(self, lookup, workers=2):
+		self.lookup = lookup
+		self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='flightaware')
+		self.pending = dict()	# ident -> Future of the lookup in progress
+		self.lock = threading.Lock()
+
+	def prefetch(self, ident):
+		"""
+		Returns a Future for the flight details of ident, or None if there
+		is no ident to look up.
+		"""
+		if not ident or not ident.strip():
+			return None
+		ident = ident.strip()
+		with self.lock:
+			future = self.pending.get(ident)
+			if future is None:
+				future = self.executor.submit(self.lookup, ident)
+				self.pending[ident] = future
+				future.add_done_callback(lambda f: self._done(ident, f))
+			return future
+
+	def _done(self, ident, future):
+		with self.lock:
+			if self.pending.get(ident) is future:
+				del self.pending[ident]
+
+	@staticmethod
+	def wait(future, timeout):
+		"""
+		Waits up to timeout seconds for a prefetched lookup.  Returns the
+		flight details, or False if there aren't any (yet).
+		"""
+		if future is None:
 			return False
-	except Exception:
-		print("exception in fa_api.FlightInfo():")
-		traceback.print_exc()
+		try:
+			return future.result(timeout=timeout)
+		except TimeoutError:
+			print("FlightAware lookup still running after {} seconds, tweeting without it".format(timeout))
+		except Exception:
+			print("exception in FlightAware prefetch:")
+			traceback.print_exc()
 		return False
+
+	def shutdown(self):
+		self.executor.shutdown(wait=False)
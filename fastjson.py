@@ -0,0 +1,31 @@
+#
+# fastjson.py
+#
+# Decodes JSON straight from the bytes of a response with the fastest
+# decoder installed: orjson, then ujson, then the standard library.
+#
+
+import json
+from collections import OrderedDict
+
+# The decoders that are installed, fastest first.  Each of them takes
+# bytes (or str) and returns the decoded object.
+BACKENDS = OrderedDict()
+
+try:
+    import orjson
+    BACKENDS['orjson'] = orjson.loads
+except ImportError:
+    pass
+
+try:
+    import ujson
+    BACKENDS['ujson'] = ujson.loads
+except ImportError:
+    pass
+
+# json.loads detects the encoding of bytes itself
+BACKENDS['json'] = json.loads
+
+BACKEND = next(iter(BACKENDS))
+loads = BACKENDS[BACKEND]
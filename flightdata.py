@@ -18,52 +18,214 @@
 
 
 import traceback
-from urllib.request import urlopen
-import json
 from time import sleep
+import fastjson
 import geomath
 import math
+import metrics
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from configparser import ConfigParser
 
-# Read the configuration file for this application.
-parser = ConfigParser()
-parser.read('config.ini')
+# Time spent in each stage of a refresh.
+REFRESH_SECONDS = metrics.histogram('abovetustin_refresh_seconds',
+                                    'Seconds spent per refresh in each stage', ('stage',))
+FETCH_SECONDS = REFRESH_SECONDS.labels('fetch')
+DECODE_SECONDS = REFRESH_SECONDS.labels('decode')
+PARSE_SECONDS = REFRESH_SECONDS.labels('parse')
+GEOMETRY_SECONDS = REFRESH_SECONDS.labels('geometry')
+FETCH_ERRORS = metrics.counter('abovetustin_fetch_errors_total', 'Failed fetches of a data url')
+AIRCRAFT = metrics.gauge('abovetustin_aircraft', 'Aircraft in the latest snapshot')
+LOCATED = metrics.gauge('abovetustin_aircraft_located', 'Aircraft with a position in the latest snapshot')
 
-# Assign receiver variables.
-receiver_latitude = float(parser.get('receiver', 'latitude'))
-receiver_longitude = float(parser.get('receiver', 'longitude'))
 
 class FlightData():
-    def __init__(self, data_url=None, parser=None):
+    '''
+    Polls the receiver's data url over a keep-alive connection.  receiver
+    is the (latitude, longitude) the aircraft are located from.  When an
+    alarm zone is given, only the aircraft that could be inside of it get
+    their distance, azimuth and elevation computed; the others are left as
+    NaN.  When a recorder.Recorder is given every new payload is recorded.
+
+    data_url may also be a list of urls, with a list of parsers to match,
+    to cover an area with several receivers.  They are polled concurrently
+    and their aircraft merged into one snapshot (see merge()).
+    '''
+    def __init__(self, receiver, data_url=None, parser=None, zone=None, timeout=10.0, recorder=None):
+        urls = data_url if isinstance(data_url, (list, tuple)) else [data_url] if data_url else []
+        parsers = parser if isinstance(parser, (list, tuple)) else [parser] * max(len(urls), 1)
         self.data_url = data_url
-        self.parser = parser
+        self.parser = parsers[0]
+        self.parsers = parsers
+        self.receiver = receiver
+        self.zone = zone
+        self.recorder = recorder
+        self.clients = []
+        if urls:
+            import httpclient
+            self.clients = [httpclient.KeepAliveClient(url, timeout) for url in urls]
+        self.client = self.clients[0] if self.clients else None
+        self.executor = None
+        if len(self.clients) > 1:
+            self.executor = ThreadPoolExecutor(len(self.clients), thread_name_prefix='receiver')
+        self.sources = [None] * len(parsers)   # the latest snapshot of each receiver
         self.aircraft = None
+        self.delta = None
         self.refresh()
 
+    def fetch(self, index):
+        # the payload, None if it hasn't changed, or the error
+        try:
+            with FETCH_SECONDS.time():
+                return self.clients[index].fetch()
+        except Exception as e:
+            FETCH_ERRORS.inc()
+            return e
+
     def refresh(self):
+        '''
+        refresh()
+        Fetches and loads the data url(s).  Returns True when there was new
+        data.
+        '''
+        if not self.clients:
+            return False
         try:
-            #open the data url
-            self.req = urlopen(self.data_url)
+            #read data from the urls, None if it hasn't changed
+            if self.executor is None:
+                payloads = [self.fetch(0)]
+            else:
+                payloads = list(self.executor.map(self.fetch, range(len(self.clients))))
+
+            changed = False
+            for index, raw_data in enumerate(payloads):
+                if isinstance(raw_data, Exception):
+                    print("could not fetch {}: {}".format(self.clients[index].url, raw_data))
+                    # forget what this receiver saw until it's back
+                    if self.sources[index] is not None:
+                        self.sources[index] = None
+                        changed = True
+                    continue
+                if raw_data is None:
+                    continue
+                if self.recorder is not None:
+                    self.recorder.write(raw_data, source=index if self.executor else None)
+                if self.load(raw_data, index):
+                    changed = True
+            return changed and self.merge()
 
-            #read data from the url
-            self.raw_data = self.req.read()
+        except Exception:
+            print("exception in FlightData.refresh():")
+            traceback.print_exc()
+            return False
+
+    def update(self, raw_data, source=0):
+        '''
+        update()
+        Loads a raw json document from the receiver (the source'th one
+        when there are several).  Returns True when it was newer than the
+        current one.
+        '''
+        return self.load(raw_data, source) and self.merge()
+
+    def load(self, raw_data, source):
+        self.raw_data = raw_data
+
+        #load in the json, straight from the bytes
+        with DECODE_SECONDS.time():
+            self.json_data = fastjson.loads(raw_data)
+
+        #get time from json
+        parser = self.parsers[source]
+        time = datetime.fromtimestamp(parser.time(self.json_data))
+        previous = self.sources[source]
+        if previous is not None and time == previous.time:
+            return False
+        with PARSE_SECONDS.time():
+            self.sources[source] = parser.parse(self.json_data, time)
+        return True
+
+    def merge(self):
+        '''
+        merge()
+        Makes the snapshot of the receivers, diffing it against the previous
+        one.  Returns False if there is nothing new.
+        '''
+        sources = [s for s in self.sources if s is not None]
+        if not sources:
+            return False
+        snapshot = sources[0] if len(sources) == 1 else merge(sources)
+        if snapshot is self.aircraft:
+            return False
+        self.time = snapshot.time
+
+        #diff against the previous refresh, and locate the aircraft that moved
+        with GEOMETRY_SECONDS.time():
+            snapshot.diff(self.aircraft)
+            self.aircraft = snapshot.locate(self.receiver, self.aircraft, self.zone)
+        self.delta = self.aircraft.delta
+        AIRCRAFT.set(len(snapshot))
+        if metrics.ENABLED:
+            LOCATED.set(sum(1 for lat in snapshot.lat if lat is not None))
+        return True
+
+
+# The per-aircraft fields, in the order AirCraftData takes them.
+AIRCRAFT_FIELDS = (
+    'hex',
+    'squawk',
+    'flight',
+    'registration',
+    'lat',
+    'lon',
+    'altitude',
+    'vert_rate',
+    'track',
+    'speed',
+    'messages',
+    'seen',
+    'mlat',
+    'nucp',
+    'seen_pos',
+    'rssi',
+    'distance',
+    'az',
+    'el')
+
+# The fields a parser supplies; distance, az and el are computed afterwards.
+PARSED_FIELDS = AIRCRAFT_FIELDS[:-3]
+
+
+class AircraftBase(object):
+    __slots__ = ()
 
-            #load in the json
-            self.json_data = json.loads(self.raw_data.decode())
+    def __str__(self):
+        return '<{} {} dist={} el={}>'.format(
+            self.__class__.__name__,
+            self.ident_desc(),
+            self.distance,
+            self.el)
 
-            #get time from json
-            self.time = datetime.fromtimestamp(self.parser.time(self.json_data))
+    def ident_desc(self):
+        idents = [self.hex, self.registration]
+        if self.flight != self.registration:
+            idents.append(self.flight)
+        idents = [i for i in idents if i]
+        return '/'.join(idents)
 
-            #load all the aircarft
-            self.aircraft = self.parser.aircraft_data(self.json_data, self.time)
+    def detach(self):
+        '''
+        detach()
+        Copies the aircraft into a standalone AirCraftData.  For a snapshot
+        row this means it can be kept around without keeping the whole
+        snapshot alive.
+        '''
+        values = [getattr(self, name) for name in AIRCRAFT_FIELDS]
+        return AirCraftData(*values, self.time)
 
-        except Exception:
-            print("exception in FlightData.refresh():")
-            traceback.print_exc()
 
+class AirCraftData(AircraftBase):
+    __slots__ = AIRCRAFT_FIELDS + ('time',)
 
-class AirCraftData():
     def __init__(self,
                  dhex,
                  squawk,
@@ -106,25 +268,270 @@ class AirCraftData():
         self.el = el
         self.time = time
 
+
+def _tolist(column):
+    # geomath.geometry() returns NumPy arrays when NumPy is installed
+    return column.tolist() if hasattr(column, 'tolist') else column
+
+
+def _column(name):
+    def get(self):
+        return getattr(self.snapshot, name)[self.index]
+    return property(get)
+
+
+class AircraftRow(AircraftBase):
+    '''
+    A lightweight view of one aircraft in an AircraftSnapshot.  It has the
+    same attributes as AirCraftData but stores nothing except its position
+    in the snapshot.
+    '''
+    __slots__ = ('snapshot', 'index')
+
+    def __init__(self, snapshot, index):
+        self.snapshot = snapshot
+        self.index = index
+
+    @property
+    def time(self):
+        return self.snapshot.time
+
+for _name in AIRCRAFT_FIELDS:
+    setattr(AircraftRow, _name, _column(_name))
+
+
+class AircraftSnapshot(object):
+    '''
+    All the aircraft of one refresh, stored column-wise: one list per field
+    (struct-of-arrays) plus an index from ICAO hex to row number.  Iterating
+    over a snapshot yields AircraftRow views.
+    '''
+    __slots__ = AIRCRAFT_FIELDS + ('time', 'rows', 'delta')
+
+    def __init__(self, time):
+        self.time = time
+        self.rows = dict()
+        self.delta = None
+        for name in AIRCRAFT_FIELDS:
+            setattr(self, name, [])
+
+    def append(self, *values):
+        '''
+        append()
+        Adds an aircraft given the values of PARSED_FIELDS, in order.
+        '''
+        self.rows[values[0]] = len(self.hex)
+        for name, value in zip(PARSED_FIELDS, values):
+            getattr(self, name).append(value)
+
+    def diff(self, previous):
+        '''
+        diff()
+        Compares this snapshot against the previous one and stores the
+        result as self.delta.
+        '''
+        delta = SnapshotDelta()
+        if previous is None:
+            delta.added.update(self.rows)
+            self.delta = delta
+            return delta
+        for dhex, i in self.rows.items():
+            j = previous.rows.get(dhex)
+            if j is None:
+                delta.added.add(dhex)
+            elif (self.lat[i] == previous.lat[j] and self.lon[i] == previous.lon[j]
+                    and self.altitude[i] == previous.altitude[j]):
+                delta.unchanged.add(dhex)
+            else:
+                delta.updated.add(dhex)
+        delta.removed.update(previous.rows.keys() - self.rows.keys())
+        self.delta = delta
+        return delta
+
+    def locate(self, origin, previous=None, prefilter=None):
+        '''
+        locate()
+        Computes the distance, azimuth and elevation columns relative to
+        origin with a single batched call into geomath.  Aircraft without a
+        position get a distance of -1.  When the previous snapshot is given
+        (and diff() has been run against it) aircraft that haven't moved
+        reuse their previous geometry.  When a prefilter zone is given,
+        aircraft it rejects get NaN instead of their geometry.
+        '''
+        count = len(self.hex)
+        self.distance = [-1] * count
+        self.az = [0] * count
+        self.el = [0] * count
+        pending = range(count)
+        if previous is not None and self.delta is not None:
+            for dhex in self.delta.unchanged:
+                i = self.rows[dhex]
+                j = previous.rows[dhex]
+                self.distance[i] = previous.distance[j]
+                self.az[i] = previous.az[j]
+                self.el[i] = previous.el[j]
+            pending = [self.rows[dhex] for dhex in self.delta.moved]
+        located = [i for i in pending
+                   if self.lat[i] is not None and self.lon[i] is not None]
+        if prefilter is not None and located:
+            keep = prefilter.candidates(
+                [self.lat[i] for i in located],
+                [self.lon[i] for i in located],
+                [self.altitude[i] for i in located])
+            for i, k in zip(located, keep):
+                if not k:
+                    self.distance[i] = self.az[i] = self.el[i] = math.nan
+            located = [i for i, k in zip(located, keep) if k]
+        if not located:
+            return self
+        if len(located) == count:
+            dist, az, el = geomath.geometry(origin, self.lat, self.lon, self.altitude)
+            self.distance, self.az, self.el = _tolist(dist), _tolist(az), _tolist(el)
+            return self
+        dist, az, el = geomath.geometry(
+            origin,
+            [self.lat[i] for i in located],
+            [self.lon[i] for i in located],
+            [self.altitude[i] for i in located])
+        dist, az, el = _tolist(dist), _tolist(az), _tolist(el)
+        for j, i in enumerate(located):
+            self.distance[i] = dist[j]
+            self.az[i] = az[j]
+            self.el[i] = el[j]
+        return self
+
+    def __len__(self):
+        return len(self.hex)
+
+    def __iter__(self):
+        for i in range(len(self.hex)):
+            yield AircraftRow(self, i)
+
+    def __contains__(self, dhex):
+        return dhex in self.rows
+
+    def __getitem__(self, dhex):
+        return AircraftRow(self, self.rows[dhex])
+
+    def get(self, dhex, default=None):
+        i = self.rows.get(dhex)
+        if i is None:
+            return default
+        return AircraftRow(self, i)
+
+
+class SnapshotDelta(object):
+    '''
+    The per-aircraft changes between two consecutive snapshots, as sets of
+    ICAO hex codes:
+        added     - aircraft that weren't in the previous snapshot
+        updated   - aircraft whose position changed
+        unchanged - aircraft whose position is the same as before
+        removed   - aircraft that are no longer in the snapshot
+    '''
+    __slots__ = ('added', 'updated', 'unchanged', 'removed')
+
+    def __init__(self):
+        self.added = set()
+        self.updated = set()
+        self.unchanged = set()
+        self.removed = set()
+
+    @property
+    def moved(self):
+        '''
+        The aircraft that need to be evaluated again: added or updated.
+        '''
+        return self.added | self.updated
+
+    def combine(self, older, present):
+        '''
+        combine()
+        Folds in the delta of an older snapshot that was never looked at, so
+        this delta is relative to the snapshot before that one.  present is
+        the set of hex codes in this snapshot.
+        '''
+        self.added = (self.added | older.added) & present
+        self.updated = ((self.updated | older.updated) & present) - self.added
+        self.unchanged = self.unchanged - self.added - self.updated
+        self.removed = (self.removed | older.removed) - present
+
     def __str__(self):
-        return '<{} {} dist={} el={}>'.format(
+        return '<{} +{} ~{} ={} -{}>'.format(
             self.__class__.__name__,
-            self.ident_desc(),
-            self.distance,
-            self.el)
+            len(self.added),
+            len(self.updated),
+            len(self.unchanged),
+            len(self.removed))
+
+
+# Positions reported by two receivers less than this many seconds apart are
+# as fresh as each other, the one with the stronger signal is kept.
+MERGE_TOLERANCE = 1.0
+
+
+def merge(snapshots):
+    '''
+    merge()
+    Merges the snapshots of several receivers into one at the time of the
+    newest.  An aircraft seen by more than one receiver is taken from the
+    one with the freshest position, or the strongest signal when they are
+    about as fresh; its seen times are moved to the merged time.
+    '''
+    time = max(s.time for s in snapshots)
+    best = dict()   # hex -> (has position, position time, rssi, snapshot, row)
+    for s in snapshots:
+        now = s.time.timestamp()
+        for dhex, i in s.rows.items():
+            located = s.lat[i] is not None and s.lon[i] is not None
+            age = s.seen_pos[i] if s.seen_pos[i] is not None else s.seen[i]
+            rssi = s.rssi[i] if s.rssi[i] is not None else -math.inf
+            candidate = (located, now - (age or 0), rssi, s, i)
+            other = best.get(dhex)
+            if other is None or located > other[0]:
+                best[dhex] = candidate
+            elif located == other[0]:
+                if abs(candidate[1] - other[1]) > MERGE_TOLERANCE:
+                    if candidate[1] > other[1]:
+                        best[dhex] = candidate
+                elif rssi > other[2]:
+                    best[dhex] = candidate
+
+    merged = AircraftSnapshot(time)
+    seen_fields = [PARSED_FIELDS.index('seen'), PARSED_FIELDS.index('seen_pos')]
+    for located, postime, rssi, s, i in best.values():
+        values = [getattr(s, name)[i] for name in PARSED_FIELDS]
+        offset = (time - s.time).total_seconds()
+        if offset:
+            for k in seen_fields:
+                if values[k] is not None:
+                    values[k] += offset
+        merged.append(*values)
+    return merged
 
-    def ident_desc(self):
-        idents = [self.hex, self.registration]
-        if self.flight != self.registration:
-            idents.append(self.flight)
-        idents = [i for i in idents if i]
-        return '/'.join(idents)
 
 class AircraftDataParser(object):
     def __init__(self):
         pass
 
-    def aircraft_data(self, json_data, time):
+    def aircraft_data(self, json_data, time, receiver, previous=None, prefilter=None):
+        '''
+        aircraft_data()
+        Parses json_data into a new AircraftSnapshot, diffs it against the
+        previous snapshot and computes the geometry, from the receiver's
+        (latitude, longitude), of the aircraft that moved and pass the
+        optional prefilter zone.
+        '''
+        snapshot = self.parse(json_data, time)
+        snapshot.diff(previous)
+        return snapshot.locate(receiver, previous, prefilter)
+
+    def parse(self, json_data, time):
+        snapshot = AircraftSnapshot(time)
+        self.parse_aircraft(json_data, snapshot)
+        return snapshot
+
+    def parse_aircraft(self, json_data, snapshot):
         raise NotImplementedError
 
     def time(self, json_data):
@@ -132,99 +539,73 @@ class AircraftDataParser(object):
 
 
 class VRSDataParser(AircraftDataParser):
-    def _parse_aircraft_data(self, a, time):
-        alt = a.get('Alt', 0)
-        dist = -1
-        az = 0
-        el = 0
-        if 'Lat' in a and 'Long' in a:
-            rec_pos = (receiver_latitude, receiver_longitude)
-            ac_pos = (a['Lat'], a['Long'])
-            dist = geomath.distance(rec_pos, ac_pos)
-            az = geomath.bearing(rec_pos, ac_pos)
-            el = math.degrees(math.atan(alt / (dist * 5280)))
-        speed = 0
-        if 'Spd' in a:
-            speed = geomath.knot2mph(a['Spd'])
-        if 'PosTime' in a:
-            last_seen_time = datetime.fromtimestamp(a['PosTime'] / 1000.0)
-            seen = (time - last_seen_time).total_seconds()
+    def _parse_aircraft_data(self, snapshot, a, time):
+        get = a.get
+        speed = get('Spd')
+        speed = geomath.knot2mph(speed) if speed is not None else 0
+        pos_time = get('PosTime')
+        if pos_time is not None:
+            seen = time.timestamp() - pos_time / 1000.0
         else:
             seen = 0
-        ac_data = AirCraftData(
-            a.get('Icao', None).upper(),
-            a.get('Sqk', None),
-            a.get('Call', None),
-            a.get('Reg', None),
-            a.get('Lat', None),
-            a.get('Long', None),
-            alt,
-            a.get('Vsi', 0),
-            a.get('Trak', None),
+        snapshot.append(
+            get('Icao').upper(),
+            get('Sqk'),
+            get('Call'),
+            get('Reg'),
+            get('Lat'),
+            get('Long'),
+            get('Alt', 0),
+            get('Vsi', 0),
+            get('Trak'),
             speed,
-            a.get('CMsgs', None),
+            get('CMsgs'),
             seen,
-            a.get('Mlat', False),
+            get('Mlat', False),
             None,  # NUCP
             None,  # Seen pos
-            10.0 * math.log10(a.get('Sig', 0) / 255.0 + 1e-5),
-            dist,
-            az,
-            el,
-            time)
-        return ac_data
+            10.0 * math.log10(get('Sig', 0) / 255.0 + 1e-5))
 
-    def aircraft_data(self, json_data, time):
-        aircraft_list = [self._parse_aircraft_data(d, time) for d in json_data['acList']]
-        return aircraft_list
+    def parse_aircraft(self, json_data, snapshot):
+        for d in json_data['acList']:
+            self._parse_aircraft_data(snapshot, d, snapshot.time)
 
     def time(self, json_data):
         return json_data['stm'] / 1000.0
 
 
 class Dump1090DataParser(AircraftDataParser):
-    def aircraft_data(self, json_data, time):
-        aircraft_list = []
+    def parse_aircraft(self, json_data, snapshot):
+        append = snapshot.append
+        knot2mph = geomath.knot2mph
         for a in json_data["aircraft"]:
+            # one dict lookup per field
+            get = a.get
 
-            alt = a["altitude"] if "altitude" in a else 0
+            alt = get("altitude", 0)
             if alt == "ground":
                 alt = 0
-            dist = -1
-            az = 0
-            el = 0
-            if "lat" in a and "lon" in a:
-                dist = geomath.distance((receiver_latitude, receiver_longitude), (a["lat"], a["lon"]))
-                az = geomath.bearing((receiver_latitude, receiver_longitude), (a["lat"], a["lon"]))
-                el = math.degrees(math.atan(alt / (dist*5280)))
-            speed = 0
-            if "speed" in a:
-                speed = geomath.knot2mph(a["speed"])
-
-            aircraftdata = AirCraftData(
-                a["hex"].upper() if "hex" in a else None,
-                a["squawk"] if "squawk" in a else None,
-                a["flight"] if "flight" in a else None,
+            speed = get("speed")
+            speed = knot2mph(speed) if speed is not None else 0
+            dhex = get("hex")
+
+            append(
+                dhex.upper() if dhex is not None else None,
+                get("squawk"),
+                get("flight"),
                 None,
-                a["lat"] if "lat" in a else None,
-                a["lon"] if "lon" in a else None,
+                get("lat"),
+                get("lon"),
                 alt,
-                a["vert_rate"] if "vert_rate" in a else 0,
-                a["track"] if "track" in a else None,
+                get("vert_rate", 0),
+                get("track"),
                 speed,
-                a["messages"] if "messages" in a else None,
-                a["seen"] if "seen" in a else None,
-                a["mlat"] if "mlat" in a else None,
-                a["nucp"] if "nucp" in a else None,
-                a["seen_pos"] if "seen_pos" in a else None,
-                a["rssi"] if "rssi" in a else None,
-                dist,
-                az,
-                el,
-                time)
-
-            aircraft_list.append(aircraftdata)
-        return aircraft_list
+                get("messages"),
+                get("seen"),
+                get("mlat"),
+                get("nucp"),
+                get("seen_pos"),
+                get("rssi"))
 
     def time(self, json_data):
         return json_data['now']
@@ -232,8 +613,10 @@ class Dump1090DataParser(AircraftDataParser):
 
 if __name__ == "__main__":
     import os
+    import config
+    import datasource
 
-    flightdata = FlightData()
+    flightdata = datasource.get_data_source(config.settings())
     while True:
         os.system('clear')
         print("Now: {}".format(flightdata.time.strftime('%Y-%m-%d %H:%M:%S')))
@@ -8,6 +8,14 @@
 
 import math
 
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+EARTH_RADIUS_MI = 3956	# Radius of earth in miles. Use 6371 for kilometers
+FEET_PER_MILE = 5280
+
 def HeadingStr(heading):
 	"""
 	Gives a heading string given the heading float
@@ -72,16 +80,18 @@ def distance(pointA, pointB):
 
 	http://stackoverflow.com/questions/15736995/how-can-i-quickly-estimate-the-distance-between-two-latitude-longitude-points
 	"""
+	return _distance(pointA[0], pointA[1], pointB[0], pointB[1])
+
+def _distance(lat1, lon1, lat2, lon2):
 	# convert decimal degrees to radians 
-	lon1, lat1, lon2, lat2 = map(math.radians, [pointA[1], pointA[0], pointB[1], pointB[0]])
+	lon1, lat1, lon2, lat2 = map(math.radians, [lon1, lat1, lon2, lat2])
 
 	# haversine formula 
 	dlon = lon2 - lon1 
 	dlat = lat2 - lat1 
 	a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
 	c = 2 * math.asin(math.sqrt(a)) 
-	r = 3956  # Radius of earth in miles. Use 6371 for kilometers
-	return c * r
+	return c * EARTH_RADIUS_MI
 
 def bearing(pointA, pointB):
 	"""
@@ -108,10 +118,12 @@ def bearing(pointA, pointB):
 	if (type(pointA) != tuple) or (type(pointB) != tuple):
 		raise TypeError("Only tuples are supported as arguments")
 
-	lat1 = math.radians(pointA[0])
-	lat2 = math.radians(pointB[0])
+	return _bearing(pointA[0], pointA[1], pointB[0], pointB[1])
 
-	diffLong = math.radians(pointB[1] - pointA[1])
+def _bearing(lat1, lon1, lat2, lon2):
+	diffLong = math.radians(lon2 - lon1)
+	lat1 = math.radians(lat1)
+	lat2 = math.radians(lat2)
 
 	x = math.sin(diffLong) * math.cos(lat2)
 	y = math.cos(lat1) * math.sin(lat2) - (math.sin(lat1) 
@@ -126,3 +138,59 @@ def bearing(pointA, pointB):
 	compass_bearing = (initial_bearing + 360) % 360
 
 	return compass_bearing
+
+def elevation(dist, alt):
+	"""
+	Calculates the elevation angle in degrees above the horizon of an
+	aircraft at altitude `alt` feet and ground distance `dist` miles.
+	"""
+	return math.degrees(math.atan2(alt, dist * FEET_PER_MILE))
+
+def geometry(origin, lats, lons, alts):
+	"""
+	Calculates the distance, bearing and elevation from the origin to many
+	points at once.
+
+	:Parameters:
+	  - `origin`: The latitude/longitude tuple of the observer in decimal degrees
+	  - `lats`, `lons`: Sequences of latitudes and longitudes in decimal degrees
+	  - `alts`: Sequence of altitudes in feet
+
+	:Returns:
+	  A tuple of (distances in miles, bearings in degrees, elevations in degrees).
+	  These are NumPy arrays when NumPy is installed, otherwise lists computed
+	  with the scalar functions above.
+	"""
+	if numpy is None:
+		return _geometry_scalar(origin, lats, lons, alts)
+
+	lat1 = math.radians(origin[0])
+	lon1 = math.radians(origin[1])
+	lat2 = numpy.radians(numpy.asarray(lats, dtype=float))
+	lon2 = numpy.radians(numpy.asarray(lons, dtype=float))
+	alts = numpy.asarray(alts, dtype=float)
+
+	dlon = lon2 - lon1
+	dlat = lat2 - lat1
+	cos_lat1 = math.cos(lat1)
+	sin_lat1 = math.sin(lat1)
+	cos_lat2 = numpy.cos(lat2)
+
+	# haversine distance
+	a = numpy.sin(dlat/2)**2 + cos_lat1 * cos_lat2 * numpy.sin(dlon/2)**2
+	dist = 2 * numpy.arcsin(numpy.sqrt(a)) * EARTH_RADIUS_MI
+
+	# compass bearing
+	x = numpy.sin(dlon) * cos_lat2
+	y = cos_lat1 * numpy.sin(lat2) - sin_lat1 * cos_lat2 * numpy.cos(dlon)
+	az = (numpy.degrees(numpy.arctan2(x, y)) + 360) % 360
+
+	el = numpy.degrees(numpy.arctan2(alts, dist * FEET_PER_MILE))
+	return dist, az, el
+
+def _geometry_scalar(origin, lats, lons, alts):
+	lat1, lon1 = origin
+	dist = [_distance(lat1, lon1, lat2, lon2) for lat2, lon2 in zip(lats, lons)]
+	az = [_bearing(lat1, lon1, lat2, lon2) for lat2, lon2 in zip(lats, lons)]
+	el = [elevation(d, alt) for d, alt in zip(dist, alts)]
+	return dist, az, el
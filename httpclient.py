@@ -0,0 +1,86 @@
+#
+# httpclient.py
+#
+# A small keep-alive HTTP client for polling the same url over and over.
+#
+
+import http.client
+from urllib.parse import urlsplit
+
+
+class Error(Exception):
+    pass
+
+
+class KeepAliveClient(object):
+    '''
+    Fetches one url over a persistent connection, with a timeout.  Requests
+    are conditional (If-None-Match / If-Modified-Since) once the server has
+    sent an ETag or Last-Modified header, so an unchanged document costs a
+    304 with no body.  The ETag is preferred since Last-Modified only has a
+    resolution of one second.
+    '''
+    def __init__(self, url, timeout=10.0):
+        parts = urlsplit(url)
+        if parts.scheme == 'https':
+            self.connection_class = http.client.HTTPSConnection
+        elif parts.scheme == 'http':
+            self.connection_class = http.client.HTTPConnection
+        else:
+            raise Error('Unsupported url: {}'.format(url))
+        self.url = url
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path or '/'
+        if parts.query:
+            self.path += '?' + parts.query
+        self.timeout = timeout
+        self.connection = None
+        self.etag = None
+        self.last_modified = None
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def fetch(self):
+        '''
+        fetch()
+        Returns the body of the url as bytes, or None if it hasn't changed
+        since the last fetch.
+        '''
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        elif self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+
+        # A kept-alive connection may have been closed by the server since
+        # the last request, in which case it's retried once on a new one.
+        for attempt in range(2):
+            reused = self.connection is not None
+            if not reused:
+                self.connection = self.connection_class(self.host, self.port, timeout=self.timeout)
+            try:
+                self.connection.request('GET', self.path, headers=headers)
+                response = self.connection.getresponse()
+                body = response.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                self.close()
+                if not reused:
+                    raise
+            except OSError:
+                self.close()
+                raise
+
+        if response.will_close:
+            self.close()
+        if response.status == 304:
+            return None
+        if response.status != 200:
+            raise Error('GET {} returned {} {}'.format(self.url, response.status, response.reason))
+        self.etag = response.getheader('ETag')
+        self.last_modified = response.getheader('Last-Modified')
+        return body
@@ -0,0 +1,206 @@
+#
+# maprender.py
+#
+# Draws the tweet image in Python from map tiles, without a browser.
+#
+
+import math
+import os
+from io import BytesIO
+
+import tracks
+import util
+from screenshot import SCREENSHOT_FAILURES, SCREENSHOT_SECONDS
+
+# Pillow is imported when a map is first rendered, see load_pillow().
+Image = ImageDraw = None
+
+TILE_SIZE = 256
+USER_AGENT = 'AboveTustin/1.0 (+https://github.com/kevinabrandon/AboveTustin)'
+
+TRACK_COLOR = (230, 40, 40)
+AIRCRAFT_COLOR = (20, 20, 160)
+RECEIVER_COLOR = (0, 140, 0)
+
+
+class Error(Exception):
+    pass
+
+
+def world_pixel(lat, lon, zoom):
+    '''
+    world_pixel()
+    Web Mercator pixel coordinates of a point at the given zoom level.
+    '''
+    scale = TILE_SIZE * (2 ** zoom)
+    x = (lon + 180.0) / 360.0 * scale
+    lat = max(min(lat, 85.0511), -85.0511)
+    s = math.sin(math.radians(lat))
+    y = (0.5 - math.log((1 + s) / (1 - s)) / (4 * math.pi)) * scale
+    return x, y
+
+
+class TileCache(object):
+    '''
+    Map tiles, fetched once from url and then kept on disk in directory.
+    '''
+    def __init__(self, url, directory):
+        self.url = url
+        self.directory = directory
+        self.fetched = 0
+
+    def path(self, z, x, y):
+        return os.path.join(self.directory, str(z), str(x), '{}.png'.format(y))
+
+    def tile(self, z, x, y):
+        '''
+        tile()
+        Returns the tile as an RGB image, or a blank one if it can't be had.
+        '''
+        path = self.path(z, x, y)
+        if not os.path.exists(path):
+            from urllib.request import Request, urlopen
+            try:
+                request = Request(self.url.format(z=z, x=x, y=y), headers={'User-Agent': USER_AGENT})
+                data = urlopen(request, timeout=10).read()
+            except Exception as e:
+                util.error("Could not fetch tile %d/%d/%d: %s", z, x, y, e)
+                return Image.new('RGB', (TILE_SIZE, TILE_SIZE), (220, 220, 220))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(path + '.tmp', path)
+            self.fetched += 1
+        return Image.open(path).convert('RGB')
+
+
+def load_pillow():
+    '''
+    load_pillow()
+    Imports Pillow, returns False if it isn't installed.
+    '''
+    global Image, ImageDraw
+    if Image is None:
+        try:
+            from PIL import Image, ImageDraw
+        except ImportError:
+            return False
+    return True
+
+
+class TileMapDisplay(object):
+    '''
+    A map driver with the same interface as screenshot.AircraftDisplay that
+    renders the image itself: cached map tiles around the receiver, the
+    aircraft's recent track, its marker and the receiver.  The map url is
+    not used.  settings is the config.Settings of the tiles and the image.
+    '''
+    def __init__(self, url, settings):
+        if not load_pillow():
+            raise Error('Image manipulation module "Pillow" is needed to render maps')
+        self.url = url
+        self.receiver = settings.receiver
+        self.zoom = settings.tile_zoom
+        self.width = settings.image_width
+        self.height = settings.image_height
+        self.tiles = TileCache(settings.tile_url, settings.tile_cache_dir)
+        self.tracks = tracks.TrackHistory(settings.track_length)
+        self.positions = dict() # hex -> (lat, lon, track, label) of the latest position
+        self.reloads = 0
+        self.loadmap()
+
+    def loadmap(self):
+        '''
+        loadmap()
+        Composes the background map centered on the receiver once; every
+        render starts from a copy of it.
+        '''
+        cx, cy = world_pixel(self.receiver[0], self.receiver[1], self.zoom)
+        self.left = cx - self.width / 2.0
+        self.top = cy - self.height / 2.0
+        background = Image.new('RGB', (self.width, self.height))
+        x0 = int(math.floor(self.left / TILE_SIZE))
+        y0 = int(math.floor(self.top / TILE_SIZE))
+        x1 = int(math.floor((self.left + self.width) / TILE_SIZE))
+        y1 = int(math.floor((self.top + self.height) / TILE_SIZE))
+        count = 2 ** self.zoom
+        for tx in range(x0, x1 + 1):
+            for ty in range(y0, y1 + 1):
+                if ty < 0 or ty >= count:
+                    continue
+                tile = self.tiles.tile(self.zoom, tx % count, ty)
+                background.paste(tile, (int(round(tx * TILE_SIZE - self.left)), int(round(ty * TILE_SIZE - self.top))))
+        self.background = background
+        print("map rendered from tiles ({} fetched)".format(self.tiles.fetched))
+
+    def close(self):
+        pass
+
+    def pixel(self, lat, lon):
+        x, y = world_pixel(lat, lon, self.zoom)
+        return x - self.left, y - self.top
+
+    def observe(self, snapshot):
+        '''
+        observe()
+        Records the positions of the aircraft that moved, and forgets the
+        aircraft that are gone.
+        '''
+        self.tracks.observe(snapshot)
+        for dhex in snapshot.delta.moved:
+            a = snapshot[dhex]
+            if a.lat is None or a.lon is None:
+                continue
+            self.positions[dhex] = (a.lat, a.lon, a.track, '{} {}ft'.format(a.ident_desc(), a.altitude))
+        for dhex in snapshot.delta.removed:
+            self.positions.pop(dhex, None)
+
+    def render(self, dhex):
+        '''
+        render()
+        Draws the map with the aircraft, returns it as PNG bytes.
+        '''
+        image = self.background.copy()
+        draw = ImageDraw.Draw(image)
+
+        track = self.tracks.get(dhex)
+        if track is not None and len(track) > 1:
+            draw.line([self.pixel(lat, lon) for t, lat, lon, alt in track.points()], fill=TRACK_COLOR, width=3)
+
+        rx, ry = self.pixel(*self.receiver)
+        draw.ellipse((rx - 5, ry - 5, rx + 5, ry + 5), fill=RECEIVER_COLOR)
+
+        lat, lon, heading, label = self.positions[dhex]
+        x, y = self.pixel(lat, lon)
+        heading = math.radians(heading or 0)
+        # a triangle pointing along the aircraft's track
+        points = []
+        for angle, length in ((0, 14), (2.5, 10), (-2.5, 10)):
+            points.append((x + length * math.sin(heading + angle), y - length * math.cos(heading + angle)))
+        draw.polygon(points, fill=AIRCRAFT_COLOR)
+        draw.text((x + 14, y - 6), label, fill=AIRCRAFT_COLOR)
+
+        out = BytesIO()
+        image.save(out, format='PNG')
+        return out.getvalue()
+
+    def clickOnAirplane(self, text):
+        '''
+        clickOnAirplane()
+        Renders the airplane with the hex code text, returns PNG bytes or
+        None if it hasn't been seen.
+        '''
+        dhex = text.upper()
+        if dhex not in self.positions:
+            print("couldn't find the object")
+            SCREENSHOT_FAILURES.inc()
+            return None
+        try:
+            with SCREENSHOT_SECONDS.time():
+                im = self.render(dhex)
+        except Exception as e:
+            util.error("Could not render airplane: {}".format(e))
+            SCREENSHOT_FAILURES.inc()
+            return None
+        print("success rendering map ({} bytes)".format(len(im)))
+        return im
@@ -0,0 +1,292 @@
+#
+# messages.py
+#
+# Renders the text of a tweet.  The templates and the hashtag rules are
+# compiled once, when the renderer is built from the configuration, and a
+# message is rendered in a single pass: the template is filled in, then
+# the hashtags that apply are added while they fit in the length budget.
+# Nothing here depends on Twitter.
+#
+# Usage:
+#     python messages.py [count]
+#
+# renders a sample message count times and prints the time per message.
+#
+
+import ast
+import string
+import sys
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import geomath
+import util
+
+# The longest message Twitter accepts.
+MAX_LENGTH = 280
+
+# The hashtags added when the [hashtags] section is missing, in order.
+# Each is added when its condition, an expression of the variables in
+# RULE_VARIABLES, is true.
+DEFAULT_RULES = OrderedDict([
+    ('#AfterHours', 'hour < 7 or hour >= 23 or (weekday == 6 and hour < 8)'),
+    ('#2CloseForComfort', 'altitude < 1000'),
+    ('#ProbablyLanding', "1000 <= altitude < 2500 and heading in ('S', 'SW')"),
+    ('#UpInTheClouds', '20000 < altitude < 35000'),
+    ('#WayTheHeckUpThere', 'altitude >= 35000'),
+    ('#MovingQuickly', '300 < speed < 500'),
+    ('#FlyingFast', '500 <= speed < 770'),
+    ('#SpeedDemon', 'speed >= 770'),
+])
+
+# What a hashtag rule can test.  weekday is 0 on Monday to 6 on Sunday.
+RULE_VARIABLES = ('flight', 'icao', 'squawk', 'zone', 'distance', 'altitude', 'el', 'az',
+                  'heading', 'speed', 'vert_rate', 'rssi', 'hour', 'minute', 'weekday')
+
+# The syntax allowed in a hashtag rule: comparisons, and/or/not,
+# arithmetic, tuples for `in`, variables and constants.  No calls and no
+# attributes, so a rule can't do anything but compute a value.
+RULE_NODES = (ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub,
+              ast.Compare, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn,
+              ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Mod,
+              ast.Tuple, ast.List, ast.Name, ast.Load, ast.Constant)
+
+
+class Error(Exception):
+    pass
+
+
+class CompiledTemplate(object):
+    '''
+    A string.Template turned into a str.format() string once, so filling it
+    in is a single format_map() call instead of a regular expression pass.
+    Missing variables raise KeyError, like Template.substitute().
+    '''
+    def __init__(self, template):
+        self.template = template
+        self.names = []
+        parts = []
+        position = 0
+        for match in string.Template.pattern.finditer(template):
+            parts.append(self.escape(template[position:match.start()]))
+            position = match.end()
+            name = match.group('named') or match.group('braced')
+            if name is not None:
+                self.names.append(name)
+                parts.append('{' + name + '}')
+            elif match.group('escaped') is not None:
+                parts.append('$')
+            else:
+                raise Error('Invalid placeholder at character {} of {!r}'.format(match.start(), template))
+        parts.append(self.escape(template[position:]))
+        self.format = ''.join(parts)
+
+    @staticmethod
+    def escape(text):
+        return text.replace('{', '{{').replace('}', '}}')
+
+    def render(self, args):
+        return self.format.format_map(args)
+
+
+class HashtagRule(object):
+    '''
+    A hashtag and the compiled condition that decides if it applies.
+    '''
+    def __init__(self, hashtag, condition):
+        self.hashtag = hashtag if hashtag.startswith('#') else '#' + hashtag
+        self.condition = condition
+        try:
+            tree = ast.parse(condition, mode='eval')
+        except SyntaxError as e:
+            raise Error('Invalid condition for {}: {}'.format(self.hashtag, e))
+        for node in ast.walk(tree):
+            if not isinstance(node, RULE_NODES):
+                raise Error('{} is not allowed in the condition for {}'.format(
+                    type(node).__name__, self.hashtag))
+            if isinstance(node, ast.Name) and node.id not in RULE_VARIABLES:
+                raise Error('Unknown variable {} in the condition for {}, the variables are {}'.format(
+                    node.id, self.hashtag, ', '.join(RULE_VARIABLES)))
+        self.code = compile(tree, self.hashtag, 'eval')
+
+    def applies(self, variables):
+        try:
+            return bool(eval(self.code, {'__builtins__': {}}, variables))
+        except TypeError:
+            # a comparison with a value the aircraft doesn't have (None)
+            return False
+        except Exception as e:
+            # a division by zero for instance, the tweet goes out without it
+            util.error("Could not apply %s if %s: %s", self.hashtag, self.condition, e)
+            return False
+
+
+def template_args(a, faInfo=False, zone=None):
+    '''
+    template_args()
+    The template variables for aircraft a, see the [tweet] section of
+    config.sample.ini.
+    '''
+    flight = (a.flight or a.hex).replace(" ", "")
+    args = {
+        'zone': zone.name if zone is not None else '',
+        'flight': flight,
+        'icao': a.hex.replace(" ", ""),
+        'dist_mi': "%.1f" % a.distance,
+        'dist_km': "%.1f" % geomath.mi2km(a.distance),
+        'dist_nm': "%.1f" % geomath.mi2nm(a.distance),
+        'alt_ft': a.altitude,
+        'alt_m': "%.1f" % geomath.ft2m(a.altitude),
+        'el': "%.1f" % a.el,
+        'az': "%.1f" % a.az,
+        'heading': geomath.HeadingStr(a.track),
+        'speed_mph': "%.1f" % a.speed,
+        'speed_kmph': "%.1f" % geomath.mi2km(a.speed),
+        'speed_kts': "%.1f" % geomath.mi2nm(a.speed),
+        'time': a.time.strftime('%H:%M:%S'),
+        'squawk': a.squawk,
+        'vert_rate_ftpm': a.vert_rate,
+        'vert_rate_mpm': "%.1f" % geomath.ft2m(a.vert_rate),
+        'rssi': a.rssi,
+    }
+    if faInfo:
+        args['orig_name'] = faInfo['orig_name']
+        args['dest_name'] = faInfo['dest_name']
+        args['orig_code'] = faInfo['orig_code']
+        args['dest_code'] = faInfo['dest_code']
+        args['orig_alt'] = faInfo['orig_alt'] or faInfo['orig_code']
+        args['dest_alt'] = faInfo['dest_alt'] or faInfo['dest_code']
+        args['orig_city'] = faInfo['orig_city'] or ''
+        args['dest_city'] = faInfo['dest_city'] or ''
+    return args
+
+
+def rule_variables(a, args):
+    return {
+        'flight': args['flight'],
+        'icao': args['icao'],
+        'squawk': a.squawk,
+        'zone': args['zone'],
+        'distance': a.distance,
+        'altitude': a.altitude,
+        'el': a.el,
+        'az': a.az,
+        'heading': args['heading'],
+        'speed': a.speed,
+        'vert_rate': a.vert_rate,
+        'rssi': a.rssi,
+        'hour': a.time.hour,
+        'minute': a.time.minute,
+        'weekday': a.time.weekday(),
+    }
+
+
+class MessageRenderer(object):
+    '''
+    Renders messages from the compiled templates and hashtag rules.  The
+    text from the template comes first and is cut to max_length if it is
+    too long; the hashtags of the rules that apply, then the default
+    hashtags, follow in order as long as each fits in what is left.
+    '''
+    def __init__(self, tweet_template, fa_tweet_template=None, default_hashtags=(), rules=None,
+                 max_length=MAX_LENGTH):
+        self.templates = dict()     # template text -> CompiledTemplate
+        self.tweet_template = self.compile(tweet_template)
+        self.fa_tweet_template = self.compile(fa_tweet_template or tweet_template)
+        self.default_hashtags = [h for h in default_hashtags if h]
+        if rules is None:
+            rules = DEFAULT_RULES
+        self.rules = [HashtagRule(hashtag, condition) for hashtag, condition in rules.items()]
+        self.max_length = max_length
+
+    def compile(self, template):
+        compiled = self.templates.get(template)
+        if compiled is None:
+            compiled = self.templates[template] = CompiledTemplate(template)
+        return compiled
+
+    def templates_for(self, zone):
+        if zone is not None and zone.tweet_template:
+            return (self.compile(zone.tweet_template),
+                    self.compile(zone.fa_tweet_template or zone.tweet_template))
+        return self.tweet_template, self.fa_tweet_template
+
+    def hashtags(self, a, args, zone=None):
+        '''
+        hashtags()
+        The hashtags of the rules that apply to aircraft a.
+        '''
+        variables = rule_variables(a, args)
+        return [rule.hashtag for rule in self.rules if rule.applies(variables)]
+
+    def render(self, a, faInfo=False, zone=None):
+        '''
+        render()
+        The message for aircraft a.  faInfo is the FlightAware flight
+        details or False, zone the alarm zone whose templates are used if it
+        has its own.
+        '''
+        args = template_args(a, faInfo, zone)
+        tweetTemplate, faTweetTemplate = self.templates_for(zone)
+        if faInfo and args['orig_alt'] and args['dest_alt']:
+            text = faTweetTemplate.render(args)
+        else:
+            text = tweetTemplate.render(args)
+        if len(text) > self.max_length:
+            text = text[:self.max_length - 1] + '…'
+        parts = [text]
+        budget = self.max_length - len(text)
+        for hashtag in self.hashtags(a, args, zone) + self.default_hashtags:
+            # each hashtag takes a space in front of it
+            if len(hashtag) + 1 <= budget:
+                parts.append(hashtag)
+                budget -= len(hashtag) + 1
+        return ' '.join(parts)
+
+
+def from_config(parser, max_length=MAX_LENGTH):
+    '''
+    from_config()
+    The renderer for the [tweet] section, and the [hashtags] section if
+    there is one.  Each of its options is a rule of the form
+    "<hashtag> if <condition>"; the names of the options don't matter.
+    '''
+    rules = None
+    if parser.has_section('hashtags'):
+        rules = OrderedDict()
+        for name in parser['hashtags']:
+            if name in parser.defaults():
+                continue
+            # raw, the conditions may use %
+            hashtag, sep, condition = parser.get('hashtags', name, raw=True).partition(' if ')
+            if not sep:
+                raise Error('The hashtag rule {} should be "<hashtag> if <condition>"'.format(name))
+            rules[hashtag.strip()] = condition.strip()
+    return MessageRenderer(
+        parser.get('tweet', 'tweet_template'),
+        parser.get('tweet', 'fa_tweet_template', fallback=None),
+        parser.get('tweet', 'default_hashtags', fallback='').split(' '),
+        rules,
+        max_length)
+
+
+if __name__ == "__main__":
+    import config
+    import flightdata
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    renderer = from_config(config.load())
+    a = flightdata.AirCraftData('a1b2c3', '1200', 'SWA1234', None, 33.7, -117.8, 1800, -768,
+                                210.0, 160.0, 1000, 0.5, False, 7, 0.4, -12.5, 0.8, 175.0, 65.0,
+                                datetime(2026, 10, 18, 6, 30))
+    faInfo = {'orig_name': 'San Francisco Intl', 'orig_city': 'San Francisco, CA', 'orig_alt': 'SFO',
+              'orig_code': 'KSFO', 'dest_name': 'John Wayne', 'dest_city': 'Santa Ana, CA',
+              'dest_alt': 'SNA', 'dest_code': 'KSNA'}
+    print(renderer.render(a))
+    print(renderer.render(a, faInfo))
+    started = time.perf_counter()
+    for i in range(count):
+        renderer.render(a, faInfo)
+    elapsed = time.perf_counter() - started
+    print("{:.1f}us per message".format(elapsed / count * 1e6))
@@ -0,0 +1,305 @@
+#
+# metrics.py
+#
+# Counters, gauges and histograms served over HTTP in the Prometheus text
+# format.  Until start() is called with a port, which the tracker does when
+# metrics_port is set, the metrics record nothing and instrumented code
+# costs next to nothing.
+#
+
+import bisect
+import math
+import threading
+import time
+from collections import OrderedDict
+
+# Set by start() when the metrics are served.  Until then the metrics
+# record nothing.
+ENABLED = False
+
+# Seconds, from a fast refresh stage to a slow tweet.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+registry = OrderedDict()    # name -> metric
+registry_lock = threading.Lock()
+
+
+class Error(Exception):
+    pass
+
+
+class Timer(object):
+    '''
+    Observes the seconds spent in a with block on a histogram.
+    '''
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class NullMetric(object):
+    '''
+    Stands in for a timer when the metrics are disabled.
+    '''
+    def labels(self, *values):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def set_function(self, function):
+        pass
+
+    def observe(self, value):
+        pass
+
+    def time(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL = NullMetric()
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                          for k, v in pairs) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric(object):
+    '''
+    A metric, or with label names a family of metrics told apart by their
+    label values (see labels()).
+    '''
+    kind = None
+
+    def __init__(self, name, help, labelnames=(), values=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.labelvalues = tuple(values)
+        self.lock = threading.Lock()
+        self.children = OrderedDict()   # label values -> metric
+
+    def labels(self, *values):
+        if len(values) != len(self.labelnames):
+            raise Error('{} takes the labels {}'.format(self.name, ', '.join(self.labelnames)))
+        values = tuple(str(v) for v in values)
+        with self.lock:
+            child = self.children.get(values)
+            if child is None:
+                child = self.children[values] = self.child(values)
+            return child
+
+    def child(self, values):
+        return self.__class__(self.name, self.help, self.labelnames, values)
+
+    def expose(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        if self.labelnames:
+            with self.lock:
+                children = list(self.children.values())
+            for child in children:
+                lines.extend(child.samples())
+        else:
+            lines.extend(self.samples())
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        if ENABLED:
+            with self.lock:
+                self.value += amount
+
+    def samples(self):
+        return ['{}{} {}'.format(self.name, _format_labels(self.labelnames, self.labelvalues),
+                                 _format_value(self.value))]
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.value = 0.0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        if ENABLED:
+            with self.lock:
+                self.value += amount
+
+    def dec(self, amount=1):
+        if ENABLED:
+            with self.lock:
+                self.value -= amount
+
+    def set_function(self, function):
+        '''
+        set_function()
+        Reads the value from function() at every scrape instead.
+        '''
+        self.function = function
+
+    def samples(self):
+        value = self.value
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception:
+                value = math.nan
+        return ['{}{} {}'.format(self.name, _format_labels(self.labelnames, self.labelvalues),
+                                 _format_value(value))]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), values=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames, values)
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def child(self, values):
+        return Histogram(self.name, self.help, self.labelnames, values, self.buckets)
+
+    def observe(self, value):
+        if not ENABLED:
+            return
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def time(self):
+        return Timer(self) if ENABLED else NULL
+
+    def samples(self):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            lines.append('{}_bucket{} {}'.format(
+                self.name,
+                _format_labels(self.labelnames, self.labelvalues, [('le', _format_value(bound))]),
+                cumulative))
+        labels = _format_labels(self.labelnames, self.labelvalues)
+        lines.append('{}_sum{} {}'.format(self.name, labels, _format_value(total)))
+        lines.append('{}_count{} {}'.format(self.name, labels, cumulative))
+        return lines
+
+
+def _register(metric_class, name, help, labels, **kwargs):
+    with registry_lock:
+        metric = registry.get(name)
+        if metric is None:
+            metric = registry[name] = metric_class(name, help, labels, **kwargs)
+        elif not isinstance(metric, metric_class):
+            raise Error('{} is already registered as a {}'.format(name, metric.kind))
+        return metric
+
+
+def counter(name, help, labels=()):
+    return _register(Counter, name, help, labels)
+
+
+def gauge(name, help, labels=()):
+    return _register(Gauge, name, help, labels)
+
+
+def histogram(name, help, labels=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram, name, help, labels, buckets=buckets)
+
+
+def expose():
+    '''
+    expose()
+    Every metric in the Prometheus text format.
+    '''
+    with registry_lock:
+        metrics = list(registry.values())
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.expose())
+    return '\n'.join(lines) + '\n'
+
+
+def _handler(base):
+    class MetricsHandler(base):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = expose().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return MetricsHandler
+
+
+def start(port, address='127.0.0.1'):
+    '''
+    start()
+    Turns the metrics on and serves them at http://address:port/metrics
+    from a background thread.  Does nothing if port is 0.
+    '''
+    global ENABLED
+    if port <= 0:
+        return None
+    ENABLED = True
+    import http.server
+    server = http.server.ThreadingHTTPServer((address, port), _handler(http.server.BaseHTTPRequestHandler))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics', daemon=True)
+    thread.start()
+    print("serving metrics at http://{}:{}/metrics".format(address or '0.0.0.0', port))
+    return server
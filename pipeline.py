@@ -0,0 +1,121 @@
+#
+# pipeline.py
+#
+# A bounded work queue drained by a pool of worker threads, so the slow
+# parts of an alarm (screenshot, FlightAware, tweeting) never block polling.
+#
+
+import queue
+import threading
+import traceback
+
+
+class Error(Exception):
+    pass
+
+
+DROP_POLICIES = ('oldest', 'newest', 'block')
+
+
+class Pipeline(object):
+    '''
+    Hands submitted items to handler(item) on `workers` threads.  At most
+    queue_size items wait in the queue; when it is full the drop policy
+    decides what happens to a new item:
+        oldest - the oldest waiting item is dropped to make room
+        newest - the new item is dropped
+        block  - submit() waits up to block_timeout seconds for room
+                 (backpressure), then drops the new item
+    on_drop(item), if given, is called with every item dropped.
+    '''
+    def __init__(self, handler, workers=1, queue_size=16, drop_policy='oldest',
+                 block_timeout=1.0, name='pipeline', on_drop=None):
+        if drop_policy not in DROP_POLICIES:
+            raise Error('Unknown drop policy: {}. Valid policies are {}'.format(
+                drop_policy, ', '.join(DROP_POLICIES)))
+        self.handler = handler
+        self.on_drop = on_drop
+        self.drop_policy = drop_policy
+        self.block_timeout = block_timeout
+        self.name = name
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.submitted = 0  # items accepted into the queue
+        self.dropped = 0    # items dropped because the queue was full
+        self.processed = 0  # items the handler finished
+        self.failed = 0     # items the handler raised on
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self.work, name='{}-{}'.format(name, i), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, item):
+        '''
+        submit()
+        Queues an item for the workers.  Never blocks unless the drop policy
+        is 'block'.  Returns False if the item was dropped.
+        '''
+        dropped = None
+        with self.lock:
+            try:
+                if self.drop_policy == 'block':
+                    self.queue.put(item, timeout=self.block_timeout)
+                else:
+                    self.queue.put_nowait(item)
+                self.submitted += 1
+            except queue.Full:
+                if self.drop_policy == 'oldest':
+                    try:
+                        dropped = self.queue.get_nowait()
+                        self.queue.task_done()
+                    except queue.Empty:
+                        pass
+                    self.queue.put_nowait(item)
+                    self.submitted += 1
+                else:
+                    dropped = item
+            if dropped is not None:
+                self.dropped += 1
+        if dropped is not None:
+            print("{}: queue full, dropping {}".format(self.name, dropped))
+            if self.on_drop is not None:
+                self.on_drop(dropped)
+        return dropped is not item
+
+    def work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            try:
+                self.handler(item)
+                self.processed += 1
+            except Exception:
+                self.failed += 1
+                print("exception in {} worker:".format(self.name))
+                traceback.print_exc()
+            finally:
+                self.queue.task_done()
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def join(self):
+        '''
+        join()
+        Waits until every queued item has been handled.
+        '''
+        self.queue.join()
+
+    def stop(self):
+        '''
+        stop()
+        Lets the workers finish what is queued, then ends them.
+        '''
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
@@ -0,0 +1,166 @@
+#
+# poller.py
+#
+# Polls the data source from an asyncio event loop in a background thread,
+# so fetching and parsing overlap with the tracker's processing.
+#
+
+import asyncio
+import math
+import queue
+import threading
+import traceback
+
+import metrics
+
+DROPPED = metrics.counter('abovetustin_snapshots_dropped_total',
+                          'Snapshots replaced before the tracker took them')
+
+
+class AsyncPoller(object):
+    '''
+    Refreshes a FlightData on a fixed cadence: polls are scheduled every
+    `interval` seconds from when the previous one was due, independent of
+    how long processing takes.  New snapshots go into a queue that holds only
+    the newest one, so the consumer never works on stale data; when a
+    snapshot is replaced before it was consumed its delta is carried over
+    into the newer one.
+    '''
+    def __init__(self, flightdata, interval):
+        self.flightdata = flightdata
+        self.interval = interval
+        self.snapshots = queue.Queue(maxsize=1)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.loop = None
+        self.wakeup = None
+        self.stopped = threading.Event()
+        self.last_time = None
+        self.polls = 0      # number of polls made
+        self.unchanged = 0  # polls that found nothing new
+        self.dropped = 0    # snapshots replaced before they were consumed
+
+    def start(self):
+        self.publish(self.flightdata.aircraft)
+        self.thread = threading.Thread(target=self.run, name='poller', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        asyncio.run(self.poll_forever())
+
+    def set_interval(self, interval):
+        '''
+        set_interval()
+        Changes the time between polls.  When it gets shorter the poll that
+        is being waited for is moved up.
+        '''
+        shorter = interval < self.interval
+        self.interval = interval
+        if shorter and self.loop is not None:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    async def poll_forever(self):
+        loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self.loop = loop
+        next_poll = loop.time()
+        while not self.stopped.is_set():
+            self.polls += 1
+            try:
+                changed = await loop.run_in_executor(None, self.flightdata.refresh)
+            except Exception:
+                print("exception in AsyncPoller.poll_forever():")
+                traceback.print_exc()
+                changed = False
+            if changed:
+                self.publish(self.flightdata.aircraft)
+            else:
+                self.unchanged += 1
+
+            # keep the cadence; if we fell behind skip the missed polls
+            # rather than firing them back to back.
+            last_poll = next_poll
+            next_poll += self.interval
+            now = loop.time()
+            if next_poll < now:
+                next_poll = now
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), next_poll - now)
+                # the interval got shorter while we were waiting
+                next_poll = max(loop.time(), last_poll + self.interval)
+                await asyncio.sleep(next_poll - loop.time())
+            except asyncio.TimeoutError:
+                pass
+
+    def publish(self, snapshot):
+        if snapshot is None or snapshot.time == self.last_time:
+            return
+        self.last_time = snapshot.time
+        with self.lock:
+            try:
+                older = self.snapshots.get_nowait()
+                snapshot.delta.combine(older.delta, snapshot.rows.keys())
+                self.dropped += 1
+                DROPPED.inc()
+            except queue.Empty:
+                pass
+            self.snapshots.put_nowait(snapshot)
+
+    def get(self, timeout=None):
+        '''
+        get()
+        Waits up to timeout seconds for the next snapshot.  Returns None if
+        there wasn't one.
+        '''
+        try:
+            return self.snapshots.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class PollScheduler(object):
+    '''
+    Chooses the poll interval from how soon any aircraft is predicted to
+    enter the alarm zone: min_interval while something is in (or about to
+    enter) the zone, stretching up to max_interval when the sky around it
+    is empty.  The interval is a `lead` fraction of the soonest predicted
+    entry, so polls get faster as an aircraft closes in.
+    '''
+    def __init__(self, zone, min_interval, max_interval, lead=0.25):
+        self.zone = zone
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.lead = lead
+        self.soonest = math.inf   # seconds until the soonest predicted entry
+
+    def interval(self, snapshot, active=False):
+        '''
+        interval()
+        The interval to poll at after this snapshot.  active means there are
+        aircraft being tracked in the zone already.
+        '''
+        if active or self.max_interval <= self.min_interval:
+            return self.min_interval
+        soonest = math.inf
+        time_to_entry = self.zone.time_to_entry
+        for i in range(len(snapshot)):
+            lat = snapshot.lat[i]
+            lon = snapshot.lon[i]
+            if lat is None or lon is None:
+                continue
+            t = time_to_entry(lat, lon, snapshot.altitude[i], snapshot.track[i],
+                              snapshot.speed[i], snapshot.vert_rate[i])
+            if t < soonest:
+                soonest = t
+                if t <= self.min_interval:
+                    break
+        self.soonest = soonest
+        return max(self.min_interval, min(self.max_interval, soonest * self.lead))
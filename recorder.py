@@ -0,0 +1,195 @@
+#
+# recorder.py
+#
+# Records the raw aircraft.json / AircraftList.json payloads of a receiver
+# to a compressed file, and replays them into a FlightData later, so the
+# tracker can be run and measured without a live receiver.
+#
+# A recording is a gzip file of JSON lines, one per payload:
+#     {"time": <seconds since the epoch when fetched>, "data": "<payload>"}
+# With several receivers, "source" is the index of the one in data_url.
+#
+# Usage:
+#     python recorder.py record <data_url> <file> [interval]
+#     python recorder.py replay <file> [speed]
+#
+
+import gzip
+import json
+import queue
+import sys
+import threading
+import time
+import traceback
+
+import poller
+
+
+class Recorder(object):
+    '''
+    Appends timestamped payloads to a recording.  Each line is flushed as it
+    is written, so a recording that was cut short is still readable.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = gzip.open(filename, 'at', encoding='utf-8')
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def write(self, raw_data, when=None, source=None):
+        if isinstance(raw_data, bytes):
+            raw_data = raw_data.decode('utf-8')
+        record = {'time': time.time() if when is None else when, 'data': raw_data}
+        if source is not None:
+            record['source'] = source
+        line = json.dumps(record)
+        with self.lock:
+            self.file.write(line + '\n')
+            self.file.flush()
+            self.count += 1
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def read(filename):
+    '''
+    read()
+    Yields the (time, payload bytes, source) of each record in a recording.
+    '''
+    with gzip.open(filename, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # the last line of a recording that was cut short
+                break
+            yield record['time'], record['data'].encode('utf-8'), record.get('source', 0)
+
+
+class Replay(poller.AsyncPoller):
+    '''
+    A drop-in replacement for the AsyncPoller that feeds a recording to the
+    FlightData instead of polling the receiver.  With a speed of 1 the
+    payloads come at the pace they were recorded, 2 is twice as fast and so
+    on; a speed of 0 replays as fast as the consumer takes the snapshots,
+    without dropping any.  `stopped` is set once the recording is done.
+    '''
+    def __init__(self, flightdata, filename, speed=1.0):
+        super().__init__(flightdata, 0)
+        self.filename = filename
+        self.speed = speed
+
+    def set_interval(self, interval):
+        self.interval = interval
+
+    def run(self):
+        start = None
+        try:
+            for when, raw_data, source in read(self.filename):
+                if self.stopped.is_set():
+                    return
+                if self.speed > 0:
+                    if start is None:
+                        start = (when, time.monotonic())
+                    delay = start[1] + (when - start[0]) / self.speed - time.monotonic()
+                    if delay > 0 and self.stopped.wait(delay):
+                        return
+                self.polls += 1
+                if self.flightdata.update(raw_data, source):
+                    self.publish(self.flightdata.aircraft)
+                else:
+                    self.unchanged += 1
+        except Exception:
+            print("exception in Replay.run():")
+            traceback.print_exc()
+        finally:
+            self.stopped.set()
+
+    def publish(self, snapshot):
+        if self.speed > 0 or snapshot is None:
+            return super().publish(snapshot)
+        # at full speed wait for the consumer rather than dropping snapshots
+        self.last_time = snapshot.time
+        while not self.stopped.is_set():
+            try:
+                self.snapshots.put(snapshot, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+    def get(self, timeout=None):
+        snapshot = super().get(0 if self.stopped.is_set() else timeout)
+        if snapshot is None and self.stopped.is_set():
+            # the recording may have ended while we waited
+            snapshot = super().get(0)
+        return snapshot
+
+
+def record(data_url, filename, interval=1.0):
+    '''
+    record()
+    Polls the data url every interval seconds and records every payload
+    that changed, until interrupted.
+    '''
+    import httpclient
+
+    client = httpclient.KeepAliveClient(data_url)
+    recorder = Recorder(filename)
+    print("recording {} to {}, ctrl-c to stop".format(data_url, filename))
+    try:
+        while True:
+            try:
+                raw_data = client.fetch()
+                if raw_data is not None:
+                    recorder.write(raw_data)
+            except Exception as e:
+                print("could not fetch {}: {}".format(data_url, e))
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        recorder.close()
+    print("recorded {} payloads".format(recorder.count))
+
+
+def replay(filename, speed=0):
+    '''
+    replay()
+    Replays a recording through the configured parsers and prints what
+    each snapshot changed.
+    '''
+    import config
+    import datasource
+    import flightdata
+
+    settings = config.settings()
+    fd = flightdata.FlightData(settings.receiver,
+                               parser=[parser for url, parser in datasource.get_receivers(settings)])
+    source = Replay(fd, filename, speed).start()
+    count = 0
+    started = time.perf_counter()
+    while True:
+        snapshot = source.get(timeout=1.0)
+        if snapshot is None:
+            if source.stopped.is_set():
+                break
+            continue
+        count += 1
+        print("{}: {} aircraft, {}".format(snapshot.time, len(snapshot), snapshot.delta))
+    elapsed = time.perf_counter() - started
+    print("replayed {} snapshots in {:.2f}s".format(count, elapsed))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 4 and sys.argv[1] == 'record':
+        record(sys.argv[2], sys.argv[3], float(sys.argv[4]) if len(sys.argv) > 4 else 1.0)
+    elif len(sys.argv) >= 3 and sys.argv[1] == 'replay':
+        replay(sys.argv[2], float(sys.argv[3]) if len(sys.argv) > 3 else 0)
+    else:
+        print("usage: recorder.py record <data_url> <file> [interval]")
+        print("       recorder.py replay <file> [speed]")
+        sys.exit(1)
@@ -4,83 +4,261 @@
 # kevinabrandon@gmail.com
 #
 
+import queue
 import sys
-import time
+import threading
 import traceback
-from selenium import webdriver
-from selenium.common import exceptions as seleniumexceptions
-from selenium.webdriver.support.wait import WebDriverWait
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
-from configparser import ConfigParser
+from contextlib import contextmanager
+from io import BytesIO
 
+import metrics
 import util
 
-# Read the configuration file for this application.
-parser = ConfigParser()
-parser.read('config.ini')
-
-# Assign AboveTustin variables.
-abovetustin_image_width = int(parser.get('abovetustin', 'image_width'))
-abovetustin_image_height = int(parser.get('abovetustin', 'image_height'))
-
-#  Check for Crop settings
-if parser.has_section('crop'):
-    do_crop = parser.getboolean('crop', 'do_crop')
-    crop_x = parser.getint('crop', 'crop_x')
-    crop_y = parser.getint('crop', 'crop_y')
-    crop_width = parser.getint('crop', 'crop_width')
-    crop_height = parser.getint('crop', 'crop_height')
-    if do_crop:
+# The metrics of the tweet images, also used by the maprender driver.
+SCREENSHOT_SECONDS = metrics.histogram('abovetustin_screenshot_seconds', 'Seconds to capture the image of an airplane')
+SCREENSHOT_FAILURES = metrics.counter('abovetustin_screenshot_failures_total', 'Airplane images that could not be captured')
+BROWSER_RELOADS = metrics.counter('abovetustin_browser_reloads_total', 'Browser pages replaced by fresh ones')
+
+# True once every image on the page (the map tiles) has finished loading.
+IMAGES_LOADED_JS = """
+return Array.prototype.every.call(document.images, function(img) { return img.complete; });
+"""
+
+# The JS heap size of a page in bytes, or 0 if the browser doesn't say.
+PAGE_MEMORY_JS = """
+return (window.performance && performance.memory) ? performance.memory.usedJSHeapSize : 0;
+"""
+
+
+# Selenium, and Pillow for cropping, are slow to import and only needed
+# once a browser is started, see load_selenium().
+webdriver = seleniumexceptions = WebDriverWait = By = EC = None
+Image = None
+
+
+def load_selenium(crop=False):
+    '''
+    load_selenium()
+    Imports Selenium, and Pillow if the screenshots are cropped, the first
+    time a browser is needed.  Returns False if they should be cropped but
+    Pillow isn't installed.
+    '''
+    global webdriver, seleniumexceptions, WebDriverWait, By, EC, Image
+    if webdriver is None:
+        from selenium import webdriver
+        from selenium.common import exceptions as seleniumexceptions
+        from selenium.webdriver.support.wait import WebDriverWait
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
+    if crop and Image is None:
         try:
             from PIL import Image
-            from io import BytesIO
-            print('will crop')
         except ImportError:
-            print('Image manipulation module "Pillow" not found, cropping disabled')
-            do_crop = False
-else:
-    do_crop = False
-
-# Assign dump1090 variables.
-g_request_timeout = float(parser.get('abovetustin', 'request_timeout'))
+            return False
+    return True
 
 
 class AircraftDisplay(object):
-    def __init__(self, url):
+    '''
+    Keeps a pool of headless Chromium pages with the map loaded and ready,
+    so a screenshot never waits for a browser to start.  A page whose JS
+    heap grows past browser_max_memory_mb, or that stops answering, is
+    replaced with a fresh one; the idle pages are checked every
+    browser_recycle_interval seconds.  settings is the config.Settings of
+    the browser and the image.
+    '''
+    def __init__(self, url, settings):
         self.url = url
-        self.browser = None
-        self.loadmap()
+        self.settings = settings
+        self.crop = settings.crop
+        if not load_selenium(self.crop is not None):
+            print('Image manipulation module "Pillow" not found, cropping disabled')
+            self.crop = None
+        elif self.crop is not None:
+            print('will crop')
+        self.pages = queue.Queue()
+        self.reloads = 0
+        for i in range(settings.browser_pool_size):
+            self.pages.put(self.loadmap())
+        # the idle pages are checked in the background, never by the
+        # polling loop
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.recycler, name='browser-recycler', daemon=True)
+        self.thread.start()
+
+    def newbrowser(self):
+        '''
+        newbrowser()
+        Starts a headless Chromium with the configured window size.
+        '''
+        options = webdriver.ChromeOptions()
+        options.add_argument('--headless')
+        options.add_argument('--disable-gpu')
+        options.add_argument('--hide-scrollbars')
+        options.add_argument('--window-size={},{}'.format(self.settings.image_width, self.settings.image_height))
+        if self.settings.chrome_binary:
+            options.binary_location = self.settings.chrome_binary
+        browser = webdriver.Chrome(executable_path=self.settings.chromedriver, chrome_options=options)
+        browser.set_page_load_timeout(15)
+        return browser
 
     def loadmap(self):
+        '''
+        loadmap()
+        Creates a browser, loads the webpage and sets up the map.
+        Returns the browser.
+        '''
         raise NotImplementedError
 
-    def reload(self):
-        self.browser.quit()
-        self.browser = None
-        self.loadmap()
+    def selectAirplane(self, browser, text):
+        '''
+        selectAirplane()
+        Selects the airplane on the map.  Returns False if it isn't there.
+        '''
+        raise NotImplementedError
+
+    @contextmanager
+    def page(self):
+        '''
+        page()
+        Borrows a page from the pool for the duration of the with block.
+        '''
+        browser = self.pages.get()
+        try:
+            yield browser
+        finally:
+            self.release(browser)
+
+    def observe(self, snapshot):
+        '''
+        observe()
+        Called with every new snapshot.  The browser follows the aircraft
+        itself, so there is nothing to do.
+        '''
+        pass
+
+    def page_memory_mb(self, browser):
+        '''
+        page_memory_mb()
+        The JS heap of the page in MB, or None if the page doesn't answer,
+        when the browser crashed for instance.
+        '''
+        try:
+            return browser.execute_script(PAGE_MEMORY_JS) / 1e6
+        except Exception:
+            return None
+
+    def release(self, browser):
+        '''
+        release()
+        Puts a page back in the pool, or a fresh one in its place if it
+        uses too much memory or doesn't answer.  If no fresh page can be
+        loaded the old one goes back, to be tried again at the next check,
+        so the pool never shrinks.
+        '''
+        memory = self.page_memory_mb(browser)
+        if memory is not None and memory <= self.settings.browser_max_memory_mb:
+            self.pages.put(browser)
+            return
+        if memory is None:
+            print("page doesn't answer, reloading the browser")
+        else:
+            print("page is using {:.0f}MB, reloading the browser".format(memory))
+        try:
+            fresh = self.loadmap()
+        except Exception as e:
+            util.error("Could not reload the browser: %s", e)
+            self.pages.put(browser)
+            return
+        self.pages.put(fresh)
+        self.reloads += 1
+        BROWSER_RELOADS.inc()
+        try:
+            browser.quit()
+        except Exception as e:
+            util.error("Could not quit browser: %s", e)
+
+    def recycle(self):
+        '''
+        recycle()
+        Checks the idle pages one at a time, replacing the bloated or dead
+        ones.  The pages in use are checked when they are released.
+        '''
+        for i in range(self.pages.qsize()):
+            try:
+                browser = self.pages.get_nowait()
+            except queue.Empty:
+                return
+            self.release(browser)
+
+    def recycler(self):
+        # runs on its own thread, starting a browser can take a while
+        while not self.stopped.wait(self.settings.browser_recycle_interval):
+            try:
+                self.recycle()
+            except Exception:
+                print("exception in AircraftDisplay.recycle():")
+                traceback.print_exc()
 
-    def screenshot(self, name):
+    def close(self):
+        '''
+        close()
+        Stops checking the pages and quits the idle browsers.
+        '''
+        self.stopped.set()
+        while True:
+            try:
+                browser = self.pages.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                browser.quit()
+            except Exception as e:
+                util.error("Could not quit browser: %s", e)
+
+    def waitForMap(self, browser):
+        '''
+        waitForMap()
+        Waits until the map tiles are drawn.
+        '''
+        WebDriverWait(browser, self.settings.select_timeout).until(
+            lambda b: b.execute_script(IMAGES_LOADED_JS))
+
+    def screenshot(self, browser):
         '''
         screenshot()
-        Takes a screenshot of the browser
+        Takes a screenshot of the browser, returns it as PNG bytes
         '''
-        if do_crop:
+        im = browser.get_screenshot_as_png()
+        if self.crop is not None:
             print('cropping screenshot')
-            #  Grab screenshot rather than saving
-            im = self.browser.get_screenshot_as_png()
-            im = Image.open(BytesIO(im))
-
             #  Crop to specifications
-            im = im.crop((crop_x, crop_y, crop_width, crop_height))
-            im.save(name)
-        else:
-            self.browser.save_screenshot(name)
-        print("success saving screenshot: %s" % name)
-        return name
+            image = Image.open(BytesIO(im))
+            image = image.crop(self.crop)
+            out = BytesIO()
+            image.save(out, format='PNG')
+            im = out.getvalue()
+        print("success taking screenshot ({} bytes)".format(len(im)))
+        return im
 
-    def ClickOnAirplane(self, ident):
-        raise NotImplementedError
+    def clickOnAirplane(self, text):
+        '''
+        clickOnAirplane()
+        Selects the airplane with the name text on one of the pages, and
+        returns a screenshot of it as PNG bytes, or None.
+        '''
+        with SCREENSHOT_SECONDS.time(), self.page() as browser:
+            try:
+                if not self.selectAirplane(browser, text):
+                    print("couldn't find the object")
+                    SCREENSHOT_FAILURES.inc()
+                    return None
+                self.waitForMap(browser)
+                return self.screenshot(browser)
+            except Exception as e:
+                util.error("Could not click on airplane: {}".format(e))
+                SCREENSHOT_FAILURES.inc()
+                return None
 
 
 class Dump1090Display(AircraftDisplay):
@@ -90,17 +268,15 @@ class Dump1090Display(AircraftDisplay):
         Creates a browser object and loads the webpage.
         It sets up the map to the proper zoom level.
 
-        Returns the browser on success, None on fail.
+        Returns the browser.
         '''
-        browser = webdriver.PhantomJS(desired_capabilities={'phantomjs.page.settings.resourceTimeout': '20000'})
-        browser.set_window_size(abovetustin_image_width, abovetustin_image_height)
+        browser = self.newbrowser()
 
         print("getting web page {}".format(self.url))
-        browser.set_page_load_timeout(15)
         browser.get(self.url)
 
         # Need to wait for the page to load
-        timeout = g_request_timeout
+        timeout = self.settings.request_timeout
         print ("waiting for page to load...")
         wait = WebDriverWait(browser, timeout)
         try:
@@ -131,26 +307,28 @@ class Dump1090Display(AircraftDisplay):
         zoomin.click()
         zoomin.click()
         zoomin.click()
-        self.browser = browser
+        return browser
 
-    def clickOnAirplane(self, text):
-        '''
-        clickOnAirplane()
-        Clicks on the airplane with the name text, and then takes a screenshot
-        '''
-        try:
-            element = self.browser.find_elements_by_xpath("//td[text()='%s']" % text.lower())
+    def selectAirplane(self, browser, text):
+        # Newer dump1090 pages can select a plane directly, otherwise
+        # click on its row in the table.
+        selected = browser.execute_script(
+            "if (typeof selectPlaneByHex === 'function' && Planes[arguments[0]]) {"
+            "  selectPlaneByHex(arguments[0], false); return true; }"
+            "return false;", text.lower())
+        if not selected:
+            element = browser.find_elements_by_xpath("//td[text()='%s']" % text.lower())
             print("number of elements found: %i" % len(element))
-            if len(element) > 0:
-                print("clicking on {}!".format(text))
-                element[0].click()
-                time.sleep(0.5) # if we don't wait a little bit the airplane icon isn't drawn.
-                return self.screenshot('tweet.png')
-            else:
-                print("couldn't find the object")
-        except Exception as e:
-            util.error("Could not click on airplane: {}".format(e))
-            return None
+            if len(element) == 0:
+                return False
+            print("clicking on {}!".format(text))
+            element[0].click()
+        # wait for the plane to show up as selected, then for the map to
+        # draw its icon.
+        WebDriverWait(browser, self.settings.select_timeout).until(
+            lambda b: text.lower() in b.find_element_by_id('selected_icao').text.lower())
+        browser.execute_script("if (window.OLMap) { OLMap.renderSync(); }")
+        return True
 
 
 class VRSDisplay(AircraftDisplay):
@@ -160,35 +338,26 @@ class VRSDisplay(AircraftDisplay):
         Creates a browser object and loads the webpage.
         It sets up the map to the proper zoom level.
 
-        Returns the browser on success, None on fail.
+        Returns the browser.
         '''
-        browser = webdriver.PhantomJS(desired_capabilities={'phantomjs.page.settings.resourceTimeout': '20000'})
-        browser.set_window_size(abovetustin_image_width, abovetustin_image_height)
+        browser = self.newbrowser()
 
         print("getting web page {}".format(self.url))
-        browser.set_page_load_timeout(15)
         browser.get(self.url)
 
         # Need to wait for the page to load
-        timeout = g_request_timeout
+        timeout = self.settings.request_timeout
         print ("waiting for page to load...")
         wait = WebDriverWait(browser, timeout)
         element = wait.until(EC.element_to_be_clickable((By.CLASS_NAME,'vrsMenu')))
-        self.browser = browser
+        return browser
 
-    def clickOnAirplane(self, text):
-        '''
-        clickOnAirplane()
-        Clicks on the airplane with the name text, and then takes a screenshot
-        '''
-        try:
-            aircraft = self.browser.find_element_by_xpath("//td[text()='%s']" % text)
-            aircraft.click()
-            time.sleep(0.5) # if we don't wait a little bit the airplane icon isn't drawn.
-            show_on_map = self.browser.find_element_by_link_text('Show on map')
-            show_on_map.click()
-            time.sleep(3.0)
-            return self.screenshot('tweet.png')
-        except Exception as e:
-            util.error("Unable to click on airplane: {}'".format(e))
-            return None
+    def selectAirplane(self, browser, text):
+        aircraft = browser.find_elements_by_xpath("//td[text()='%s']" % text)
+        if len(aircraft) == 0:
+            return False
+        aircraft[0].click()
+        wait = WebDriverWait(browser, self.settings.select_timeout)
+        show_on_map = wait.until(EC.element_to_be_clickable((By.LINK_TEXT, 'Show on map')))
+        show_on_map.click()
+        return True
@@ -0,0 +1,296 @@
+#
+# sightings.py
+#
+# A history of the aircraft that were tweeted, and optionally of every
+# aircraft seen, kept in a local SQLite database.  Rows are queued and
+# written by a background thread in batches, one transaction per flush,
+# so the polling loop never waits on the disk.
+#
+# Usage:
+#     python sightings.py <database> summary [--days 7]
+#     python sightings.py <database> hourly [--days 7] [--zone name]
+#     python sightings.py <database> daily [--days 30] [--zone name]
+#     python sightings.py <database> top [--days 30] [--limit 20]
+#     python sightings.py <database> recent [--limit 20]
+#     python sightings.py <database> aircraft <hex> [--limit 20]
+#
+
+import argparse
+import queue
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sightings (
+    time REAL NOT NULL,
+    hex TEXT NOT NULL,
+    flight TEXT,
+    squawk TEXT,
+    zone TEXT,
+    distance REAL,
+    az REAL,
+    el REAL,
+    altitude INTEGER,
+    speed REAL,
+    track REAL,
+    vert_rate INTEGER,
+    rssi REAL,
+    lat REAL,
+    lon REAL
+);
+CREATE INDEX IF NOT EXISTS sightings_time ON sightings (time);
+CREATE INDEX IF NOT EXISTS sightings_hex ON sightings (hex, time);
+
+CREATE TABLE IF NOT EXISTS positions (
+    time REAL NOT NULL,
+    hex TEXT NOT NULL,
+    flight TEXT,
+    lat REAL,
+    lon REAL,
+    altitude INTEGER,
+    distance REAL
+);
+CREATE INDEX IF NOT EXISTS positions_time ON positions (time);
+CREATE INDEX IF NOT EXISTS positions_hex ON positions (hex, time);
+'''
+
+INSERT_SIGHTING = 'INSERT INTO sightings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+INSERT_POSITION = 'INSERT INTO positions VALUES (?, ?, ?, ?, ?, ?, ?)'
+
+
+def connect(filename):
+    '''
+    connect()
+    Opens the database in WAL mode, so queries don't block the writer, and
+    creates the tables if they don't exist yet.
+    '''
+    conn = sqlite3.connect(filename)
+    conn.execute('PRAGMA journal_mode=WAL')
+    # a crash may lose the last flush but never corrupts the database
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _timestamp(when):
+    return when.timestamp() if hasattr(when, 'timestamp') else when
+
+
+def _strip(text):
+    return text.strip() if text else text
+
+
+class SightingStore(object):
+    '''
+    A write-behind writer to the sightings database.  record() and
+    record_snapshot() only queue rows; a thread writes whatever is queued
+    every flush_interval seconds, or as soon as batch_size rows are
+    waiting.  At most queue_size records (a sighting, or the rows of a
+    snapshot) wait, newer ones are dropped beyond that rather than
+    blocking the caller.  Aircraft without a hex can't be told apart and
+    aren't recorded.
+    '''
+    def __init__(self, filename, flush_interval=5.0, batch_size=1000, queue_size=10000):
+        self.filename = filename
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.written = 0    # rows committed to the database
+        self.dropped = 0    # rows dropped because the queue was full
+        self.flushes = 0
+        self.closing = threading.Event()
+        # open it here so a bad path fails at startup, not in the thread
+        connect(filename).close()
+        self.thread = threading.Thread(target=self.run, name='sightings', daemon=True)
+        self.thread.start()
+
+    def put(self, statement, rows):
+        try:
+            self.queue.put_nowait((statement, rows))
+        except queue.Full:
+            self.dropped += len(rows)
+
+    def record(self, a, zone=None):
+        '''
+        record()
+        Queues a finished alarm: aircraft a at its closest approach to the
+        alarm zone.
+        '''
+        if not a.hex:
+            return
+        self.put(INSERT_SIGHTING, [(
+            _timestamp(a.time), a.hex.lower(), _strip(a.flight), a.squawk,
+            zone.name if zone is not None else None,
+            a.distance, a.az, a.el, a.altitude, a.speed, a.track,
+            a.vert_rate, a.rssi, a.lat, a.lon)])
+
+    def record_snapshot(self, snapshot):
+        '''
+        record_snapshot()
+        Queues the position of every aircraft in the snapshot that has one.
+        '''
+        when = _timestamp(snapshot.time)
+        rows = [(when, snapshot.hex[i].lower(), _strip(snapshot.flight[i]), lat,
+                 snapshot.lon[i], snapshot.altitude[i], snapshot.distance[i])
+                for i, lat in enumerate(snapshot.lat) if lat is not None and snapshot.hex[i]]
+        if rows:
+            self.put(INSERT_POSITION, rows)
+
+    def run(self):
+        conn = connect(self.filename)
+        while True:
+            batch, count = self.next_batch()
+            if batch:
+                self.flush(conn, batch, count)
+            if self.closing.is_set() and self.queue.empty():
+                break
+        conn.close()
+
+    def next_batch(self):
+        # what is queued within flush_interval, up to batch_size rows; once
+        # closing, only what is already queued
+        batch = []
+        count = 0
+        deadline = time.monotonic() + self.flush_interval
+        while count < self.batch_size:
+            timeout = 0 if self.closing.is_set() else max(deadline - time.monotonic(), 0)
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                # close() waking the writer up
+                continue
+            batch.append(item)
+            count += len(item[1])
+        return batch, count
+
+    def flush(self, conn, batch, count):
+        # one transaction for the whole batch
+        try:
+            with conn:
+                for statement, rows in batch:
+                    conn.executemany(statement, rows)
+            self.written += count
+            self.flushes += 1
+        except sqlite3.Error:
+            print("could not write {} rows to {}:".format(count, self.filename))
+            traceback.print_exc()
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def close(self, timeout=30.0):
+        '''
+        close()
+        Writes what is queued and ends the writer thread, waiting at most
+        timeout seconds for it, in case the database is locked.
+        '''
+        if self.thread is None:
+            return
+        self.closing.set()
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            # the writer has plenty to do, it isn't waiting for rows
+            pass
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            print("gave up writing {} records to {}".format(self.pending(), self.filename))
+        self.thread = None
+
+
+def _since(days):
+    return time.time() - days * 86400
+
+
+def _zone_filter(zone):
+    return (' AND zone = ?', (zone,)) if zone else ('', ())
+
+
+def summary(conn, days=7):
+    return conn.execute(
+        'SELECT COUNT(*), COUNT(DISTINCT hex), MIN(distance), AVG(distance), MIN(altitude)'
+        ' FROM sightings WHERE time >= ?', (_since(days),)).fetchone()
+
+
+def hourly(conn, days=7, zone=None):
+    '''
+    hourly()
+    The number of sightings in each hour of the day, local time.
+    '''
+    where, args = _zone_filter(zone)
+    return conn.execute(
+        "SELECT CAST(strftime('%H', time, 'unixepoch', 'localtime') AS INTEGER) AS hour, COUNT(*)"
+        ' FROM sightings WHERE time >= ?' + where + ' GROUP BY hour ORDER BY hour',
+        (_since(days),) + args).fetchall()
+
+
+def daily(conn, days=30, zone=None):
+    where, args = _zone_filter(zone)
+    return conn.execute(
+        "SELECT date(time, 'unixepoch', 'localtime') AS day, COUNT(*), COUNT(DISTINCT hex)"
+        ' FROM sightings WHERE time >= ?' + where + ' GROUP BY day ORDER BY day',
+        (_since(days),) + args).fetchall()
+
+
+def top(conn, days=30, limit=10):
+    '''
+    top()
+    The flights seen most often.
+    '''
+    return conn.execute(
+        "SELECT COALESCE(NULLIF(flight, ''), hex) AS ident, COUNT(*) AS n, MIN(distance)"
+        ' FROM sightings WHERE time >= ? GROUP BY ident ORDER BY n DESC LIMIT ?',
+        (_since(days), limit)).fetchall()
+
+
+def recent(conn, limit=20):
+    return conn.execute(
+        "SELECT datetime(time, 'unixepoch', 'localtime'), hex, flight, zone, distance, altitude"
+        ' FROM sightings ORDER BY time DESC LIMIT ?', (limit,)).fetchall()
+
+
+def aircraft(conn, dhex, limit=20):
+    return conn.execute(
+        "SELECT datetime(time, 'unixepoch', 'localtime'), hex, flight, zone, distance, altitude"
+        ' FROM sightings WHERE hex = ? ORDER BY time DESC LIMIT ?', (dhex.lower(), limit)).fetchall()
+
+
+def print_rows(header, rows):
+    print(' | '.join(header))
+    for row in rows:
+        print(' | '.join('%.1f' % v if isinstance(v, float) else str(v) for v in row))
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description='Queries the sighting history.')
+    argparser.add_argument('database')
+    argparser.add_argument('query', choices=('summary', 'hourly', 'daily', 'top', 'recent', 'aircraft'))
+    argparser.add_argument('hex', nargs='?')
+    argparser.add_argument('--days', type=float)
+    argparser.add_argument('--zone')
+    argparser.add_argument('--limit', type=int, default=20)
+    args = argparser.parse_args()
+
+    conn = connect(args.database)
+    started = time.perf_counter()
+    if args.query == 'summary':
+        print_rows(('sightings', 'aircraft', 'closest mi', 'average mi', 'lowest ft'),
+                   [summary(conn, args.days or 7)])
+    elif args.query == 'hourly':
+        print_rows(('hour', 'sightings'), hourly(conn, args.days or 7, args.zone))
+    elif args.query == 'daily':
+        print_rows(('day', 'sightings', 'aircraft'), daily(conn, args.days or 30, args.zone))
+    elif args.query == 'top':
+        print_rows(('flight', 'sightings', 'closest mi'), top(conn, args.days or 30, args.limit))
+    elif args.query == 'recent':
+        print_rows(('time', 'hex', 'flight', 'zone', 'mi', 'ft'), recent(conn, args.limit))
+    else:
+        if not args.hex:
+            argparser.error('aircraft needs the hex of the aircraft')
+        print_rows(('time', 'hex', 'flight', 'zone', 'mi', 'ft'), aircraft(conn, args.hex, args.limit))
+    print("({:.1f}ms)".format((time.perf_counter() - started) * 1000), file=sys.stderr)
@@ -0,0 +1,471 @@
+#
+# sinks.py
+#
+# Where the notifications of finished alarms go: Twitter, Mastodon, a
+# webhook, an MQTT broker or local files.  Each sink is driven by its own
+# thread with its own bounded queue, rate limit and batching, so a slow
+# or failing sink never holds up the others or the tracker.
+#
+# The sinks are configured in [sink:<name>] sections:
+#
+#     [sink:home]
+#     type = webhook
+#     url = http://127.0.0.1:8080/overhead
+#     rate = 30
+#     batch_size = 10
+#     batch_wait = 5
+#
+# Without any, the [twitter] section is used as a single Twitter sink.
+#
+
+import base64
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+import metrics
+import util
+
+SINK_SECONDS = metrics.histogram('abovetustin_sink_seconds', 'Seconds to send a batch of notifications', ('sink',))
+SINK_SENT = metrics.counter('abovetustin_sink_sent_total', 'Notifications sent', ('sink',))
+SINK_FAILURES = metrics.counter('abovetustin_sink_failures_total', 'Notifications that could not be sent', ('sink',))
+SINK_DROPPED = metrics.counter('abovetustin_sink_dropped_total', 'Notifications dropped because a sink fell behind', ('sink',))
+
+
+class Error(Exception):
+    pass
+
+
+class Notification(object):
+    '''
+    A finished alarm to send: the rendered text, the image as PNG bytes (or
+    None), and the details of the aircraft for the sinks that send data
+    rather than text.  on_done() is called once every sink has sent it,
+    failed to or dropped it.
+    '''
+    __slots__ = ('text', 'image', 'fields', 'on_done', 'remaining', 'lock')
+
+    def __init__(self, text, image=None, fields=None, on_done=None):
+        self.text = text
+        self.image = image
+        self.fields = fields or dict()
+        self.on_done = on_done
+        self.remaining = 0
+        self.lock = threading.Lock()
+
+    def finished(self):
+        '''
+        finished()
+        Called by each sink when it is done with the notification.
+        '''
+        with self.lock:
+            self.remaining -= 1
+            if self.remaining > 0:
+                return
+        if self.on_done is not None:
+            self.on_done()
+
+    def __str__(self):
+        return self.text
+
+    def to_dict(self, include_image=False):
+        d = dict(self.fields)
+        d['text'] = self.text
+        if include_image and self.image:
+            d['image'] = base64.b64encode(self.image).decode('ascii')
+        return d
+
+
+def aircraft_fields(a, faInfo=False, zone=None):
+    '''
+    aircraft_fields()
+    The details of aircraft a at its closest approach, as plain values.
+    '''
+    fields = OrderedDict()
+    fields['time'] = a.time.isoformat() if hasattr(a.time, 'isoformat') else a.time
+    fields['hex'] = a.hex
+    fields['flight'] = a.flight.strip() if a.flight else None
+    fields['squawk'] = a.squawk
+    fields['zone'] = zone.name if zone is not None else ''
+    for name in ('lat', 'lon', 'altitude', 'speed', 'track', 'vert_rate', 'distance', 'az', 'el', 'rssi'):
+        fields[name] = getattr(a, name)
+    if faInfo:
+        for name in ('orig_name', 'orig_city', 'orig_code', 'orig_alt',
+                     'dest_name', 'dest_city', 'dest_code', 'dest_alt'):
+            fields[name] = faInfo.get(name)
+    return fields
+
+
+class Sink(object):
+    '''
+    The base of the sinks.  A sink sends one notification with send(), or
+    several at once with send_batch() if batching is on, which by default
+    sends them one by one.
+    '''
+    kind = None
+    batching = False    # whether send_batch() is better than one send() each
+
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return '{} sink {}'.format(self.kind, self.name)
+
+    def send(self, notification):
+        raise NotImplementedError
+
+    def send_batch(self, notifications):
+        for notification in notifications:
+            self.send(notification)
+
+    def close(self):
+        pass
+
+
+class TwitterSink(Sink):
+    '''
+    Tweets the notifications.  Images are uploaded with the media upload
+    endpoint and attached by id, update_with_media is deprecated.
+    '''
+    kind = 'twitter'
+
+    def __init__(self, name, consumer_key, consumer_secret, access_token, access_token_secret):
+        super().__init__(name)
+        # only needed when tweeting
+        from twitter import OAuth, Twitter
+        auth = OAuth(access_token, access_token_secret, consumer_key, consumer_secret)
+        self.twit = Twitter(auth=auth)
+        self.upload = Twitter(domain='upload.twitter.com', auth=auth)
+
+    def send(self, notification):
+        params = {'status': notification.text}
+        if notification.image:
+            media = self.upload.media.upload(media=notification.image)
+            params['media_ids'] = media['media_id_string']
+        self.twit.statuses.update(**params)
+
+
+class MastodonSink(Sink):
+    '''
+    Posts the notifications as statuses of a Mastodon account, given the
+    instance url and an access token with the write:statuses and
+    write:media scopes.
+    '''
+    kind = 'mastodon'
+
+    def __init__(self, name, url, access_token, visibility='public', timeout=30.0):
+        super().__init__(name)
+        import requests
+        self.url = url.rstrip('/')
+        self.visibility = visibility
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = 'Bearer ' + access_token
+
+    def send(self, notification):
+        data = {'status': notification.text, 'visibility': self.visibility}
+        if notification.image:
+            response = self.session.post(self.url + '/api/v2/media',
+                                         files={'file': ('airplane.png', notification.image, 'image/png')},
+                                         timeout=self.timeout)
+            response.raise_for_status()
+            data['media_ids[]'] = response.json()['id']
+        response = self.session.post(self.url + '/api/v1/statuses', data=data, timeout=self.timeout)
+        response.raise_for_status()
+
+
+class WebhookSink(Sink):
+    '''
+    POSTs the notifications as JSON to a url.  One at a time the body is
+    the notification; batched it is {"notifications": [...]}.  The image
+    is included base64 encoded if include_image is set.
+    '''
+    kind = 'webhook'
+    batching = True
+
+    def __init__(self, name, url, include_image=False, headers=None, timeout=10.0):
+        super().__init__(name)
+        import requests
+        self.url = url
+        self.include_image = include_image
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(headers or {})
+
+    def post(self, body):
+        response = self.session.post(self.url, json=body, timeout=self.timeout)
+        response.raise_for_status()
+
+    def send(self, notification):
+        self.post(notification.to_dict(self.include_image))
+
+    def send_batch(self, notifications):
+        if len(notifications) == 1:
+            return self.send(notifications[0])
+        self.post({'notifications': [n.to_dict(self.include_image) for n in notifications]})
+
+    def close(self):
+        self.session.close()
+
+
+class MQTTSink(Sink):
+    '''
+    Publishes each notification as JSON to an MQTT topic.  Needs the
+    paho-mqtt package.
+    '''
+    kind = 'mqtt'
+    batching = True
+
+    def __init__(self, name, host, port=1883, topic='abovetustin/alarms', username=None, password=None,
+                 qos=1, retain=False, include_image=False):
+        super().__init__(name)
+        try:
+            import paho.mqtt.client as mqtt
+        except ImportError:
+            raise Error('The mqtt sink {} needs the paho-mqtt package'.format(name))
+        self.topic = topic
+        self.qos = qos
+        self.retain = retain
+        self.include_image = include_image
+        self.client = mqtt.Client()
+        if username:
+            self.client.username_pw_set(username, password)
+        self.client.connect_async(host, port)
+        # the client reconnects by itself from its own thread
+        self.client.loop_start()
+
+    def send(self, notification):
+        self.send_batch([notification])
+
+    def send_batch(self, notifications):
+        infos = [self.client.publish(self.topic, json.dumps(n.to_dict(self.include_image)),
+                                     qos=self.qos, retain=self.retain)
+                 for n in notifications]
+        for info in infos:
+            info.wait_for_publish(timeout=30)
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+class FileSink(Sink):
+    '''
+    Appends each notification as a JSON line to <directory>/alarms.jsonl,
+    and saves its image next to it as <time>-<hex>.png.
+    '''
+    kind = 'file'
+    batching = True
+
+    def __init__(self, name, directory):
+        super().__init__(name)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.filename = os.path.join(directory, 'alarms.jsonl')
+
+    def send_batch(self, notifications):
+        lines = []
+        for n in notifications:
+            d = n.to_dict()
+            if n.image:
+                image = '{}-{}.png'.format(time.strftime('%Y%m%d-%H%M%S'), n.fields.get('hex', 'unknown'))
+                with open(os.path.join(self.directory, image), 'wb') as f:
+                    f.write(n.image)
+                d['image'] = image
+            lines.append(json.dumps(d) + '\n')
+        with open(self.filename, 'a', encoding='utf-8') as f:
+            f.writelines(lines)
+
+    def send(self, notification):
+        self.send_batch([notification])
+
+
+class SinkRunner(object):
+    '''
+    Feeds one sink from its own thread.  Up to queue_size notifications
+    wait for it, the oldest is dropped beyond that.  At most `rate`
+    batches are sent per minute (0 for no limit).  With a batch_size above
+    1 and a sink that batches, up to batch_size notifications that arrive
+    within batch_wait seconds of the first are sent together.
+    '''
+    def __init__(self, sink, rate=0, batch_size=1, batch_wait=0.0, queue_size=64):
+        self.sink = sink
+        self.limiter = util.RateLimiter(rate / 60.0) if rate else None
+        self.batch_size = batch_size if sink.batching else 1
+        self.batch_wait = batch_wait
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.seconds = SINK_SECONDS.labels(sink.name)
+        self.sent_total = SINK_SENT.labels(sink.name)
+        self.failures_total = SINK_FAILURES.labels(sink.name)
+        self.dropped_total = SINK_DROPPED.labels(sink.name)
+        self.thread = threading.Thread(target=self.run, name='sink-{}'.format(sink.name), daemon=True)
+        self.thread.start()
+
+    def submit(self, notification):
+        with self.lock:
+            try:
+                self.queue.put_nowait(notification)
+            except queue.Full:
+                try:
+                    oldest = self.queue.get_nowait()
+                    self.queue.task_done()
+                    self.dropped += 1
+                    self.dropped_total.inc()
+                    print("{}: queue full, dropping {}".format(self.sink, oldest))
+                    oldest.finished()
+                except queue.Empty:
+                    pass
+                self.queue.put_nowait(notification)
+
+    def next_batch(self):
+        first = self.queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            try:
+                item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if item is None:
+                # finish this batch, then stop
+                self.queue.task_done()
+                self.queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                self.queue.task_done()
+                return
+            try:
+                if self.limiter:
+                    self.limiter.acquire()
+                with self.seconds.time():
+                    self.sink.send_batch(batch)
+                self.sent += len(batch)
+                self.sent_total.inc(len(batch))
+            except Exception:
+                self.failed += len(batch)
+                self.failures_total.inc(len(batch))
+                print("{} could not send {} notification(s):".format(self.sink, len(batch)))
+                traceback.print_exc()
+            finally:
+                for item in batch:
+                    item.finished()
+                    self.queue.task_done()
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def stop(self):
+        '''
+        stop()
+        Sends what is queued, then ends the thread.
+        '''
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        self.sink.close()
+
+
+class Dispatcher(object):
+    '''
+    Hands every notification to each of the sinks.  submit() never blocks.
+    '''
+    def __init__(self, runners):
+        self.runners = list(runners)
+
+    def __len__(self):
+        return len(self.runners)
+
+    def __iter__(self):
+        return iter(self.runners)
+
+    def submit(self, notification):
+        if not self.runners:
+            if notification.on_done is not None:
+                notification.on_done()
+            return
+        notification.remaining = len(self.runners)
+        for runner in self.runners:
+            runner.submit(notification)
+
+    def pending(self):
+        return sum(runner.pending() for runner in self.runners)
+
+    def stop(self):
+        for runner in self.runners:
+            runner.stop()
+
+
+def make_sink(name, options):
+    '''
+    make_sink()
+    The sink of the given options, a section of the configuration.
+    '''
+    kind = options.get('type', '').strip().lower()
+    if kind == 'twitter':
+        return TwitterSink(name, options['consumer_key'], options['consumer_secret'],
+                           options['access_token'], options['access_token_secret'])
+    if kind == 'mastodon':
+        return MastodonSink(name, options['url'], options['access_token'],
+                            options.get('visibility', 'public'))
+    if kind == 'webhook':
+        headers = dict()
+        if options.get('authorization'):
+            headers['Authorization'] = options['authorization']
+        return WebhookSink(name, options['url'], options.getboolean('include_image', False), headers)
+    if kind == 'mqtt':
+        return MQTTSink(name, options['host'], options.getint('port', 1883),
+                        options.get('topic', 'abovetustin/alarms'),
+                        options.get('username') or None, options.get('password') or None,
+                        options.getint('qos', 1), options.getboolean('retain', False),
+                        options.getboolean('include_image', False))
+    if kind == 'file':
+        return FileSink(name, options.get('directory', 'alarms'))
+    raise Error('Unknown type "{}" of sink {}, the types are twitter, mastodon, webhook, mqtt and file'.format(
+        kind, name))
+
+
+def from_config(parser):
+    '''
+    from_config()
+    A Dispatcher for the sinks of the [sink:<name>] sections, or for the
+    [twitter] section if there are none.  Besides the options of its type
+    each section may set rate (batches per minute), batch_size, batch_wait
+    (seconds) and queue_size.
+    '''
+    runners = []
+    for section in parser.sections():
+        if not section.startswith('sink:'):
+            continue
+        options = parser[section]
+        if not options.getboolean('enabled', True):
+            continue
+        name = section[len('sink:'):].strip()
+        runners.append(SinkRunner(
+            make_sink(name, options),
+            rate=options.getfloat('rate', 0),
+            batch_size=options.getint('batch_size', 1),
+            batch_wait=options.getfloat('batch_wait', 0),
+            queue_size=options.getint('queue_size', 64)))
+    if not runners and parser.has_section('twitter'):
+        options = parser['twitter']
+        runners.append(SinkRunner(TwitterSink('twitter', options['consumer_key'], options['consumer_secret'],
+                                              options['access_token'], options['access_token_secret'])))
+    return Dispatcher(runners)
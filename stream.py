@@ -0,0 +1,493 @@
+#
+# stream.py
+#
+# Reads aircraft from dump1090's TCP outputs instead of polling
+# aircraft.json: SBS-1 BaseStation text (port 30003) or Beast binary
+# (port 30005).  Messages are decoded as they arrive into per-aircraft state,
+# and a snapshot of it is published every interval.
+#
+# Only the messages that carry what the tracker needs are decoded: for
+# Beast, the DF17 extended squitters with a valid CRC (identification,
+# airborne position and airborne velocity).  Positions are decoded locally
+# against the receiver location, which is reliable up to 180 nautical miles
+# from it.
+#
+# Usage, to watch a stream:
+#     python stream.py sbs|beast [host:port]
+#
+
+import math
+import socket
+import sys
+import time
+import traceback
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import config
+import flightdata
+import geomath
+import poller
+
+# Seconds without a message before an aircraft is forgotten.
+AIRCRAFT_TIMEOUT = 60.0
+
+# Seconds to wait before connecting again after the stream was lost.
+RECONNECT_DELAY = 5.0
+
+# Positions further than this from the receiver are bad local decodes.
+MAX_RANGE_MI = 180 * 1.15078
+
+
+class StreamAircraft(object):
+    '''
+    What was decoded so far about one aircraft.  speed is in knots, the
+    times are seconds since the epoch.
+    '''
+    __slots__ = ('hex', 'squawk', 'flight', 'lat', 'lon', 'altitude', 'vert_rate',
+                 'track', 'speed', 'messages', 'last_seen', 'last_pos', 'rssi')
+
+    def __init__(self, dhex):
+        self.hex = dhex
+        self.squawk = None
+        self.flight = None
+        self.lat = None
+        self.lon = None
+        self.altitude = None
+        self.vert_rate = None
+        self.track = None
+        self.speed = None
+        self.messages = 0
+        self.last_seen = 0.0
+        self.last_pos = None
+        self.rssi = None
+
+
+class StreamState(object):
+    '''
+    The aircraft heard on a stream, indexed by hex.
+    '''
+    def __init__(self):
+        self.aircraft = dict()
+        self.time = time.time()
+
+    def get(self, dhex, now):
+        a = self.aircraft.get(dhex)
+        if a is None:
+            a = self.aircraft[dhex] = StreamAircraft(dhex)
+        a.messages += 1
+        a.last_seen = now
+        return a
+
+    def expire(self, now):
+        for dhex in [h for h, a in self.aircraft.items() if now - a.last_seen > AIRCRAFT_TIMEOUT]:
+            del self.aircraft[dhex]
+
+
+class StreamDataParser(flightdata.AircraftDataParser):
+    '''
+    Turns a StreamState into a snapshot, like the other parsers do with the
+    json of the receiver.
+    '''
+    def parse_aircraft(self, state, snapshot):
+        now = state.time
+        for a in state.aircraft.values():
+            snapshot.append(
+                a.hex,
+                a.squawk,
+                a.flight,
+                None,
+                a.lat,
+                a.lon,
+                a.altitude if a.altitude is not None else 0,
+                a.vert_rate if a.vert_rate is not None else 0,
+                a.track,
+                geomath.knot2mph(a.speed) if a.speed is not None else 0,
+                a.messages,
+                now - a.last_seen,
+                None,
+                None,
+                now - a.last_pos if a.last_pos is not None else None,
+                a.rssi)
+
+    def time(self, state):
+        return state.time
+
+
+#
+# SBS-1 BaseStation
+#
+
+class SBSDecoder(object):
+    '''
+    Decodes the lines of an SBS-1 BaseStation stream:
+        MSG,type,session,aircraft,hex,flight,date,time,date,time,callsign,
+        altitude,ground speed,track,lat,lon,vertical rate,squawk,...
+    '''
+    def __init__(self):
+        self.buffer = b''
+
+    def feed(self, data, state, now):
+        '''
+        feed()
+        Decodes the complete lines in data into the state.  Returns the
+        number of positions decoded.
+        '''
+        lines = (self.buffer + data).split(b'\n')
+        self.buffer = lines.pop()
+        positions = 0
+        for line in lines:
+            try:
+                if self.decode(line.decode('ascii', 'replace').strip().split(','), state, now):
+                    positions += 1
+            except (ValueError, IndexError):
+                continue
+        return positions
+
+    def decode(self, f, state, now):
+        if len(f) < 18 or f[0] != 'MSG' or not f[4]:
+            return False
+        a = state.get(f[4].upper(), now)
+        if f[10].strip():
+            a.flight = f[10].strip()
+        if f[11]:
+            a.altitude = int(float(f[11]))
+        if f[12]:
+            a.speed = float(f[12])
+        if f[13]:
+            a.track = float(f[13])
+        if f[16]:
+            a.vert_rate = int(float(f[16]))
+        if f[17]:
+            a.squawk = f[17]
+        if f[14] and f[15]:
+            a.lat = float(f[14])
+            a.lon = float(f[15])
+            a.last_pos = now
+            return True
+        return False
+
+
+#
+# Beast binary and Mode S
+#
+
+# The message lengths of the Beast frame types: Mode A/C, Mode S short and
+# Mode S long.  Every frame also carries a 6 byte timestamp and a signal
+# level byte.
+BEAST_ESCAPE = 0x1a
+BEAST_LENGTHS = {0x31: 2, 0x32: 7, 0x33: 14}
+
+
+def _crc_table():
+    table = []
+    for i in range(256):
+        c = i << 16
+        for _ in range(8):
+            c = (c << 1) ^ 0xfff409 if c & 0x800000 else c << 1
+        table.append(c & 0xffffff)
+    return table
+
+CRC_TABLE = _crc_table()
+
+
+def crc(data):
+    '''
+    crc()
+    The Mode S CRC-24 of data.  For an extended squitter including its
+    parity the result is 0.
+    '''
+    c = 0
+    for b in data:
+        c = ((c << 8) & 0xffffff) ^ CRC_TABLE[((c >> 16) ^ b) & 0xff]
+    return c
+
+
+CALLSIGN_CHARS = '#ABCDEFGHIJKLMNOPQRSTUVWXYZ##### ###############0123456789######'
+
+CPR_NZ = 15
+CPR_SCALE = 131072.0    # 2 ** 17
+
+
+def cpr_nl(lat):
+    '''
+    cpr_nl()
+    The number of longitude zones at a latitude.
+    '''
+    lat = abs(lat)
+    if lat < 1e-9:
+        return 59
+    if lat > 87:
+        return 1
+    if lat == 87:
+        return 2
+    a = 1 - math.cos(math.pi / (2 * CPR_NZ))
+    b = math.cos(math.radians(lat)) ** 2
+    return int(math.floor(2 * math.pi / math.acos(1 - a / b)))
+
+
+def cpr_local(lat_cpr, lon_cpr, odd, lat_ref, lon_ref):
+    '''
+    cpr_local()
+    Decodes one CPR position relative to a reference position within 180
+    nautical miles of it.
+    '''
+    lat_cpr /= CPR_SCALE
+    lon_cpr /= CPR_SCALE
+    dlat = 360.0 / (4 * CPR_NZ - odd)
+    j = math.floor(lat_ref / dlat) + math.floor(0.5 + (lat_ref % dlat) / dlat - lat_cpr)
+    lat = dlat * (j + lat_cpr)
+    dlon = 360.0 / max(cpr_nl(lat) - odd, 1)
+    m = math.floor(lon_ref / dlon) + math.floor(0.5 + (lon_ref % dlon) / dlon - lon_cpr)
+    lon = dlon * (m + lon_cpr)
+    return lat, lon
+
+
+def _bits(value, start, length, width=56):
+    # `length` bits of value starting at bit `start`, counting from 1 at the
+    # most significant of `width` bits, the way the Mode S documents do.
+    return (value >> (width - start - length + 1)) & ((1 << length) - 1)
+
+
+class BeastDecoder(object):
+    '''
+    Decodes a Beast binary stream: frames start with 0x1a and a type byte,
+    and 0x1a bytes inside a frame are doubled.
+    '''
+    def __init__(self, latitude, longitude):
+        self.buffer = b''
+        self.latitude = latitude
+        self.longitude = longitude
+        self.bad_crc = 0
+
+    def frames(self, data):
+        '''
+        frames()
+        Splits data into (signal, message) frames.  An incomplete frame at
+        the end is kept for the next call.
+        '''
+        buf = self.buffer + data
+        self.buffer = b''
+        n = len(buf)
+        i = 0
+        while True:
+            start = buf.find(b'\x1a', i)
+            if start < 0:
+                return
+            if start + 1 >= n:
+                self.buffer = buf[start:]
+                return
+            length = BEAST_LENGTHS.get(buf[start + 1])
+            if length is None:
+                i = start + 1
+                continue
+            frame = bytearray()
+            j = start + 2
+            while len(frame) < 7 + length and j < n:
+                c = buf[j]
+                if c == BEAST_ESCAPE:
+                    if j + 1 >= n:
+                        break
+                    if buf[j + 1] != BEAST_ESCAPE:
+                        # a new frame started early, this one is corrupt
+                        break
+                    j += 1
+                frame.append(c)
+                j += 1
+            if len(frame) == 7 + length:
+                yield frame[6], bytes(frame[7:])
+                i = j
+            elif j >= n - 1:
+                self.buffer = buf[start:]
+                return
+            else:
+                i = j
+
+    def feed(self, data, state, now):
+        '''
+        feed()
+        Decodes the complete frames in data into the state.  Returns the
+        number of positions decoded.
+        '''
+        positions = 0
+        for signal, msg in self.frames(data):
+            if len(msg) == 14 and self.decode(msg, signal, state, now):
+                positions += 1
+        return positions
+
+    def decode(self, msg, signal, state, now):
+        if msg[0] >> 3 != 17:
+            return False
+        if crc(msg) != 0:
+            self.bad_crc += 1
+            return False
+        a = state.get(msg[1:4].hex().upper(), now)
+        level = (signal / 255.0) ** 2
+        a.rssi = 10 * math.log10(level + 1e-5)
+        me = int.from_bytes(msg[4:11], 'big')
+        tc = me >> 51
+        if 1 <= tc <= 4:
+            a.flight = ''.join(CALLSIGN_CHARS[_bits(me, 9 + 6 * k, 6)] for k in range(8)).strip('# ')
+        elif 9 <= tc <= 18 or 20 <= tc <= 22:
+            return self.decode_position(a, me, tc, now)
+        elif tc == 19:
+            self.decode_velocity(a, me)
+        return False
+
+    def decode_position(self, a, me, tc, now):
+        alt = _bits(me, 9, 12)
+        if tc >= 20:
+            # GNSS height, in meters
+            a.altitude = int(round(alt * 3.28084))
+        elif alt & 0x10:
+            # 25ft steps, with the Q bit taken out
+            a.altitude = ((alt >> 5) << 4 | (alt & 0xf)) * 25 - 1000
+        odd = _bits(me, 22, 1)
+        lat, lon = cpr_local(_bits(me, 23, 17), _bits(me, 40, 17), odd, self.latitude, self.longitude)
+        if geomath.distance((self.latitude, self.longitude), (lat, lon)) > MAX_RANGE_MI:
+            return False
+        a.lat = lat
+        a.lon = lon
+        a.last_pos = now
+        return True
+
+    def decode_velocity(self, a, me):
+        subtype = _bits(me, 6, 3)
+        if subtype in (1, 2):
+            v_ew = _bits(me, 15, 10)
+            v_ns = _bits(me, 26, 10)
+            if v_ew and v_ns:
+                scale = 4 if subtype == 2 else 1
+                v_ew = (v_ew - 1) * scale * (-1 if _bits(me, 14, 1) else 1)
+                v_ns = (v_ns - 1) * scale * (-1 if _bits(me, 25, 1) else 1)
+                a.speed = math.hypot(v_ew, v_ns)
+                a.track = math.degrees(math.atan2(v_ew, v_ns)) % 360
+        vr = _bits(me, 38, 9)
+        if vr:
+            a.vert_rate = (vr - 1) * 64 * (-1 if _bits(me, 37, 1) else 1)
+
+
+#
+# The data source
+#
+
+class StreamSource(poller.AsyncPoller):
+    '''
+    A drop-in replacement for the AsyncPoller that holds a TCP connection
+    to the receiver and decodes its stream as it arrives.  A snapshot is
+    published every `interval` seconds, also when nothing was heard, so
+    silent aircraft expire and the alarms keep counting down.  The
+    connection is retried when it's lost.
+    '''
+    decoder_class = None
+    default_port = None
+
+    def __init__(self, flightdata, url, interval):
+        super().__init__(flightdata, interval)
+        parts = urlsplit(url if '://' in url else 'tcp://' + url)
+        self.host = parts.hostname or 'localhost'
+        self.port = parts.port or self.default_port
+        self.state = StreamState()
+        self.decoder = self.make_decoder()
+        self.positions = 0      # positions decoded
+        self.last_publish = 0.0
+        self.reconnects = 0     # times the connection was lost
+
+    def make_decoder(self):
+        return self.decoder_class()
+
+    def set_interval(self, interval):
+        self.interval = interval
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                with socket.create_connection((self.host, self.port), timeout=RECONNECT_DELAY) as sock:
+                    print("streaming aircraft from {}:{}".format(self.host, self.port))
+                    self.read(sock)
+            except OSError as e:
+                print("lost the stream from {}:{}: {}".format(self.host, self.port, e))
+            except Exception:
+                print("exception in StreamSource.run():")
+                traceback.print_exc()
+            self.reconnects += 1
+            self.decoder.buffer = b''
+            self.wait(RECONNECT_DELAY)
+
+    def wait(self, seconds):
+        # keeps publishing while disconnected
+        deadline = time.time() + seconds
+        while not self.stopped.is_set():
+            now = time.time()
+            self.tick(now)
+            if now >= deadline:
+                return
+            self.stopped.wait(min(deadline - now, max(self.interval, 0.1)))
+
+    def read(self, sock):
+        sock.settimeout(0.1)
+        while not self.stopped.is_set():
+            try:
+                data = sock.recv(65536)
+                if not data:
+                    raise ConnectionError('connection closed')
+            except socket.timeout:
+                data = None
+            now = time.time()
+            if data:
+                self.positions += self.decoder.feed(data, self.state, now)
+            self.tick(now)
+
+    def tick(self, now):
+        if now - self.last_publish >= self.interval:
+            self.snapshot(now)
+            self.last_publish = now
+
+    def snapshot(self, now):
+        self.polls += 1
+        state = self.state
+        state.time = now
+        state.expire(now)
+        fd = self.flightdata
+        fd.time = datetime.fromtimestamp(now)
+        fd.aircraft = fd.parser.aircraft_data(state, fd.time, fd.receiver, fd.aircraft, fd.zone)
+        fd.delta = fd.aircraft.delta
+        self.publish(fd.aircraft)
+
+
+class SBSSource(StreamSource):
+    decoder_class = SBSDecoder
+    default_port = 30003
+
+
+class BeastSource(StreamSource):
+    decoder_class = BeastDecoder
+    default_port = 30005
+
+    def make_decoder(self):
+        # positions are decoded relative to the receiver
+        return BeastDecoder(*self.flightdata.receiver)
+
+
+SOURCES = {
+    'sbs': SBSSource,
+    'beast': BeastSource,
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in SOURCES:
+        print("usage: stream.py sbs|beast [host:port]")
+        sys.exit(1)
+    source_class = SOURCES[sys.argv[1]]
+    url = sys.argv[2] if len(sys.argv) > 2 else 'localhost'
+    fd = flightdata.FlightData(config.settings().receiver, parser=StreamDataParser())
+    source = source_class(fd, url, 1.0).start()
+    while True:
+        snapshot = source.get(timeout=1.0)
+        if snapshot is None:
+            continue
+        print("{}: {} aircraft, {}".format(snapshot.time, len(snapshot), snapshot.delta))
+        for a in snapshot:
+            if a.hex in snapshot.delta.moved:
+                print("    {}".format(a))
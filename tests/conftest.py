@@ -0,0 +1,10 @@
+#
+# conftest.py
+#
+# The modules live at the top of the repository, next to config.ini.
+#
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,165 @@
+#
+# test_alarms.py
+#
+# The alarm state machine, fed small snapshots and checked for the alarms
+# that fire and the state of the others after each update.
+#
+
+from datetime import datetime, timedelta
+
+import alarms
+import flightdata
+import zones
+
+RECEIVER = (33.7, -117.8)
+START = datetime(2026, 10, 18, 12, 0)
+
+# 1 mi around the receiver, or above 50 degrees.
+ZONE = zones.AlarmZone(RECEIVER[0], RECEIVER[1], 1, 50)
+
+INSIDE = (33.705, -117.8, 3000)       # 0.35 mi north
+CLOSER = (33.702, -117.8, 3000)       # 0.14 mi north
+OUTSIDE = (33.75, -117.8, 3000)       # 3.5 mi north
+FAR = (34.2, -117.8, 3000)
+
+
+class Feed(object):
+    '''
+    Makes consecutive snapshots of the aircraft given as {hex: (lat, lon,
+    altitude)}, each diffed against the one before.
+    '''
+    def __init__(self):
+        self.previous = None
+        self.seconds = 0
+
+    def __call__(self, positions, track=180.0):
+        s = flightdata.AircraftSnapshot(START + timedelta(seconds=self.seconds))
+        for dhex, (lat, lon, alt) in positions.items():
+            s.append(dhex, '1200', 'SWA' + dhex[-3:], None, lat, lon, alt, 0, track, 300.0,
+                     100, 0.1, False, 7, 0.0, -10.0)
+        s.diff(self.previous)
+        self.previous = s.locate(RECEIVER, self.previous)
+        self.seconds += 1
+        return self.previous
+
+
+def states(tracker):
+    return {dhex: (alarm.state, alarm.countdown) for dhex, alarm in tracker.alarms.items()}
+
+
+def test_an_alarm_goes_through_every_state():
+    feed = Feed()
+    tracker = alarms.AlarmTracker(ZONE, wait_x_updates=2)
+    assert tracker.update(feed({'A00001': OUTSIDE})) == []
+    assert len(tracker) == 0
+
+    assert tracker.update(feed({'A00001': INSIDE})) == []
+    assert states(tracker) == {'A00001': (alarms.ENTERING, 0)}
+
+    # an aircraft that didn't move stays inside
+    assert tracker.update(feed({'A00001': INSIDE})) == []
+    assert states(tracker) == {'A00001': (alarms.INSIDE, 0)}
+    assert 'A00001' in tracker.inside
+
+    assert tracker.update(feed({'A00001': CLOSER})) == []
+    assert states(tracker) == {'A00001': (alarms.INSIDE, 0)}
+
+    assert tracker.update(feed({'A00001': OUTSIDE})) == []
+    assert states(tracker) == {'A00001': (alarms.EXITING, 1)}
+    assert tracker.update(feed({'A00001': FAR})) == []
+    assert states(tracker) == {'A00001': (alarms.EXITING, 2)}
+
+    # gone from the snapshot altogether
+    fired = tracker.update(feed({}))
+    assert [alarm.hex for alarm in fired] == ['A00001']
+    assert fired[0].state == alarms.FIRED
+    assert fired[0].closest.lat == CLOSER[0]
+    assert fired[0].closest.distance < 0.2
+    assert len(tracker) == 0
+    assert tracker.update(feed({})) == []
+
+
+def test_reentry_resets_the_countdown():
+    feed = Feed()
+    tracker = alarms.AlarmTracker(ZONE, wait_x_updates=2)
+    tracker.update(feed({'A00001': INSIDE}))
+    tracker.update(feed({'A00001': OUTSIDE}))
+    tracker.update(feed({'A00001': FAR}))
+    assert states(tracker) == {'A00001': (alarms.EXITING, 2)}
+    tracker.update(feed({'A00001': CLOSER}))
+    assert states(tracker) == {'A00001': (alarms.INSIDE, 0)}
+    tracker.update(feed({'A00001': OUTSIDE}))
+    assert states(tracker) == {'A00001': (alarms.EXITING, 1)}
+
+
+def test_aircraft_without_a_track_are_skipped():
+    feed = Feed()
+    tracker = alarms.AlarmTracker(ZONE, wait_x_updates=2)
+    assert tracker.update(feed({'A00001': INSIDE}, track=None)) == []
+    assert len(tracker) == 0
+
+
+def test_changes_only_move_with_the_alarms():
+    feed = Feed()
+    tracker = alarms.AlarmTracker(ZONE, wait_x_updates=2)
+    tracker.update(feed({'A00001': OUTSIDE}))
+    assert tracker.changes == 0
+    tracker.update(feed({'A00001': INSIDE}))
+    tracker.update(feed({'A00001': INSIDE}))
+    changes = tracker.changes
+    tracker.update(feed({'A00001': INSIDE}))
+    assert tracker.changes == changes
+
+
+def test_enrich_is_retried_until_it_answers():
+    feed = Feed()
+    answers = [None, 'details']
+    asked = []
+
+    def enrich(a):
+        asked.append(a.hex)
+        return answers.pop(0) if answers else 'again'
+
+    tracker = alarms.AlarmTracker(ZONE, wait_x_updates=0, enrich=enrich)
+    tracker.update(feed({'A00001': INSIDE}))
+    assert tracker.get('A00001').enrichment is None
+    tracker.update(feed({'A00001': CLOSER}))
+    assert tracker.get('A00001').enrichment == 'details'
+    tracker.update(feed({'A00001': INSIDE}))
+    assert asked == ['A00001', 'A00001']
+    fired = tracker.update(feed({'A00001': OUTSIDE}))
+    assert fired[0].enrichment == 'details'
+
+
+def test_restore():
+    feed = Feed()
+    tracker = alarms.AlarmTracker(ZONE, wait_x_updates=2, enrich=lambda a: a.flight)
+    closest = feed({'A00001': CLOSER})['A00001'].detach()
+    alarm = tracker.restore(closest, alarms.EXITING, 1)
+    assert alarm.enrichment == 'SWA001'
+    assert states(tracker) == {'A00001': (alarms.EXITING, 1)}
+    # it goes on where it was
+    assert tracker.update(feed({'A00001': FAR})) == []
+    assert states(tracker) == {'A00001': (alarms.EXITING, 2)}
+    assert tracker.update(feed({}))[0].closest is closest
+
+
+def test_zone_alarms_route_aircraft_to_their_zones():
+    # a second zone 10 mi north, whose geometry isn't the receiver's
+    north = zones.AlarmZone(33.845, -117.8, 1, 50, receiver=RECEIVER, name='north')
+    here = zones.AlarmZone(RECEIVER[0], RECEIVER[1], 1, 50, receiver=RECEIVER, name='here')
+    zone_alarms = alarms.ZoneAlarms(zones.ZoneIndex([here, north]), wait_x_updates=1)
+    feed = Feed()
+
+    zone_alarms.update(feed({'A00001': INSIDE, 'A00002': (33.846, -117.8, 3000), 'A00003': FAR}))
+    assert {(zone.name, a.hex) for zone, a in zone_alarms.inside()} == {
+        ('here', 'A00001'), ('north', 'A00002')}
+    assert len(zone_alarms) == 2
+    alarm = zone_alarms.trackers[north].get('A00002')
+    # relative to the zone, not the receiver
+    assert alarm.closest.distance < 0.1
+
+    zone_alarms.update(feed({'A00001': INSIDE, 'A00002': FAR, 'A00003': FAR}))
+    fired = zone_alarms.update(feed({'A00001': INSIDE, 'A00002': FAR, 'A00003': FAR}))
+    assert [(alarm.zone.name, alarm.hex) for alarm in fired] == [('north', 'A00002')]
+    assert [alarm.hex for alarm in zone_alarms.alarms()] == ['A00001']
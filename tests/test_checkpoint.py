@@ -0,0 +1,153 @@
+#
+# test_checkpoint.py
+#
+# Writes the alarms in progress and the finished ones waiting to be
+# tweeted to a checkpoint, and brings them back into new trackers.
+#
+
+import json
+import time
+from datetime import datetime, timedelta
+
+import alarms
+import checkpoint
+import flightdata
+import zones
+
+RECEIVER = (33.7, -117.8)
+START = datetime(2026, 10, 18, 12, 0)
+
+INSIDE = (33.705, -117.8, 3000)
+CLOSER = (33.702, -117.8, 3000)
+OUTSIDE = (33.75, -117.8, 3000)
+
+
+def zone_alarms(wait_x_updates=3):
+    zone = zones.AlarmZone(RECEIVER[0], RECEIVER[1], 1, 50, name='here')
+    return alarms.ZoneAlarms(zones.ZoneIndex([zone]), wait_x_updates)
+
+
+def feed(positions, previous=None, seconds=0):
+    s = flightdata.AircraftSnapshot(START + timedelta(seconds=seconds))
+    for dhex, (lat, lon, alt) in positions.items():
+        s.append(dhex, '1200', 'SWA1234', None, lat, lon, alt, -500, 180.0, 300.0,
+                 100, 0.1, False, 7, 0.0, -10.0)
+    s.diff(previous)
+    return s.locate(RECEIVER, previous)
+
+
+def mid_pass(za):
+    # A00001 passed its closest point and is counting down outside
+    s = None
+    for seconds, position in enumerate((INSIDE, CLOSER, OUTSIDE)):
+        s = feed({'A00001': position}, s, seconds)
+        za.update(s)
+    return s
+
+
+def test_mid_pass_alarm_round_trip(tmp_path):
+    filename = str(tmp_path / 'alarms.checkpoint')
+    za = zone_alarms()
+    last = mid_pass(za)
+    assert checkpoint.Checkpoint(filename).save(za)
+
+    restored = zone_alarms()
+    assert checkpoint.Checkpoint(filename).restore(restored) == []
+    alarm, = restored.alarms()
+    assert (alarm.hex, alarm.state, alarm.countdown) == ('A00001', alarms.EXITING, 1)
+    assert alarm.zone.name == 'here'
+    assert (alarm.closest.lat, alarm.closest.lon, alarm.closest.altitude) == CLOSER
+    assert alarm.closest.time == START + timedelta(seconds=1)
+    assert alarm.closest.vert_rate == -500
+
+    # and it fires after the updates it had left
+    s = last
+    for seconds in (3, 4):
+        s = feed({'A00001': OUTSIDE}, s, seconds)
+        assert restored.update(s) == []
+    fired = restored.update(feed({}, s, 5))
+    assert [a.closest.lat for a in fired] == [CLOSER[0]]
+
+
+def test_fired_but_not_tweeted_comes_back(tmp_path):
+    filename = str(tmp_path / 'alarms.checkpoint')
+    za = zone_alarms(wait_x_updates=0)
+    s = feed({'A00001': CLOSER})
+    za.update(s)
+    fired = za.update(feed({'A00001': OUTSIDE}, s, 1))
+    ckpt = checkpoint.Checkpoint(filename)
+    tweeted = ckpt.fired(fired[0].closest, fired[0].zone)
+    ckpt.fired(fired[0].closest, fired[0].zone)
+    ckpt.done(tweeted)
+    assert ckpt.save(za)
+
+    restored = zone_alarms()
+    pending = checkpoint.Checkpoint(filename).restore(restored)
+    assert len(restored) == 0
+    (closest, zone), = pending
+    assert zone.name == 'here'
+    assert (closest.hex, closest.lat) == ('A00001', CLOSER[0])
+
+
+def test_writes_only_when_something_changed(tmp_path):
+    filename = str(tmp_path / 'alarms.checkpoint')
+    za = zone_alarms()
+    s = feed({'A00001': INSIDE})
+    za.update(s)
+    ckpt = checkpoint.Checkpoint(filename, min_interval=0)
+    assert ckpt.save(za)
+    assert not ckpt.save(za)
+    # ENTERING to INSIDE, then an update that changed nothing
+    s = feed({'A00001': INSIDE}, s, 1)
+    za.update(s)
+    assert ckpt.save(za)
+    za.update(feed({'A00001': INSIDE}, s, 2))
+    assert not ckpt.save(za)
+    assert ckpt.writes == 2
+
+    # finished alarms handed out and done count as changes
+    alarm, = za.alarms()
+    ckpt.done(ckpt.fired(alarm.closest, alarm.zone))
+    assert ckpt.save(za)
+    assert ckpt.writes == 3
+
+
+def test_writes_at_most_every_min_interval(tmp_path):
+    filename = str(tmp_path / 'alarms.checkpoint')
+    za = zone_alarms()
+    ckpt = checkpoint.Checkpoint(filename, min_interval=60)
+    s = feed({'A00001': INSIDE})
+    za.update(s)
+    assert ckpt.save(za)
+    za.update(feed({'A00001': CLOSER}, s, 1))
+    assert not ckpt.save(za)
+    # unless forced, at shutdown
+    assert ckpt.save(za, force=True)
+
+
+def test_stale_checkpoints_are_not_restored(tmp_path):
+    filename = str(tmp_path / 'alarms.checkpoint')
+    za = zone_alarms()
+    mid_pass(za)
+    checkpoint.Checkpoint(filename).save(za)
+    with open(filename) as f:
+        state = json.load(f)
+    state['time'] = time.time() - 700
+    with open(filename, 'w') as f:
+        json.dump(state, f)
+
+    restored = zone_alarms()
+    assert checkpoint.Checkpoint(filename, max_age=600).restore(restored) == []
+    assert len(restored) == 0
+    assert checkpoint.Checkpoint(filename, max_age=800).restore(restored) == []
+    assert len(restored) == 1
+
+
+def test_missing_or_broken_checkpoints(tmp_path):
+    filename = str(tmp_path / 'alarms.checkpoint')
+    za = zone_alarms()
+    assert checkpoint.Checkpoint(filename).restore(za) == []
+    with open(filename, 'w') as f:
+        f.write('{"version": 1, "ti')
+    assert checkpoint.Checkpoint(filename).restore(za) == []
+    assert len(za) == 0
@@ -0,0 +1,234 @@
+#
+# test_fa_api.py
+#
+# Runs the FlightXML client against a stub HTTP server on localhost, to
+# check its retries, backoff, timeouts and rate limit, and the TTLs of the
+# FlightInfoCache.
+#
+
+import json
+import random
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import fa_api
+
+FLIGHT = {
+    'status': 'En Route / On Time',
+    'origin': {'airport_name': 'San Francisco Intl', 'city': 'San Francisco, CA',
+               'alternate_ident': 'SFO', 'code': 'KSFO'},
+    'destination': {'airport_name': 'John Wayne', 'city': 'Santa Ana, CA',
+                    'alternate_ident': 'SNA', 'code': 'KSNA'},
+}
+OK = (200, {}, {'FlightInfoStatusResult': {'flights': [FLIGHT]}})
+UNAVAILABLE = (503, {}, {'error': 'try again'})
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((time.monotonic(), self.path))
+            status, headers, body = server.responses.pop(0) if server.responses else OK
+        time.sleep(server.delay)
+        body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.requests = []
+    server.responses = []   # (status, headers, body), then OK
+    server.delay = 0.0
+    server.lock = threading.Lock()
+    server.url = 'http://127.0.0.1:{}/json/FlightXML3/'.format(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def client(server, **kwargs):
+    kwargs.setdefault('backoff', 0.01)
+    return fa_api.FlightXMLClient('user', 'key', base_url=server.url, **kwargs)
+
+
+def test_flight_info(server):
+    info = client(server).FlightInfo('SWA1234 ')
+    assert info['orig_alt'] == 'SFO'
+    assert info['dest_code'] == 'KSNA'
+    t, path = server.requests[0]
+    assert path.startswith('/json/FlightXML3/FlightInfoStatus?')
+    assert 'ident=SWA1234&' in path
+
+
+def test_retries_server_errors(server):
+    server.responses = [UNAVAILABLE, UNAVAILABLE]
+    c = client(server)
+    assert c.FlightInfoStatus('SWA1234')[0]['orig_code'] == 'KSFO'
+    assert len(server.requests) == 3
+    assert (c.requests, c.retried, c.failures) == (3, 2, 0)
+
+
+def test_gives_up_after_the_retries(server):
+    server.responses = [UNAVAILABLE] * 3
+    c = client(server, retries=2)
+    # not a definitive answer, so not worth caching
+    assert c.FlightInfoStatus('SWA1234') == (False, False)
+    assert len(server.requests) == 3
+    assert (c.retried, c.failures) == (2, 1)
+
+
+def test_honors_retry_after(server):
+    server.responses = [(429, {'Retry-After': '1'}, {})]
+    client(server).FlightInfo('SWA1234')
+    (first, path), (second, path) = server.requests
+    assert second - first >= 0.9
+
+
+def test_retry_after_is_capped_by_max_backoff(server):
+    server.responses = [(429, {'Retry-After': '30'}, {})]
+    start = time.monotonic()
+    client(server, max_backoff=0.2).FlightInfo('SWA1234')
+    assert len(server.requests) == 2
+    assert time.monotonic() - start < 5
+
+
+def test_backoff_is_jittered_and_capped():
+    c = fa_api.FlightXMLClient('user', 'key', backoff=0.5, max_backoff=8.0)
+    random.seed(1)
+    for attempt, delay in enumerate((0.5, 1.0, 2.0, 4.0, 8.0, 8.0)):
+        delays = [c._delay(attempt, None) for i in range(20)]
+        assert all(delay / 2 <= d <= delay for d in delays)
+        assert len(set(delays)) > 1
+
+
+def test_read_timeout(server):
+    server.delay = 1.0
+    c = client(server, read_timeout=0.1, retries=1)
+    start = time.monotonic()
+    assert c.FlightInfoStatus('SWA1234') == (False, False)
+    assert time.monotonic() - start < 1.0
+    assert (c.requests, c.retried, c.failures) == (2, 1, 1)
+
+
+def test_connection_errors_are_retried():
+    # a port nothing listens on
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    c = fa_api.FlightXMLClient('user', 'key', base_url='http://127.0.0.1:{}/'.format(port),
+                               connect_timeout=0.5, retries=2, backoff=0.01)
+    assert c.FlightInfoStatus('SWA1234') == (False, False)
+    assert (c.requests, c.retried, c.failures) == (3, 2, 1)
+
+
+def test_rate_limit(server):
+    # 120 a minute is one every half second, the first goes at once
+    c = client(server, rate=120)
+    for i in range(3):
+        c.FlightInfo('SWA{}'.format(i))
+    times = [t for t, path in server.requests]
+    assert times[1] - times[0] >= 0.4
+    assert times[2] - times[1] >= 0.4
+
+
+class FakeClient(object):
+    def __init__(self, *answers):
+        self.answers = list(answers)
+        self.asked = []
+
+    def FlightInfoStatus(self, ident, results=10):
+        self.asked.append(ident)
+        return self.answers.pop(0)
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(fa_api.time, 'time', clock)
+    return clock
+
+
+def test_cache_keeps_results_for_ttl(clock):
+    info = {'orig_code': 'KSFO'}
+    fake = FakeClient((info, True), (info, True))
+    cache = fa_api.FlightInfoCache(fake, ttl=100, negative_ttl=10)
+    assert cache.FlightInfo('SWA1234') == info
+    clock.now += 99
+    assert cache.FlightInfo('SWA1234 ') == info
+    assert fake.asked == ['SWA1234']
+    clock.now += 1
+    assert cache.FlightInfo('SWA1234') == info
+    assert fake.asked == ['SWA1234', 'SWA1234']
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_cache_keeps_negative_results_for_negative_ttl(clock):
+    fake = FakeClient((False, True), (False, True))
+    cache = fa_api.FlightInfoCache(fake, ttl=100, negative_ttl=10)
+    assert cache.FlightInfo('N12345') is False
+    clock.now += 9
+    assert cache.FlightInfo('N12345') is False
+    assert len(fake.asked) == 1
+    clock.now += 1
+    cache.FlightInfo('N12345')
+    assert len(fake.asked) == 2
+
+
+def test_cache_skips_transient_failures(clock):
+    info = {'orig_code': 'KSFO'}
+    fake = FakeClient((False, False), (info, True))
+    cache = fa_api.FlightInfoCache(fake)
+    assert cache.FlightInfo('SWA1234') is False
+    assert cache.FlightInfo('SWA1234') == info
+    assert len(fake.asked) == 2
+
+
+def test_cache_evicts_the_least_recently_used(clock):
+    fake = FakeClient(*[({'n': i}, True) for i in range(4)])
+    cache = fa_api.FlightInfoCache(fake, size=2)
+    cache.FlightInfo('A')
+    cache.FlightInfo('B')
+    cache.FlightInfo('A')
+    cache.FlightInfo('C')
+    assert list(cache.entries) == ['A', 'C']
+
+
+def test_cache_file_survives_restarts(clock, tmp_path):
+    filename = str(tmp_path / 'fa')
+    cache = fa_api.FlightInfoCache(FakeClient(({'n': 1}, True), (False, True)), ttl=100,
+                                   negative_ttl=10, filename=filename)
+    cache.FlightInfo('A')
+    cache.FlightInfo('B')
+    cache.close()
+    clock.now += 50
+    # the negative result expired meanwhile
+    cache = fa_api.FlightInfoCache(FakeClient(), filename=filename)
+    assert list(cache.entries) == ['A']
+    assert cache.FlightInfo('A') == {'n': 1}
+    cache.close()
@@ -0,0 +1,143 @@
+#
+# test_messages.py
+#
+# The tweet templates, the hashtag rules and the length budget.
+#
+
+from configparser import ConfigParser
+from datetime import datetime
+
+import pytest
+
+import flightdata
+import messages
+
+TEMPLATE = '#${flight} : ${dist_mi} mi away @ ${alt_ft} ft heading ${heading} @ ${speed_mph}mi/h ${time}.'
+FA_TEMPLATE = '#${flight} : #${orig_alt} to #${dest_alt}. ${dist_mi} mi away @ ${alt_ft} ft ${time}.'
+
+FA_INFO = {'orig_name': 'San Francisco Intl', 'orig_city': 'San Francisco, CA', 'orig_alt': 'SFO',
+           'orig_code': 'KSFO', 'dest_name': 'John Wayne', 'dest_city': None,
+           'dest_alt': 'SNA', 'dest_code': 'KSNA'}
+
+
+def aircraft(altitude=1800, speed=210.0, vert_rate=-768, when=datetime(2026, 10, 14, 12, 30)):
+    # a Wednesday afternoon, heading S
+    return flightdata.AirCraftData('a1b2c3', '1200', 'SWA1234', None, 33.7, -117.8, altitude, vert_rate,
+                                   180.0, speed, 1000, 0.5, False, 7, 0.4, -12.5, 0.8, 175.0, 65.0, when)
+
+
+def renderer(**kwargs):
+    return messages.MessageRenderer(TEMPLATE, FA_TEMPLATE, **kwargs)
+
+
+def test_compiled_template_matches_string_template():
+    import string
+    text = 'a $$5 {literal} ${x}y $x'
+    compiled = messages.CompiledTemplate(text)
+    assert compiled.names == ['x', 'x']
+    assert compiled.render({'x': 'X'}) == string.Template(text).substitute(x='X')
+
+
+def test_compiled_template_errors():
+    with pytest.raises(messages.Error):
+        messages.CompiledTemplate('bad $ placeholder')
+    with pytest.raises(KeyError):
+        messages.CompiledTemplate('${missing}').render({})
+
+
+@pytest.mark.parametrize('condition', [
+    'altitude <',                       # syntax
+    '__import__("os")',                 # calls
+    'flight.lower() == "x"',            # attributes
+    'altitude < limit',                 # unknown variables
+    '[x for x in (1, 2)]',              # comprehensions
+])
+def test_rule_compilation_rejects(condition):
+    with pytest.raises(messages.Error):
+        messages.HashtagRule('#Nope', condition)
+
+
+def test_rule_adds_missing_hash():
+    assert messages.HashtagRule('Low', 'altitude < 1000').hashtag == '#Low'
+
+
+def test_rule_with_missing_value_does_not_apply():
+    rule = messages.HashtagRule('#Low', 'altitude < 1000')
+    assert rule.applies({'altitude': None}) is False
+
+
+def test_rule_that_raises_does_not_lose_the_tweet():
+    rules = {'#Steep': 'speed / vert_rate > 1', '#Low': 'altitude < 2000'}
+    text = renderer(rules=rules).render(aircraft(vert_rate=0))
+    assert text.endswith(' #Low')
+    assert '#Steep' not in text
+
+
+def test_default_rules():
+    r = renderer()
+    assert r.render(aircraft()).endswith(' #ProbablyLanding')
+    assert r.render(aircraft(altitude=30000, speed=800)).endswith(' #UpInTheClouds #SpeedDemon')
+    assert r.render(aircraft(altitude=30000, speed=600)).endswith(' #UpInTheClouds #FlyingFast')
+    # Sunday before 8
+    sunday = aircraft(altitude=30000, when=datetime(2026, 10, 18, 7, 30))
+    assert r.render(sunday).endswith(' #AfterHours #UpInTheClouds')
+
+
+def test_fa_template_and_missing_city():
+    text = renderer(rules={}).render(aircraft(), FA_INFO)
+    assert text.startswith('#SWA1234 : #SFO to #SNA. 0.8 mi away @ 1800 ft 12:30:00.')
+
+
+def test_hashtags_fill_the_budget_in_order():
+    defaults = ['#Default1', '#Default2']
+    r = renderer(default_hashtags=defaults)
+    text = r.render(aircraft())
+    base = renderer(rules={}).render(aircraft())
+    assert text == base + ' #ProbablyLanding #Default1 #Default2'
+
+    # room for the first hashtag only
+    r = renderer(default_hashtags=defaults, max_length=len(base) + len(' #ProbablyLanding') + 5)
+    assert r.render(aircraft()) == base + ' #ProbablyLanding'
+
+    # a hashtag that doesn't fit is skipped, a shorter one after it still goes
+    r = renderer(default_hashtags=['#A'], max_length=len(base) + 4)
+    assert r.render(aircraft()) == base + ' #A'
+
+
+def test_long_text_is_truncated_to_the_budget():
+    r = messages.MessageRenderer('x' * 300, default_hashtags=['#Tag'], rules={})
+    text = r.render(aircraft())
+    assert len(text) == messages.MAX_LENGTH
+    assert text.endswith('…')
+
+
+def test_zone_templates():
+    class Zone(object):
+        name = 'stadium'
+        tweet_template = '${flight} over the ${zone}'
+        fa_tweet_template = None
+    text = renderer(rules={}).render(aircraft(), FA_INFO, Zone())
+    assert text == 'SWA1234 over the stadium'
+
+
+def test_from_config():
+    parser = ConfigParser()
+    parser.read_string('''
+[tweet]
+tweet_template = ${flight} at ${alt_ft} ft
+default_hashtags = #Default
+
+[hashtags]
+low = #Low if altitude < 2000 and speed % 2 == 0
+high = #High if altitude >= 2000
+''')
+    r = messages.from_config(parser)
+    assert [rule.hashtag for rule in r.rules] == ['#Low', '#High']
+    assert r.render(aircraft(speed=210.0)) == 'SWA1234 at 1800 ft #Low #Default'
+
+
+def test_from_config_rejects_rules_without_if():
+    parser = ConfigParser()
+    parser.read_string('[tweet]\ntweet_template = x\n[hashtags]\nlow = #Low altitude < 2000\n')
+    with pytest.raises(messages.Error):
+        messages.from_config(parser)
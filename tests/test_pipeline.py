@@ -0,0 +1,70 @@
+#
+# test_pipeline.py
+#
+# The drop policies of the notification pipeline, and the finished alarms
+# of the checkpoint that the dropped ones must not be left in.
+#
+
+import threading
+
+import pytest
+
+import checkpoint
+import pipeline
+
+
+class Zone(object):
+    name = 'overhead'
+
+
+def blocked_pipeline(drop_policy, on_drop=None):
+    '''
+    blocked_pipeline()
+    A pipeline with room for one item, whose worker is held on the first
+    until the returned event is set.
+    '''
+    gate = threading.Event()
+    started = threading.Event()
+    handled = []
+
+    def handler(item):
+        started.set()
+        gate.wait(5)
+        handled.append(item)
+
+    p = pipeline.Pipeline(handler, queue_size=1, drop_policy=drop_policy, block_timeout=0.05,
+                          on_drop=on_drop)
+    p.submit(0)
+    assert started.wait(5)
+    return p, gate, handled
+
+
+@pytest.mark.parametrize('drop_policy,kept,dropped', [
+    ('oldest', [0, 3], [1, 2]),
+    ('newest', [0, 1], [2, 3]),
+    ('block', [0, 1], [2, 3]),
+])
+def test_drop_policies(drop_policy, kept, dropped):
+    on_drop = []
+    p, gate, handled = blocked_pipeline(drop_policy, on_drop.append)
+    results = [p.submit(i) for i in (1, 2, 3)]
+    assert on_drop == dropped
+    assert p.dropped == 2
+    # submit() is False when the item it was given is the one dropped
+    assert results == [drop_policy == 'oldest' or i not in dropped for i in (1, 2, 3)]
+    gate.set()
+    p.stop()
+    assert handled == kept
+
+
+def test_dropped_alarms_leave_the_checkpoint(tmp_path):
+    alarms = checkpoint.Checkpoint(str(tmp_path / 'checkpoint'))
+    p, gate, handled = blocked_pipeline('oldest', alarms.done)
+    # the worker only ends the one it handles, as the tracker does once
+    # the tweet is sent
+    p.handler = alarms.done
+    for i in range(3):
+        p.submit(alarms.fired(object(), Zone()))
+    gate.set()
+    p.stop()
+    assert not alarms.pending
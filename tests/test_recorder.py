@@ -0,0 +1,93 @@
+#
+# test_recorder.py
+#
+# Records payloads to a gzip JSON lines file and replays them into a
+# FlightData, as fast as they are consumed and at the recorded pace.
+#
+
+import gzip
+import json
+import time
+
+import flightdata
+import recorder
+
+RECEIVER = (33.7, -117.8)
+
+
+def payload(now, lat):
+    return json.dumps({'now': now, 'aircraft': [
+        {'hex': 'a1b2c3', 'flight': 'SWA1234', 'lat': lat, 'lon': -117.8, 'altitude': 3000,
+         'track': 180.0, 'speed': 250, 'seen': 0.1, 'seen_pos': 0.1}]}).encode('utf-8')
+
+
+def record(filename, count, step=1.0, start=1_800_000_000.0):
+    r = recorder.Recorder(filename)
+    for i in range(count):
+        r.write(payload(start + i * step, 33.8 - i * 0.01), when=start + i * step)
+    r.close()
+    return r
+
+
+def test_round_trip(tmp_path):
+    filename = str(tmp_path / 'flyby.gz')
+    r = recorder.Recorder(filename)
+    r.write(b'{"now": 1}', when=10.0)
+    r.write('{"now": 2}', when=11.0, source=1)
+    r.close()
+    assert r.count == 2
+    assert list(recorder.read(filename)) == [(10.0, b'{"now": 1}', 0), (11.0, b'{"now": 2}', 1)]
+    # appended to, not overwritten
+    r = recorder.Recorder(filename)
+    r.write(b'{"now": 3}', when=12.0)
+    r.close()
+    assert [when for when, raw_data, source in recorder.read(filename)] == [10.0, 11.0, 12.0]
+
+
+def test_a_recording_cut_short_is_read_up_to_the_cut(tmp_path):
+    filename = str(tmp_path / 'cut.gz')
+    with gzip.open(filename, 'wt', encoding='utf-8') as f:
+        f.write(json.dumps({'time': 10.0, 'data': '{}'}) + '\n\n')
+        f.write('{"time": 11.0, "da')
+    assert list(recorder.read(filename)) == [(10.0, b'{}', 0)]
+
+
+def replay(filename, speed):
+    fd = flightdata.FlightData(RECEIVER, parser=flightdata.Dump1090DataParser())
+    source = recorder.Replay(fd, filename, speed).start()
+    snapshots = []
+    while True:
+        snapshot = source.get(timeout=1.0)
+        if snapshot is None:
+            if source.stopped.is_set():
+                break
+            continue
+        snapshots.append((time.monotonic(), snapshot))
+        # a slow consumer
+        time.sleep(0.01)
+    return source, snapshots
+
+
+def test_replay_at_full_speed_drops_nothing(tmp_path):
+    filename = str(tmp_path / 'flyby.gz')
+    record(filename, 20, step=60.0)
+    source, snapshots = replay(filename, 0)
+    assert len(snapshots) == 20
+    assert source.dropped == 0
+    assert snapshots[-1][0] - snapshots[0][0] < 5
+    lats = [s['A1B2C3'].lat for t, s in snapshots]
+    assert lats == sorted(lats, reverse=True)
+    assert snapshots[0][1].delta.added == {'A1B2C3'}
+    assert snapshots[1][1].delta.updated == {'A1B2C3'}
+    assert snapshots[1][1]['A1B2C3'].distance < snapshots[0][1]['A1B2C3'].distance
+
+
+def test_replay_keeps_the_recorded_pace(tmp_path):
+    filename = str(tmp_path / 'flyby.gz')
+    record(filename, 4, step=0.2)
+    source, snapshots = replay(filename, 1)
+    assert len(snapshots) == 4
+    assert snapshots[-1][0] - snapshots[0][0] >= 0.5
+    # twice as fast
+    source, snapshots = replay(filename, 2)
+    assert 0.25 <= snapshots[-1][0] - snapshots[0][0] < 0.5
@@ -0,0 +1,188 @@
+#
+# test_sinks.py
+#
+# Runs the webhook and Mastodon sinks against a stub HTTP server on
+# localhost, to check the batching, the dropping of the oldest
+# notifications and the rate limit of the SinkRunner.
+#
+
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import sinks
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        # held here while the test fills the queue
+        server.gate.wait(10)
+        with server.lock:
+            server.requests.append((time.monotonic(), self.path, self.headers.get('Content-Type'), body))
+        response = b'{"id": "1"}'
+        self.send_response(server.status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.requests = []
+    server.lock = threading.Lock()
+    server.gate = threading.Event()
+    server.gate.set()
+    server.status = 200
+    server.url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.gate.set()
+    server.shutdown()
+    server.server_close()
+
+
+def posted(server):
+    with server.lock:
+        return [json.loads(body) for t, path, content_type, body in server.requests]
+
+
+def notification(i):
+    return sinks.Notification('alarm {}'.format(i), fields={'hex': 'a{:05x}'.format(i)})
+
+
+def test_webhook_sends_one_notification_as_itself(server):
+    runner = sinks.SinkRunner(sinks.WebhookSink('hook', server.url + '/overhead'))
+    runner.submit(notification(1))
+    runner.stop()
+    assert posted(server) == [{'hex': 'a00001', 'text': 'alarm 1'}]
+    assert server.requests[0][1] == '/overhead'
+    assert runner.sent == 1
+
+
+def test_webhook_batches_what_arrives_within_batch_wait(server):
+    runner = sinks.SinkRunner(sinks.WebhookSink('hook', server.url), batch_size=3, batch_wait=1.0)
+    for i in range(5):
+        runner.submit(notification(i))
+    runner.stop()
+    bodies = posted(server)
+    assert [[n['text'] for n in body['notifications']] for body in bodies] == [
+        ['alarm 0', 'alarm 1', 'alarm 2'], ['alarm 3', 'alarm 4']]
+    assert runner.sent == 5
+    assert runner.dropped == 0
+
+
+def test_next_batch_stops_at_batch_size_and_batch_wait():
+    # without its thread, which would take the items itself
+    runner = sinks.SinkRunner.__new__(sinks.SinkRunner)
+    runner.batch_size = 2
+    runner.batch_wait = 0.2
+    runner.queue = queue.Queue()
+    for i in range(3):
+        runner.queue.put(i)
+    assert runner.next_batch() == [0, 1]
+    start = time.monotonic()
+    assert runner.next_batch() == [2]
+    assert time.monotonic() - start >= 0.15
+    # a stop in the middle of a batch ends the batch, and is seen next
+    runner.queue.put(3)
+    runner.queue.put(None)
+    assert runner.next_batch() == [3]
+    assert runner.next_batch() is None
+
+
+def test_full_queue_drops_the_oldest(server):
+    server.gate.clear()
+    runner = sinks.SinkRunner(sinks.WebhookSink('hook', server.url), queue_size=2)
+    runner.submit(notification(0))
+    # wait for the runner to take it, it is then held by the server
+    deadline = time.monotonic() + 5
+    while runner.pending() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    for i in range(1, 5):
+        runner.submit(notification(i))
+    assert runner.dropped == 2
+    assert runner.pending() == 2
+    server.gate.set()
+    runner.stop()
+    assert [body['text'] for body in posted(server)] == ['alarm 0', 'alarm 3', 'alarm 4']
+    assert runner.sent == 3
+
+
+def test_failed_sends_are_counted(server):
+    server.status = 500
+    runner = sinks.SinkRunner(sinks.WebhookSink('hook', server.url))
+    runner.submit(notification(1))
+    runner.stop()
+    assert runner.sent == 0
+    assert runner.failed == 1
+
+
+def test_mastodon_is_rate_limited(server):
+    # 120 a minute is one every half second, the first goes at once
+    runner = sinks.SinkRunner(sinks.MastodonSink('toot', server.url + '/', 'secret', visibility='unlisted'),
+                              rate=120)
+    for i in range(3):
+        runner.submit(notification(i))
+    runner.stop()
+    times = [t for t, path, content_type, body in server.requests]
+    assert [path for t, path, content_type, body in server.requests] == ['/api/v1/statuses'] * 3
+    assert times[1] - times[0] >= 0.4
+    assert times[2] - times[1] >= 0.4
+    assert b'visibility=unlisted' in server.requests[0][3]
+    assert runner.sent == 3
+
+
+def test_on_done_waits_for_every_sink(server):
+    server.gate.clear()
+    done = threading.Event()
+    slow = sinks.SinkRunner(sinks.WebhookSink('slow', server.url))
+    files = []
+
+    class Memory(sinks.Sink):
+        def send(self, notification):
+            files.append(notification.text)
+
+    fast = sinks.SinkRunner(Memory('memory'))
+    dispatcher = sinks.Dispatcher([slow, fast])
+    dispatcher.submit(sinks.Notification('alarm', on_done=done.set))
+    deadline = time.monotonic() + 5
+    while not files and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert files == ['alarm']
+    assert not done.wait(0.2)
+    server.gate.set()
+    assert done.wait(5)
+    dispatcher.stop()
+
+
+def test_on_done_of_dropped_notifications(server):
+    server.gate.clear()
+    runner = sinks.SinkRunner(sinks.WebhookSink('hook', server.url), queue_size=1)
+    finished = []
+    dispatcher = sinks.Dispatcher([runner])
+    for i in range(4):
+        dispatcher.submit(sinks.Notification('alarm {}'.format(i), on_done=lambda i=i: finished.append(i)))
+        time.sleep(0.05)
+    # 0 is being sent, 3 waits and 1 and 2 were dropped
+    assert sorted(finished) == [1, 2]
+    server.gate.set()
+    dispatcher.stop()
+    assert sorted(finished) == [0, 1, 2, 3]
+
+
+def test_on_done_without_sinks():
+    finished = []
+    sinks.Dispatcher([]).submit(sinks.Notification('alarm', on_done=lambda: finished.append(1)))
+    assert finished == [1]
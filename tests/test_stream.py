@@ -0,0 +1,217 @@
+#
+# test_stream.py
+#
+# Feeds recorded SBS-1 and Beast bytes to the stream decoders, directly
+# and through a local socket, and checks them against the standard
+# ADS-B examples.
+#
+
+import socket
+import threading
+import time
+
+import pytest
+
+import flightdata
+import stream
+
+# The reference position of the ADS-B examples, close enough to decode
+# 40621D's position locally.
+RECEIVER = (52.258, 3.918)
+
+# DF17 identification of 4840D6: KLM1023.
+IDENT = '8D4840D6202CC371C32CE0576098'
+# DF17 airborne position of 40621D: 52.2572, 3.91937 at 38000 ft.
+POSITION = '8D40621D58C382D690C8AC2863A7'
+# DF17 airborne velocity of 485020: 159 kt, track 182.88, -832 ft/min.
+VELOCITY = '8D485020994409940838175B284F'
+
+# A snapshot is published when a position arrives, so it comes last.
+SBS_LINES = (
+    'MSG,1,1,1,4CA2D6,1,2026/10/18,12:00:00.000,2026/10/18,12:00:00.000,KLM1023 ,,,,,,,,0,0,0,0',
+    'MSG,4,1,1,4CA2D6,1,2026/10/18,12:00:00.100,2026/10/18,12:00:00.100,,,159,182.9,,,-832,,0,0,0,0',
+    'MSG,6,1,1,4CA2D6,1,2026/10/18,12:00:00.200,2026/10/18,12:00:00.200,,,,,,,,1200,0,0,0,0',
+    'MSG,3,1,1,4CA2D6,1,2026/10/18,12:00:00.300,2026/10/18,12:00:00.300,,35000,,,52.2572,3.9194,,,0,0,0,0',
+)
+
+
+def beast_frame(message, signal=0x80, timestamp=b'\x00\x00\x1a\x00\x00\x01'):
+    '''
+    beast_frame()
+    The Beast frame of a long Mode S message given in hex, with the 0x1a
+    bytes of its body doubled.
+    '''
+    body = timestamp + bytes([signal]) + bytes.fromhex(message)
+    return b'\x1a\x33' + body.replace(b'\x1a', b'\x1a\x1a')
+
+
+def beast_bytes():
+    return beast_frame(IDENT) + beast_frame(VELOCITY) + beast_frame(POSITION)
+
+
+def sbs_bytes():
+    return ''.join(line + '\r\n' for line in SBS_LINES).encode('ascii')
+
+
+def chunks(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def test_crc_of_the_examples_is_zero():
+    for message in (IDENT, POSITION, VELOCITY):
+        assert stream.crc(bytes.fromhex(message)) == 0
+
+
+def test_beast_decodes_the_examples():
+    decoder = stream.BeastDecoder(*RECEIVER)
+    state = stream.StreamState()
+    assert decoder.feed(beast_bytes(), state, 100.0) == 1
+
+    klm = state.aircraft['4840D6']
+    assert klm.flight == 'KLM1023'
+
+    a = state.aircraft['40621D']
+    assert a.lat == pytest.approx(52.2572, abs=1e-4)
+    assert a.lon == pytest.approx(3.91937, abs=1e-4)
+    assert a.altitude == 38000
+    assert a.last_pos == 100.0
+
+    v = state.aircraft['485020']
+    assert v.speed == pytest.approx(159.2, abs=0.1)
+    assert v.track == pytest.approx(182.88, abs=0.01)
+    assert v.vert_rate == -832
+    assert decoder.bad_crc == 0
+
+
+def test_beast_frames_split_across_reads():
+    # one byte at a time, through the escaped 0x1a of the timestamps
+    decoder = stream.BeastDecoder(*RECEIVER)
+    state = stream.StreamState()
+    positions = sum(decoder.feed(chunk, state, 100.0) for chunk in chunks(beast_bytes(), 1))
+    assert positions == 1
+    assert set(state.aircraft) == {'4840D6', '40621D', '485020'}
+    assert decoder.buffer == b''
+
+
+def test_beast_skips_bad_crc():
+    corrupt = POSITION[:-2] + '00'
+    decoder = stream.BeastDecoder(*RECEIVER)
+    state = stream.StreamState()
+    assert decoder.feed(beast_frame(corrupt), state, 100.0) == 0
+    assert decoder.bad_crc == 1
+    assert state.aircraft == {}
+
+
+def test_sbs_decodes_lines_split_across_reads():
+    decoder = stream.SBSDecoder()
+    state = stream.StreamState()
+    positions = sum(decoder.feed(chunk, state, 100.0) for chunk in chunks(sbs_bytes(), 7))
+    assert positions == 1
+    a = state.aircraft['4CA2D6']
+    assert a.flight == 'KLM1023'
+    assert (a.lat, a.lon, a.altitude) == (52.2572, 3.9194, 35000)
+    assert (a.speed, a.track, a.vert_rate, a.squawk) == (159.0, 182.9, -832, '1200')
+
+
+class RecordedStream(object):
+    '''
+    A local TCP server that sends the recorded bytes, a few at a time, to
+    the first client, then closes the connection.
+    '''
+    def __init__(self, data, chunk_size=5):
+        self.data = data
+        self.chunk_size = chunk_size
+        self.sent = threading.Event()
+        self.server = socket.socket()
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        conn, address = self.server.accept()
+        with conn:
+            for chunk in chunks(self.data, self.chunk_size):
+                conn.sendall(chunk)
+                time.sleep(0.001)
+            self.sent.set()
+            # let the client publish before the connection goes away
+            time.sleep(0.2)
+        self.server.close()
+
+
+def stream_snapshot(source_class, data):
+    server = RecordedStream(data)
+    fd = flightdata.FlightData(RECEIVER, parser=stream.StreamDataParser())
+    source = source_class(fd, 'tcp://127.0.0.1:{}'.format(server.port), 0.01).start()
+    try:
+        assert server.sent.wait(5), 'the stream was not read'
+        # the snapshot published after the last bytes arrived
+        time.sleep(0.1)
+        snapshot = source.get(timeout=1.0)
+        assert snapshot is not None, 'no snapshot from the stream'
+        return snapshot
+    finally:
+        source.stop()
+
+
+def test_beast_source_over_a_socket():
+    snapshot = stream_snapshot(stream.BeastSource, beast_bytes())
+    a = snapshot['40621D']
+    assert a.lat == pytest.approx(52.2572, abs=1e-4)
+    assert a.lon == pytest.approx(3.91937, abs=1e-4)
+    assert a.altitude == 38000
+    # located from the receiver, 0.08 mi away
+    assert a.distance == pytest.approx(0.08, abs=0.01)
+    assert snapshot['4840D6'].flight == 'KLM1023'
+    assert snapshot['485020'].track == pytest.approx(182.88, abs=0.01)
+
+
+def test_sbs_source_over_a_socket():
+    snapshot = stream_snapshot(stream.SBSSource, sbs_bytes())
+    a = snapshot['4CA2D6']
+    assert (a.lat, a.lon, a.altitude) == (52.2572, 3.9194, 35000)
+    assert a.flight == 'KLM1023'
+    assert a.squawk == '1200'
+
+
+class SilentStream(RecordedStream):
+    '''
+    Sends the recorded bytes, then keeps the connection open without
+    sending anything more until closed.
+    '''
+    def serve(self):
+        conn, address = self.server.accept()
+        with conn:
+            conn.sendall(self.data)
+            self.sent.set()
+            self.done.wait(10)
+        self.server.close()
+
+
+def test_silent_aircraft_expire(monkeypatch):
+    monkeypatch.setattr(stream, 'AIRCRAFT_TIMEOUT', 0.3)
+    server = SilentStream(sbs_bytes())
+    server.done = threading.Event()
+    fd = flightdata.FlightData(RECEIVER, parser=stream.StreamDataParser())
+    source = stream.SBSSource(fd, 'tcp://127.0.0.1:{}'.format(server.port), 0.05).start()
+    try:
+        assert server.sent.wait(5), 'the stream was not read'
+        seen = []
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            snapshot = source.get(timeout=1.0)
+            assert snapshot is not None, 'no snapshot while the stream is silent'
+            if '4CA2D6' in snapshot or seen:
+                seen.append(snapshot)
+            if seen and '4CA2D6' not in snapshot:
+                break
+        # snapshots kept coming with nothing new, until the aircraft expired
+        assert seen, 'the aircraft was never seen'
+        assert '4CA2D6' not in seen[-1]
+        assert '4CA2D6' in seen[-1].delta.removed
+        assert any(s.delta.unchanged == {'4CA2D6'} for s in seen)
+    finally:
+        server.done.set()
+        source.stop()
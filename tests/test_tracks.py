@@ -0,0 +1,110 @@
+#
+# test_tracks.py
+#
+# The track history of each aircraft and the closest point of approach
+# interpolated between its positions.
+#
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import flightdata
+import geomath
+import tracks
+
+RECEIVER = (33.7, -117.8)
+START = datetime(2026, 10, 18, 12, 0)
+
+
+def snapshot(seconds, positions, previous=None):
+    '''
+    snapshot()
+    The AircraftSnapshot `seconds` after START of the aircraft given as
+    {hex: (lat, lon, altitude)}, diffed against the previous one.
+    '''
+    s = flightdata.AircraftSnapshot(START + timedelta(seconds=seconds))
+    for dhex, (lat, lon, alt) in positions.items():
+        s.append(dhex, '1200', 'SWA1234', None, lat, lon, alt, 0, 90.0, 300.0,
+                 100, 0.1, False, 7, 0.0, -10.0)
+    s.diff(previous)
+    return s.locate(RECEIVER, previous)
+
+
+def fly_east(history, lons, lat=33.71, alt=3000, step=10):
+    # 0.01 degree north of the receiver, about 0.69 mi
+    previous = None
+    for k, lon in enumerate(lons):
+        previous = snapshot(k * step, {'A1B2C3': (lat, lon, alt)}, previous)
+        history.observe(previous)
+    return previous
+
+
+def test_track_ring_buffer():
+    track = tracks.Track(3)
+    for i in range(5):
+        track.append(float(i), 33.0 + i, -117.0, 1000.0 * i)
+    assert len(track) == 3
+    assert track.last_time == 4.0
+    assert [p[0] for p in track.points()] == [2.0, 3.0, 4.0]
+
+
+def test_closest_approach_between_two_samples():
+    history = tracks.TrackHistory()
+    last = fly_east(history, (-117.84, -117.81, -117.78))
+    samples = [geomath.distance(RECEIVER, (p[1], p[2])) for p in history.get('A1B2C3').points()]
+
+    cpa = history.closest_approach('A1B2C3', *RECEIVER)
+    assert cpa.distance < min(samples)
+    assert cpa.distance == pytest.approx(geomath.distance(RECEIVER, (33.71, -117.8)), rel=1e-3)
+    assert cpa.lon == pytest.approx(-117.8)
+    # a third of the way from the second sample to the third
+    assert cpa.time == pytest.approx(START + timedelta(seconds=10 + 10 / 3.0), abs=timedelta(milliseconds=1))
+    assert cpa.altitude == 3000
+    assert cpa.el > max(geomath.elevation(d, 3000) for d in samples)
+
+    # the aircraft data tweeted is moved to the closest approach
+    a = cpa.apply(last['A1B2C3'])
+    assert (a.distance, a.el, a.time) == (cpa.distance, cpa.el, cpa.time)
+    assert a.flight == 'SWA1234'
+    assert last['A1B2C3'].distance > a.distance
+
+
+def test_closest_approach_at_an_end_of_the_track():
+    history = tracks.TrackHistory()
+    fly_east(history, (-117.90, -117.87, -117.84))
+    cpa = history.closest_approach('A1B2C3', *RECEIVER)
+    assert cpa.lon == pytest.approx(-117.84)
+    assert cpa.time == START + timedelta(seconds=20)
+
+
+def test_closest_approach_of_one_sample():
+    points = [(START.timestamp(), 33.71, -117.8, 3000.0)]
+    cpa = tracks.closest_approach(points, *RECEIVER)
+    assert cpa.time == START
+    assert cpa.distance == pytest.approx(geomath.distance(RECEIVER, (33.71, -117.8)))
+    assert tracks.closest_approach([], *RECEIVER) is None
+
+
+def test_positions_are_dated_by_seen_pos():
+    history = tracks.TrackHistory()
+    s = flightdata.AircraftSnapshot(START)
+    s.append('A1B2C3', None, None, None, 33.71, -117.8, 3000, 0, 90.0, 300.0, 100, 0.1, False, 7, 2.5, -10.0)
+    s.diff(None)
+    history.observe(s.locate(RECEIVER))
+    assert history.get('A1B2C3').last_time == START.timestamp() - 2.5
+
+
+def test_stale_tracks_are_dropped():
+    history = tracks.TrackHistory(stale=60)
+    first = snapshot(0, {'A1B2C3': (33.71, -117.84, 3000), 'D4E5F6': (33.75, -117.9, 9000)})
+    history.observe(first)
+    # A1B2C3 keeps moving, D4E5F6 stays put, so isn't appended to
+    second = snapshot(60, {'A1B2C3': (33.71, -117.83, 3000), 'D4E5F6': (33.75, -117.9, 9000)}, first)
+    history.observe(second)
+    assert 'D4E5F6' in history
+    third = snapshot(61, {'A1B2C3': (33.71, -117.82, 3000)}, second)
+    history.observe(third)
+    assert 'D4E5F6' not in history
+    assert history.closest_approach('D4E5F6', *RECEIVER) is None
+    assert len(history.get('A1B2C3')) == 3
@@ -0,0 +1,53 @@
+#
+# test_zones.py
+#
+# The predicted time until an aircraft enters an alarm zone.
+#
+
+import math
+
+import pytest
+
+import zones
+
+# 1 mi, or above 50 degrees: 4.77 mi around at 30000 ft.
+ZONE = zones.AlarmZone(33.7, -117.8, 1, 50)
+
+
+def position(east, north):
+    # the lat, lon a number of miles from the zone
+    return (ZONE.latitude + north / zones.MILES_PER_DEGREE,
+            ZONE.longitude + east / ZONE.miles_per_degree_lon)
+
+
+def test_inside_is_now_even_without_a_track():
+    assert ZONE.time_to_entry(*position(0.5, 0), 3000, None, 0) == 0.0
+
+
+def test_no_track_or_moving_away_never_enters():
+    assert ZONE.time_to_entry(*position(10, 0), 3000, None, 300) == math.inf
+    assert ZONE.time_to_entry(*position(10, 0), 3000, 270.0, 0) == math.inf
+    assert ZONE.time_to_entry(*position(10, 0), 3000, 90.0, 300) == math.inf
+
+
+def test_straight_at_the_zone():
+    # 9 mi to the edge of the 1 mi zone at 360 mi/h
+    assert ZONE.time_to_entry(*position(10, 0), 1000, 270.0, 360) == pytest.approx(90, rel=0.01)
+
+
+def test_passing_inside_the_cone():
+    # 3 mi to the side, inside the 4.77 mi of the cone at 30000 ft
+    t = ZONE.time_to_entry(*position(10, 3), 30000, 270.0, 300)
+    assert t == pytest.approx((10 - math.sqrt(ZONE.radius(30000) ** 2 - 9)) / 300 * 3600, rel=0.01)
+
+
+def test_descending_below_the_cone_never_enters():
+    # by the time it would reach the cone it is down to 15000 ft, where
+    # the cone is 2.4 mi around and it passes 3 mi away
+    assert ZONE.time_to_entry(*position(10, 3), 30000, 270.0, 300, -12000) == math.inf
+
+
+def test_zone_index_horizon():
+    index = zones.ZoneIndex([ZONE, zones.AlarmZone(34.5, -118.5, 1, 50)], horizon=60)
+    assert index.time_to_entry(*position(4, 0), 1000, 270.0, 360) == pytest.approx(30, rel=0.01)
+    assert index.time_to_entry(*position(10, 0), 1000, 270.0, 360) == math.inf
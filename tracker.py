@@ -5,223 +5,218 @@
 #
 
 import sys
-import traceback
-import time
-from time import sleep
-from twitter import *
-from configparser import ConfigParser
-from string import Template
 
+import alarms
+import checkpoint
+import config
 import datasource
 import fa_api
+import fastjson
 import flightdata
-import geomath
+import messages
+import metrics
+import pipeline
+import poller
 import screenshot
-
-# Read the configuration file for this application.
-parser = ConfigParser()
-parser.read('config.ini')
-
-# Assign AboveTustin variables.
-abovetustin_distance_alarm = float(parser.get('abovetustin', 'distance_alarm'))	# The alarm distance in miles.
-abovetustin_elevation_alarm = float(parser.get('abovetustin', 'elevation_alarm'))	# The angle in degrees that indicates if the airplane is overhead or not.
-abovetustin_wait_x_updates = int(parser.get('abovetustin', 'wait_x_updates'))	# Number of updates to wait after the airplane has left the alarm zone before tweeting.
-abovetustin_sleep_time = float(parser.get('abovetustin', 'sleep_time'))		# Time between each loop.
-
-# Assign FlightAware variables.
-fa_enable = parser.getboolean('flightaware', 'fa_enable')
-fa_username = parser.get('flightaware', 'fa_username')
-fa_api_key = parser.get('flightaware', 'fa_api_key')
-
-# Assign Twitter variables.
-twitter_consumer_key = parser.get('twitter', 'consumer_key')
-twitter_consumer_secret = parser.get('twitter', 'consumer_secret')
-twitter_access_token = parser.get('twitter', 'access_token')
-twitter_access_token_secret = parser.get('twitter', 'access_token_secret')
-
-
-# Login to twitter.
-twit = Twitter(auth=(OAuth(twitter_access_token, twitter_access_token_secret, twitter_consumer_key, twitter_consumer_secret)))
+import sightings
+import sinks
+import tracks
+import zones
 
 # Given an aircraft 'a' tweet.  
-# If we have a screenshot, upload it to twitter with the tweet.
-def Tweet(a, havescreenshot):
-	# compile the template arguments
-	templateArgs = dict()
-	flight = a.flight or a.hex
-	flight = flight.replace(" ", "")
-	templateArgs['flight'] = flight
-	templateArgs['icao'] = a.hex
-	templateArgs['icao'] = templateArgs['icao'].replace(" ", "")
-	templateArgs['dist_mi'] = "%.1f" % a.distance
-	templateArgs['dist_km'] = "%.1f" % geomath.mi2km(a.distance)
-	templateArgs['dist_nm'] = "%.1f" % geomath.mi2nm(a.distance)
-	templateArgs['alt_ft'] = a.altitude
-	templateArgs['alt_m'] = "%.1f" % geomath.ft2m(a.altitude)
-	templateArgs['el'] = "%.1f" % a.el
-	templateArgs['az'] = "%.1f" % a.az
-	templateArgs['heading'] = geomath.HeadingStr(a.track)
-	templateArgs['speed_mph'] = "%.1f" % a.speed
-	templateArgs['speed_kmph'] = "%.1f" % geomath.mi2km(a.speed)
-	templateArgs['speed_kts'] = "%.1f" % geomath.mi2nm(a.speed)
-	templateArgs['time'] = a.time.strftime('%H:%M:%S')
-	templateArgs['squawk'] = a.squawk
-	templateArgs['vert_rate_ftpm'] = a.vert_rate
-	templateArgs['vert_rate_mpm'] = "%.1f" % geomath.ft2m(a.vert_rate)
-	templateArgs['rssi'] = a.rssi
-	if fa_enable and faInfo:
-		templateArgs['orig_name'] = faInfo['orig_name']
-		templateArgs['dest_name'] = faInfo['dest_name']
-		if faInfo['orig_alt']:
-			templateArgs['orig_alt'] = faInfo['orig_alt']
-		else:
-			templateArgs['orig_alt'] = faInfo['orig_code']
-		if faInfo['dest_alt']:
-			templateArgs['dest_alt'] = faInfo['dest_alt']
-		else:
-			templateArgs['dest_alt'] = faInfo['dest_code']
-		if faInfo['dest_city']:
-			templateArgs['dest_city'] = faInfo['dest_city']
-		if faInfo['orig_city']:
-			templateArgs['orig_city'] = faInfo['orig_city']
-		if templateArgs['orig_alt'] and templateArgs['dest_alt']:
-			tweet = Template(parser.get('tweet', 'fa_tweet_template')).substitute(templateArgs)
-		else:
-			tweet = Template(parser.get('tweet', 'tweet_template')).substitute(templateArgs)
-	else:
-		tweet = Template(parser.get('tweet', 'tweet_template')).substitute(templateArgs)
-	#conditional hashtags:
-	hashtags = []
-	if a.time.hour < 7 or a.time.hour >= 23 or (a.time.weekday() == 7 and a.time.hour < 8):
-		hashtags.append(" #AfterHours")
-	if a.altitude < 1000:
-		hashtags.append(" #2CloseForComfort")
-	if a.altitude >= 1000 and a.altitude < 2500 and (templateArgs['heading'] == "S" or templateArgs['heading'] == "SW"):
-		hashtags.append(" #ProbablyLanding")
-	if a.altitude > 20000 and a.altitude < 35000:
-		hashtags.append(" #UpInTheClouds")
-	if a.altitude >= 35000:
-		hashtags.append(" #WayTheHeckUpThere")
-	if a.speed > 300 and a.speed < 500:
-		hashtags.append(" #MovingQuickly")
-	if a.speed >= 500 and a.speed < 770:
-		hashtags.append(" #FlyingFast")
-	if a.speed >= 700:
-		hashtags.append(" #SpeedDemon")
-
-	# add the conditional hashtags as long as there is room in 140 chars
-	for hash in hashtags: 
-		if len(tweet) + len(hash) <= 280:
-			tweet += hash
-
-	# add the default hashtags as long as there is room
-	for hash in parser.get('tweet', 'default_hashtags').split(' '):
-		if len(tweet) + len(hash) <= 279:
-			tweet += " " + hash
-
-	# send tweet to twitter!
-	if havescreenshot:
-		with open('tweet.png', "rb") as imagefile:
-			imagedata = imagefile.read()
-		params = {"media[]": imagedata, "status": tweet}
-		twit.statuses.update_with_media(**params)
-	else:
-		twit.statuses.update(status=tweet)
+# If we have a screenshot, it goes with the tweet as PNG bytes.
+# faInfo is the FlightAware flight details, or False if there aren't any.
+# zone is the alarm zone it was in, whose tweet templates are used if it
+# has its own.  The tweet is queued for every sink (Twitter, Mastodon,
+# webhooks...), each sends it from its own thread; done() is called once
+# they all have sent it, failed to or dropped it.
+def Tweet(a, imagedata, faInfo=False, zone=None, done=None):
+	faInfo = faInfo if settings.fa_enable else False
+	tweet = renderer.render(a, faInfo, zone)
+	dispatcher.submit(sinks.Notification(tweet, imagedata, sinks.aircraft_fields(a, faInfo, zone), done))
 
 	# send the tweet to stdout while we're at it
 	print(tweet)
 
-if __name__ == "__main__":
+# How long the alarms take and how many are waiting, see metrics.py.
+ALARM_SECONDS = flightdata.REFRESH_SECONDS.labels('alarms')
+ALARMS_ACTIVE = metrics.gauge('abovetustin_alarms_active', 'Aircraft that triggered an alarm zone and are not yet tweeted')
+NOTIFY_PENDING = metrics.gauge('abovetustin_notify_pending', 'Alarms queued for tweeting')
+
+# Screenshot and tweet a finished alarm.  faFuture is the FlightAware
+# lookup that was started when the aircraft entered the alarm zone, or
+# None.  This runs on the notification pipeline's worker threads, never on
+# the polling loop.  done() is called once the tweet is sent, see Tweet().
+def Notify(a, faFuture, zone=None, done=None):
+	imagedata = None
+	if display != None:
+		print("time to create screenshot of {}:".format(a))
+		hexcode = a.hex
+		hexcode = hexcode.replace(" ", "")
+		hexcode = hexcode.replace("~", "")
+		imagedata = display.clickOnAirplane(hexcode)
+	if settings.fa_enable:
+		print("Waiting for FlightAware flight details")
+		faInfo = fa_api.FlightInfoPrefetcher.wait(faFuture, settings.fa_timeout)
+	else:
+		faInfo = False
+
+	print("time to tweet!!!!!")
+	Tweet(a, imagedata, faInfo, zone, done)
+	sys.stdout.flush()
+
+# Notify a finished alarm (closest, faFuture, zone, key) handed to the
+# workers.  It is dropped from the checkpoint once every sink is done with
+# the tweet.  An alarm that couldn't be tweeted, or that a full queue
+# dropped, isn't tried again; one still queued at a restart is.
+def NotifyAlarm(alarm):
+	closest, faFuture, zone, key = alarm
+	try:
+		Notify(closest, faFuture, zone, lambda: AlarmDone(alarm))
+	except Exception:
+		AlarmDone(alarm)
+		raise
+
+# Drop an alarm that was tweeted, or that won't be, from the checkpoint.
+def AlarmDone(alarm):
+	closest, faFuture, zone, key = alarm
+	if alarmCheckpoint is not None:
+		alarmCheckpoint.done(key)
+
+# Queue a finished alarm for the workers, keeping it in the checkpoint
+# until it is tweeted.
+def QueueAlarm(closest, faFuture, zone):
+	key = alarmCheckpoint.fired(closest, zone) if alarmCheckpoint is not None else None
+	notifier.submit((closest, faFuture, zone, key))
 
-	lastReloadTime = time.time()
-	display = datasource.get_map_source()
-	alarms = dict() # dictonary of all aircraft that have triggered the alarm
-			# Indexed by it's hex code, each entry contains a tuple of
-			# the aircraft data at the closest position so far, and a 
-			# counter.  Once the airplane is out of the alarm zone,
-			# the counter is incremented until we hit [abovetustin_wait_x_updates]
-			# (defined above), at which point we then Tweet
+if __name__ == "__main__":
 
-	fd = datasource.get_data_source()
-	lastTime = fd.time
+	# the configuration, read once and handed to what needs it
+	parser = config.load()
+	settings = config.Settings.from_parser(parser)
+	# the tweet templates and hashtag rules, compiled once
+	renderer = messages.from_config(parser)
+
+	metrics.start(settings.metrics_port, settings.metrics_address)
+	display = datasource.get_map_source(settings)
+	faPrefetcher = None
+	if settings.fa_enable:
+		faClient = fa_api.FlightXMLClient(settings.fa_username, settings.fa_api_key,
+			connect_timeout=settings.fa_connect_timeout, read_timeout=settings.fa_read_timeout,
+			retries=settings.fa_retries, rate=settings.fa_rate_limit)
+		faCache = fa_api.FlightInfoCache(faClient, settings.fa_cache_size, settings.fa_cache_ttl,
+			settings.fa_negative_ttl, settings.fa_cache_file or None)
+		faPrefetcher = fa_api.FlightInfoPrefetcher(faCache.FlightInfo)
+	# where the tweets go, each sink sends from its own thread
+	dispatcher = sinks.from_config(parser)
+	for runner in dispatcher:
+		print("sending the tweets to the {}".format(runner.sink))
+	# finished alarms are handed to a pool of workers so the loop below
+	# never waits on the browser or the network.
+	notifier = pipeline.Pipeline(NotifyAlarm,
+		workers=settings.notify_workers,
+		queue_size=settings.notify_queue_size,
+		drop_policy=settings.notify_drop_policy,
+		name='notify',
+		on_drop=AlarmDone)
+	NOTIFY_PENDING.set_function(notifier.pending)
+	# the alarm zones, from the [zone:<name>] sections or around the receiver
+	zoneIndex = zones.ZoneIndex(zones.from_config(parser, settings.receiver,
+		settings.distance_alarm, settings.elevation_alarm))
+	for zone in zoneIndex:
+		print("watching {}".format(zone))
+		# compile the zone's own templates before the workers use them
+		renderer.templates_for(zone)
+	fd = datasource.get_data_source(settings, zoneIndex)
+	print("decoding the aircraft data with {}".format(fastjson.BACKEND))
+	# poll in the background on a fixed cadence, the loop below takes each
+	# new snapshot as soon as it is parsed.
+	source = datasource.get_poller(settings, fd, settings.sleep_time).start()
+	# poll slower while nothing is heading for the alarm zone
+	scheduler = poller.PollScheduler(zoneIndex, settings.sleep_time, settings.max_sleep_time)
+	# recent positions of every aircraft, for the closest approach
+	history = tracks.TrackHistory(settings.track_history_size, settings.track_stale_time)
+	# the aircraft that triggered an alarm zone, each starts its flight
+	# details lookup when it enters the zone and is tweeted
+	# [wait_x_updates] updates after it left it.
+	enrich = (lambda a: faPrefetcher.prefetch(a.flight)) if faPrefetcher else None
+	alarmTracker = alarms.ZoneAlarms(zoneIndex, settings.wait_x_updates, enrich)
+	# the alarms are checkpointed so a restart, or a crash, doesn't lose
+	# the aircraft in the middle of a pass or waiting to be tweeted
+	alarmCheckpoint = None
+	if settings.checkpoint_file:
+		alarmCheckpoint = checkpoint.Checkpoint(settings.checkpoint_file,
+			settings.checkpoint_interval, settings.checkpoint_max_age)
+		for closest, zone in alarmCheckpoint.restore(alarmTracker):
+			print("{} was not tweeted before the restart, queueing it for tweeting".format(closest))
+			QueueAlarm(closest, enrich(closest) if enrich else None, zone)
+	# the history of the tweeted aircraft, written in the background
+	history_db = None
+	if settings.sightings_db:
+		history_db = sightings.SightingStore(settings.sightings_db, settings.sightings_flush_interval)
+		print("keeping the sighting history in {}".format(settings.sightings_db))
+	snapshots = 0
 
 	while True:
-		if time.time() > lastReloadTime + 3600 and len(alarms) == 0:
-			print("one hour since last browser reload... reloading now")
-			display.reload()
-			lastReloadTime = time.time()
-
-		sleep(abovetustin_sleep_time)
-		fd.refresh()
-		if fd.time == lastTime:
+		aircraft = source.get(timeout=1.0)
+		if aircraft is None:
+			if source.stopped.is_set():
+				# the end of a replayed recording
+				break
 			continue
-		lastTime = fd.time
-
-		print("Now: {}".format(fd.time))
-
-		current = dict() # current aircraft inside alarm zone
-
-		# loop on all the aircarft in the receiver
-		for a in fd.aircraft:
-			# if they don't have lat/lon or a heading skip them
-			if a.lat == None or a.lon == None or a.track == None:
-				continue
-			# check to see if it's in the alarm zone:
-			if a.distance < abovetustin_distance_alarm or a.el > abovetustin_elevation_alarm:
-				# add it to the current dictionary
-				current[a.hex] = a 
-				print("{}: {}mi, {}az, {}el, {}alt, {}dB, {}seen".format(
-					a.ident_desc(), "%.1f" % a.distance, "%.1f" % a.az, "%.1f" % a.el,
+
+		print("Now: {} ({} aircraft rejected by the alarm zone pre-filter so far)".format(aircraft.time, zoneIndex.rejected))
+		history.observe(aircraft)
+		display.observe(aircraft)
+		snapshots += 1
+		if history_db is not None and settings.sightings_snapshot_every > 0 \
+				and snapshots % settings.sightings_snapshot_every == 0:
+			history_db.record_snapshot(aircraft)
+
+		with ALARM_SECONDS.time():
+			fired = alarmTracker.update(aircraft)
+		ALARMS_ACTIVE.set(len(alarmTracker))
+		moved = aircraft.delta.moved
+		for zone, a in alarmTracker.inside():
+			if a.hex in moved:
+				distance, az, el = zone.geometry(a)
+				print("{}{}: {}mi, {}az, {}el, {}alt, {}dB, {}seen".format(
+					zone.name + ' ' if zone.name else '',
+					a.ident_desc(), "%.1f" % distance, "%.1f" % az, "%.1f" % el,
 					a.altitude, "%0.1f" % a.rssi, "%.1f" % (a.seen or 0)))
-				if a.hex in alarms:
-					#if it's already in the alarms dict, check to see if we're closer
-					if a.distance < alarms[a.hex][0].distance:
-						#if we're closer than the one already there, then overwrite it
-						alarms[a.hex] = (a, 0)
-				else:
-					#add it to the alarms
-					alarms[a.hex] = (a, 0)
-
-		finishedalarms = []
-		# loop on all the aircraft in the alarms dict
-		for h, a in alarms.items():
-			found = False
-			# check to see if it's in the current set of aircraft
-			for h2, a2 in current.items():
-				if h2 == h:
-					print("{} not yet, dist, elv: {}, {}".format(h, "%.1f" % a[0].distance, "%.1f" % a[0].el))
-					found = True
-					break
-			# if it wasn't in the current set of aircraft, that means it's time to tweet!
-			if not found:
-				if a[1] < abovetustin_wait_x_updates:
-					alarms[h] = (a[0], a[1]+1)
-				else:
-					havescreenshot = False
-					if display != None:
-						print("time to create screenshot of {}:".format(a[0]))
-						hexcode = a[0].hex
-						hexcode = hexcode.replace(" ", "")
-						hexcode = hexcode.replace("~", "")
-						havescreenshot = display.clickOnAirplane(hexcode)
-					if fa_enable:
-						print("Getting FlightAware flight details")
-						faInfo = fa_api.FlightInfo(a[0].flight, fa_username, fa_api_key)
-					else:
-						faInfo = False
-
-					print("time to tweet!!!!!")
-					
-					try:
-						Tweet(a[0], havescreenshot)
-					except Exception:
-						print("exception in Tweet():")
-						traceback.print_exc()
-					finishedalarms.append(a[0].hex)
-		
-		# for each alarm that is finished, delete it from the dictionary
-		for h in finishedalarms:
-			del(alarms[h])
+		for a in alarmTracker.alarms():
+			print("{} not yet ({}), dist, elv: {}, {}".format(a.hex, a.state, "%.1f" % a.closest.distance, "%.1f" % a.closest.el))
+
+		# the alarms that fired are time to tweet!
+		for a in fired:
+			closest = a.closest
+			# the closest sample may be off the true closest approach
+			# by up to a poll interval, so interpolate along its track
+			cpa = history.closest_approach(a.hex, a.zone.latitude, a.zone.longitude)
+			if cpa is not None and cpa.distance < closest.distance:
+				print("interpolated closest approach of {}: {}".format(closest, cpa))
+				closest = cpa.apply(closest)
+			print("{} left the alarm zone, queueing it for tweeting".format(closest))
+			if history_db is not None:
+				history_db.record(closest, a.zone)
+			QueueAlarm(closest, a.enrichment, a.zone)
+		if alarmCheckpoint is not None:
+			alarmCheckpoint.save(alarmTracker)
+
+		interval = scheduler.interval(aircraft, active=len(alarmTracker) > 0)
+		if interval != source.interval:
+			print("polling every {:.1f}s, next aircraft predicted in the alarm zone in {:.0f}s".format(interval, scheduler.soonest))
+			source.set_interval(interval)
 
 		# flush output for following in log file
 		sys.stdout.flush()
+
+	# send what is queued and write the rest of the sighting history once
+	# a replay is over
+	notifier.stop()
+	display.close()
+	dispatcher.stop()
+	if alarmCheckpoint is not None:
+		alarmCheckpoint.save(alarmTracker, force=True)
+	if history_db is not None:
+		history_db.close()
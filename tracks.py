@@ -0,0 +1,179 @@
+#
+# tracks.py
+#
+# Recent positions of each aircraft, and the closest point of approach to
+# a location interpolated between them.
+#
+
+import math
+from array import array
+from datetime import datetime
+
+import geomath
+
+# Miles per degree of latitude.
+MILES_PER_DEGREE = math.radians(geomath.EARTH_RADIUS_MI)
+
+
+class Track(object):
+    '''
+    A fixed-size ring buffer of timestamped positions.  The arrays are
+    allocated once and overwritten in place.
+    '''
+    __slots__ = ('time', 'lat', 'lon', 'alt', 'size', 'next', 'count')
+
+    def __init__(self, size):
+        self.time = array('d', [0.0]) * size
+        self.lat = array('d', [0.0]) * size
+        self.lon = array('d', [0.0]) * size
+        self.alt = array('d', [0.0]) * size
+        self.size = size
+        self.next = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, time, lat, lon, alt):
+        i = self.next
+        self.time[i] = time
+        self.lat[i] = lat
+        self.lon[i] = lon
+        self.alt[i] = alt
+        self.next = (i + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    @property
+    def last_time(self):
+        return self.time[(self.next - 1) % self.size]
+
+    def points(self):
+        '''
+        points()
+        The positions as a list of (time, lat, lon, alt), oldest first.
+        '''
+        start = (self.next - self.count) % self.size
+        indexes = [(start + k) % self.size for k in range(self.count)]
+        return [(self.time[i], self.lat[i], self.lon[i], self.alt[i]) for i in indexes]
+
+
+class ClosestApproach(object):
+    '''
+    The point of a track closest to a location.
+    '''
+    __slots__ = ('time', 'lat', 'lon', 'altitude', 'distance', 'az', 'el')
+
+    def __init__(self, time, lat, lon, altitude, latitude, longitude):
+        self.time = time
+        self.lat = lat
+        self.lon = lon
+        self.altitude = altitude
+        origin = (latitude, longitude)
+        self.distance = geomath.distance(origin, (lat, lon))
+        self.az = geomath.bearing(origin, (lat, lon))
+        self.el = geomath.elevation(self.distance, altitude)
+
+    def __str__(self):
+        return '<{} {} dist={:.3f} el={:.1f}>'.format(
+            self.__class__.__name__,
+            self.time.strftime('%H:%M:%S.%f'),
+            self.distance,
+            self.el)
+
+    def apply(self, a):
+        '''
+        apply()
+        Returns a copy of the aircraft data a with its position, distance
+        and time moved to the closest approach.
+        '''
+        c = a.detach()
+        c.lat = self.lat
+        c.lon = self.lon
+        c.altitude = int(round(self.altitude))
+        c.distance = self.distance
+        c.az = self.az
+        c.el = self.el
+        c.time = self.time
+        return c
+
+
+def closest_approach(points, latitude, longitude):
+    '''
+    closest_approach()
+    Finds the closest approach of a list of (time, lat, lon, alt) points to
+    the location, interpolating linearly between consecutive points.
+    Returns a ClosestApproach, or None if there are no points.
+    '''
+    if not points:
+        return None
+    miles_per_degree_lon = MILES_PER_DEGREE * math.cos(math.radians(latitude))
+
+    def local(p):
+        # flat x/y miles from the location, plenty accurate over a few miles
+        return ((p[2] - longitude) * miles_per_degree_lon, (p[1] - latitude) * MILES_PER_DEGREE)
+
+    best = (math.inf, points[0], points[0], 0.0)
+    x0, y0 = local(points[0])
+    if len(points) == 1:
+        best = (math.hypot(x0, y0), points[0], points[0], 0.0)
+    for p0, p1 in zip(points, points[1:]):
+        x1, y1 = local(p1)
+        dx = x1 - x0
+        dy = y1 - y0
+        length = dx * dx + dy * dy
+        s = 0.0
+        if length > 0:
+            s = max(0.0, min(1.0, -(x0 * dx + y0 * dy) / length))
+        d = math.hypot(x0 + s * dx, y0 + s * dy)
+        if d < best[0]:
+            best = (d, p0, p1, s)
+        x0, y0 = x1, y1
+
+    d, p0, p1, s = best
+    t, lat, lon, alt = [a + s * (b - a) for a, b in zip(p0, p1)]
+    return ClosestApproach(datetime.fromtimestamp(t), lat, lon, alt, latitude, longitude)
+
+
+class TrackHistory(object):
+    '''
+    A Track for every aircraft with a position.  Tracks are dropped once
+    the aircraft hasn't moved for `stale` seconds.
+    '''
+    def __init__(self, size=64, stale=300.0):
+        self.size = size
+        self.stale = stale
+        self.tracks = dict()    # hex -> Track
+
+    def __contains__(self, dhex):
+        return dhex in self.tracks
+
+    def get(self, dhex):
+        return self.tracks.get(dhex)
+
+    def observe(self, snapshot):
+        '''
+        observe()
+        Appends the new position of every aircraft that moved in the
+        snapshot, and drops stale tracks.
+        '''
+        now = snapshot.time.timestamp()
+        for dhex in snapshot.delta.moved:
+            i = snapshot.rows[dhex]
+            lat = snapshot.lat[i]
+            lon = snapshot.lon[i]
+            if lat is None or lon is None:
+                continue
+            track = self.tracks.get(dhex)
+            if track is None:
+                track = self.tracks[dhex] = Track(self.size)
+            # seen_pos is how old the position was when it was reported
+            track.append(now - (snapshot.seen_pos[i] or 0), lat, lon, snapshot.altitude[i] or 0)
+        for dhex in [h for h, t in self.tracks.items() if now - t.last_time > self.stale]:
+            del self.tracks[dhex]
+
+    def closest_approach(self, dhex, latitude, longitude):
+        track = self.tracks.get(dhex)
+        if track is None:
+            return None
+        return closest_approach(track.points(), latitude, longitude)
@@ -1,6 +1,44 @@
 import sys
+import threading
+import time
 
 
 def error(fmt, *args):
     sys.stdout.flush()
     sys.stderr.write((fmt % args) + '\n')
+
+
+class RateLimiter(object):
+    '''
+    A token bucket allowing `rate` calls per second on average, with bursts
+    of up to `burst` calls.  acquire() blocks until a call is allowed.
+    '''
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def try_acquire(self):
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
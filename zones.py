@@ -0,0 +1,313 @@
+#
+# zones.py
+#
+# The alarm zones, a cheap test to throw away aircraft that can't possibly
+# be inside one before doing the exact geometry, and a grid index to find
+# the zones near an aircraft.
+#
+
+import math
+from collections import defaultdict
+
+import geomath
+
+# Miles per degree of latitude (and of longitude at the equator).
+MILES_PER_DEGREE = math.radians(geomath.EARTH_RADIUS_MI)
+
+# The equirectangular approximation is only used to reject aircraft, so it
+# is given some slack to never reject one the exact geometry would accept.
+PREFILTER_MARGIN = 1.05
+
+# Zones are indexed by how far they reach for aircraft up to this altitude
+# in feet; aircraft above it are tested against every zone.
+MAX_ALTITUDE = 60000
+
+
+class AlarmZone(object):
+    '''
+    The alarm zone around a location.  An aircraft is inside the zone when
+    it is closer than distance_alarm miles, or higher than elevation_alarm
+    degrees above the horizon.
+
+    The aircraft's distance, azimuth and elevation are relative to the
+    receiver; when the zone is somewhere else they are computed for it.
+    A zone has a name and optionally its own tweet templates.
+    '''
+    def __init__(self, latitude, longitude, distance_alarm, elevation_alarm,
+                 receiver=None, name='', tweet_template=None, fa_tweet_template=None):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.distance_alarm = distance_alarm
+        self.elevation_alarm = elevation_alarm
+        self.name = name
+        self.tweet_template = tweet_template
+        self.fa_tweet_template = fa_tweet_template
+        # whether the aircraft geometry is already relative to this zone
+        self.local = receiver is None or tuple(receiver) == (latitude, longitude)
+
+        # the elevation cone as a max ground distance per foot of altitude
+        if elevation_alarm <= 0:
+            self.miles_per_foot = math.inf
+        elif elevation_alarm >= 90:
+            self.miles_per_foot = 0.0
+        else:
+            self.miles_per_foot = 1.0 / (geomath.FEET_PER_MILE * math.tan(math.radians(elevation_alarm)))
+        self.miles_per_degree_lon = MILES_PER_DEGREE * math.cos(math.radians(latitude))
+
+        self.checked = 0  # number of aircraft run through the pre-filter
+        self.rejected = 0  # number of those it rejected
+
+    def __str__(self):
+        return '<{} {}{:.4f},{:.4f} dist<{} el>{}>'.format(
+            self.__class__.__name__,
+            self.name + ' ' if self.name else '',
+            self.latitude,
+            self.longitude,
+            self.distance_alarm,
+            self.elevation_alarm)
+
+    def radius(self, altitude):
+        '''
+        radius()
+        The ground distance in miles inside of which an aircraft at the given
+        altitude in feet is in the zone.
+        '''
+        if altitude and altitude > 0:
+            return max(self.distance_alarm, altitude * self.miles_per_foot)
+        return self.distance_alarm
+
+    def could_contain(self, lat, lon, altitude):
+        '''
+        could_contain()
+        Fast, conservative test: False means the aircraft is certainly outside
+        of the zone, True means the exact geometry has to decide.
+        '''
+        r = self.radius(altitude) * PREFILTER_MARGIN
+        dy = (lat - self.latitude) * MILES_PER_DEGREE
+        if dy > r or dy < -r:
+            return False
+        dx = ((lon - self.longitude + 180) % 360 - 180) * self.miles_per_degree_lon
+        if dx > r or dx < -r:
+            return False
+        return dx * dx + dy * dy <= r * r
+
+    def candidates(self, lats, lons, alts):
+        '''
+        candidates()
+        Runs the pre-filter on sequences of positions and returns a list of
+        booleans, True for the aircraft that could be inside the zone.
+        '''
+        self.checked += len(lats)
+        if self.miles_per_foot == math.inf:
+            return [True] * len(lats)
+        if geomath.numpy is None:
+            keep = [self.could_contain(lat, lon, alt) for lat, lon, alt in zip(lats, lons, alts)]
+        else:
+            np = geomath.numpy
+            alts = np.asarray(alts, dtype=float)
+            r = np.maximum(self.distance_alarm, np.maximum(alts, 0) * self.miles_per_foot)
+            r *= PREFILTER_MARGIN
+            dy = (np.asarray(lats, dtype=float) - self.latitude) * MILES_PER_DEGREE
+            dx = ((np.asarray(lons, dtype=float) - self.longitude + 180) % 360 - 180) * self.miles_per_degree_lon
+            keep = (dx * dx + dy * dy <= r * r).tolist()
+        self.rejected += keep.count(False)
+        return keep
+
+    def time_to_entry(self, lat, lon, altitude, track, speed, vert_rate=0):
+        '''
+        time_to_entry()
+        Predicts how many seconds until an aircraft flying a straight line at
+        its current track (degrees), ground speed (mi/h) and vertical rate
+        (ft/min) enters the zone.  Returns 0 if it is already inside, or
+        math.inf if it won't get there.
+        '''
+        altitude = altitude or 0
+        dy = (lat - self.latitude) * MILES_PER_DEGREE
+        dx = ((lon - self.longitude + 180) % 360 - 180) * self.miles_per_degree_lon
+        r = self.radius(altitude)
+        if dx * dx + dy * dy <= r * r:
+            return 0.0
+        if track is None or not speed:
+            return math.inf
+        heading = math.radians(track)
+        vx = speed * math.sin(heading) / 3600.0
+        vy = speed * math.cos(heading) / 3600.0
+
+        # solve |p + v t| = r for the first t > 0, with r following the
+        # altitude the aircraft is predicted to be at by then.
+        a = vx * vx + vy * vy
+        b = 2 * (dx * vx + dy * vy)
+        if b >= 0:
+            # moving away
+            return math.inf
+        t = math.inf
+        for i in range(3):
+            c = dx * dx + dy * dy - r * r
+            disc = b * b - 4 * a * c
+            if disc < 0:
+                # never gets within r, at the altitude it will be at by the
+                # previous estimate either
+                return math.inf
+            t = (-b - math.sqrt(disc)) / (2 * a)
+            r = self.radius(max(0, altitude + (vert_rate or 0) * t / 60.0))
+        return max(t, 0.0)
+
+    def geometry(self, a):
+        '''
+        geometry()
+        The distance, azimuth and elevation of an aircraft from this zone's
+        location.
+        '''
+        if self.local:
+            return a.distance, a.az, a.el
+        origin = (self.latitude, self.longitude)
+        distance = geomath.distance(origin, (a.lat, a.lon))
+        return distance, geomath.bearing(origin, (a.lat, a.lon)), geomath.elevation(distance, a.altitude)
+
+    def locate(self, a):
+        '''
+        locate()
+        A copy of the aircraft data with its distance, azimuth and elevation
+        relative to this zone.
+        '''
+        c = a.detach()
+        if not self.local:
+            c.distance, c.az, c.el = self.geometry(a)
+        return c
+
+    def contains(self, a):
+        '''
+        contains()
+        Exact test on an aircraft.
+        '''
+        if self.local:
+            return a.distance < self.distance_alarm or a.el > self.elevation_alarm
+        if not self.could_contain(a.lat, a.lon, a.altitude):
+            return False
+        distance, az, el = self.geometry(a)
+        return distance < self.distance_alarm or el > self.elevation_alarm
+
+
+class ZoneIndex(object):
+    '''
+    A grid of `cell` degree squares, each listing the zones that reach into
+    it, so an aircraft is only tested against the zones near it.  It stands
+    in for a single AlarmZone as the pre-filter of the FlightData and for
+    the PollScheduler.  Only entries into the zones within `horizon`
+    seconds are predicted.
+    '''
+    def __init__(self, zones, cell=0.25, horizon=120.0):
+        self.zones = list(zones)
+        self.cell = cell
+        self.horizon = horizon
+        self.columns = max(1, int(round(360.0 / cell)))
+        self.cells = defaultdict(list)  # (row, column) -> zones
+        self.everywhere = []    # zones with no elevation limit, they reach anywhere
+        self.reach = 0.0        # miles, the furthest any indexed zone reaches
+        for zone in self.zones:
+            if zone.miles_per_foot == math.inf:
+                self.everywhere.append(zone)
+                continue
+            reach = zone.radius(MAX_ALTITUDE) * PREFILTER_MARGIN
+            self.reach = max(self.reach, reach)
+            for key in self.keys(zone.latitude, zone.longitude, reach):
+                self.cells[key].append(zone)
+        self.checked = 0
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self.zones)
+
+    def __iter__(self):
+        return iter(self.zones)
+
+    def key(self, lat, lon):
+        return (int(math.floor(lat / self.cell)),
+                int(math.floor(((lon + 180) % 360) / self.cell)) % self.columns)
+
+    def keys(self, lat, lon, miles):
+        '''
+        keys()
+        The cells within miles of a location.
+        '''
+        dlat = miles / MILES_PER_DEGREE
+        dlon = min(180.0, miles / max(MILES_PER_DEGREE * math.cos(math.radians(min(abs(lat) + dlat, 89.9))), 1e-9))
+        row0, col0 = self.key(lat - dlat, lon - dlon)
+        row1 = self.key(lat + dlat, lon)[0]
+        columns = min(self.columns, int(math.ceil(2 * dlon / self.cell)) + 1)
+        return [(row, (col0 + i) % self.columns)
+                for row in range(row0, row1 + 1) for i in range(columns)]
+
+    def nearby(self, lat, lon, altitude):
+        '''
+        nearby()
+        The zones whose pre-filter lets the aircraft through.
+        '''
+        if altitude and altitude > MAX_ALTITUDE:
+            zones = self.zones
+        else:
+            zones = self.cells.get(self.key(lat, lon), ())
+            if self.everywhere:
+                zones = list(zones) + self.everywhere
+        return [zone for zone in zones if zone.could_contain(lat, lon, altitude)]
+
+    def candidates(self, lats, lons, alts):
+        '''
+        candidates()
+        The pre-filter: a list of booleans, True for the aircraft that could
+        be inside any zone.
+        '''
+        if len(self.zones) == 1:
+            keep = self.zones[0].candidates(lats, lons, alts)
+        else:
+            keep = [bool(self.nearby(lat, lon, alt)) for lat, lon, alt in zip(lats, lons, alts)]
+        self.checked += len(lats)
+        self.rejected += keep.count(False)
+        return keep
+
+    def time_to_entry(self, lat, lon, altitude, track, speed, vert_rate=0):
+        '''
+        time_to_entry()
+        Predicts how many seconds until the aircraft enters any zone, or
+        math.inf if it won't within the horizon.
+        '''
+        if len(self.zones) == 1:
+            return self.zones[0].time_to_entry(lat, lon, altitude, track, speed, vert_rate)
+        miles = self.reach + (speed or 0) * self.horizon / 3600.0
+        zones = set(self.everywhere)
+        for key in self.keys(lat, lon, miles):
+            zones.update(self.cells.get(key, ()))
+        soonest = math.inf
+        for zone in zones:
+            t = zone.time_to_entry(lat, lon, altitude, track, speed, vert_rate)
+            if t < soonest:
+                soonest = t
+        return soonest if soonest <= self.horizon else math.inf
+
+
+def from_config(parser, receiver, distance_alarm, elevation_alarm):
+    '''
+    from_config()
+    The zones of the [zone:<name>] sections of the configuration, each with
+    a latitude, longitude, distance_alarm, elevation_alarm, and optionally
+    tweet_template and fa_tweet_template.  The location defaults to the
+    receiver and the alarms to the given ones.  Without any, the one zone
+    around the receiver.
+    '''
+    zones = []
+    for section in parser.sections():
+        if not section.startswith('zone:'):
+            continue
+        options = parser[section]
+        zones.append(AlarmZone(
+            options.getfloat('latitude', receiver[0]),
+            options.getfloat('longitude', receiver[1]),
+            options.getfloat('distance_alarm', distance_alarm),
+            options.getfloat('elevation_alarm', elevation_alarm),
+            receiver=receiver,
+            name=section[len('zone:'):].strip(),
+            tweet_template=options.get('tweet_template'),
+            fa_tweet_template=options.get('fa_tweet_template')))
+    if not zones:
+        zones.append(AlarmZone(receiver[0], receiver[1], distance_alarm, elevation_alarm, receiver=receiver))
+    return zones